@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+""" Write files atomically: readers see the old or the new content, never a partial file"""
+
+from __future__ import print_function
+import os
+import json
+import uuid
+
+
+def replace_file(source, target):
+    """ rename source to target, replacing target atomically (os.replace on python 3,
+        os.rename on python 2, which only replaces an existing file on posix)"""
+    if hasattr(os, 'replace'):
+        os.replace(source, target)
+    else:
+        if os.name == 'nt' and os.path.exists(target):
+            os.remove(target)
+        os.rename(source, target)
+
+
+def save_json(content, filename, indent=None):
+    """ write a json file through a temporary file of the same folder (unique, so
+        several processes can save the same file) renamed over filename"""
+    temp_file = filename + '.' + uuid.uuid4().hex + '.tmp'
+    try:
+        with open(temp_file, 'w') as json_file:
+            json.dump(content, json_file, indent=indent)
+        replace_file(temp_file, filename)
+    except BaseException:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        raise
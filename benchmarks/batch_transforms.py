@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+""" Benchmark: transforms applied image by image vs by vectorized batches
+    usage: python benchmarks/batch_transforms.py [images_nbr] [batch_size]"""
+
+from __future__ import print_function
+import os
+import sys
+import time
+import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from dataset_builder import DatasetBuilder
+from image_backend import get_backend
+from transforms import Resize, CenterCrop, Grayscale, Normalize
+
+
+def per_image(images, transforms):
+    """ the per-file path: each image goes through the transforms separately
+        (resized by the image backend, see image_backend.py)"""
+    results = []
+    for image in images:
+        for transform in transforms:
+            image = transform(image)
+        results.append(image)
+    return results
+
+
+def measure(function, *args):
+    """ run the function once and return its duration in seconds"""
+    start = time.time()
+    function(*args)
+    return time.time() - start
+
+
+def main(images_nbr=512, batch_size=64):
+    backend = get_backend(DatasetBuilder.image_backend)
+    print("image backend: ", backend.name)
+    print("images  size      per image (img/s)   batch (img/s)   speedup")
+    for size in (64, 128, 256):
+        images = [np.random.randint(0, 256, (size + 32, size + 32, 3)).astype(np.uint8)
+                  for _ in range(images_nbr)]
+        transforms = [Resize(size, size), CenterCrop(size - 8, size - 8), Grayscale(),
+                      Normalize()]
+        single_time = measure(per_image, images, transforms)
+        batch_time = 0
+        for start in range(0, images_nbr, batch_size):
+            batch_time += measure(DatasetBuilder.transform_batch,
+                                  images[start:start + batch_size], transforms)
+        print("%6d  %3dx%-3d   %17.1f   %13.1f   %6.1fx" % (
+            images_nbr, size, size, images_nbr / single_time, images_nbr / batch_time,
+            single_time / batch_time))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+""" Offline fixtures of the benchmarks: fake search engines, a local HTTP server serving
+    synthetic images, and synthetic image trees"""
+
+from __future__ import print_function
+import os
+import sys
+import time
+import zlib
+import struct
+import threading
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from search_engines import FakeEngine, register_engine
+
+
+@register_engine
+class FakeGoogleEngine(FakeEngine):
+    """ Fake engine with the pages and limits of Google Custom Search
+        (key: link template, secret: latency of each page in seconds)"""
+
+    name = 'fake_google'
+    items_per_page = 10
+    max_results = 100
+
+
+@register_engine
+class FakeFlickrEngine(FakeEngine):
+    """ Fake engine with the pages and limits of Flickr search
+        (key: link template, secret: latency of each page in seconds)"""
+
+    name = 'fake_flickr'
+    items_per_page = 200
+    max_results = 4000
+
+
+def synthetic_png(width, height, seed=0):
+    """ encode a width x height RGB gradient (with some noise, so it does not compress
+        too much) as PNG bytes, without any image library"""
+    rows = []
+    for y in range(height):
+        row = bytearray(width * 3)
+        for x in range(width):
+            noise = (x * 7919 + y * 104729 + seed * 31) % 61
+            row[3 * x] = (x * 255 // max(1, width - 1) + noise) % 256
+            row[3 * x + 1] = (y * 255 // max(1, height - 1) + noise) % 256
+            row[3 * x + 2] = (seed * 37 + noise * 3) % 256
+        rows.append(b'\x00' + bytes(row))
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + \
+               struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + \
+           chunk(b'IDAT', zlib.compress(b''.join(rows), 6)) + chunk(b'IEND', b'')
+
+
+def make_image_tree(folder, keywords=('cats', 'dogs'), images_per_keyword=100,
+                    width=256, height=256, variants=8):
+    """ write folder/keyword/0.png, 1.png... (variants different images, repeated).
+        Return the total number of bytes written"""
+    images = [synthetic_png(width, height, seed) for seed in range(variants)]
+    total = 0
+    for keyword in keywords:
+        keyword_folder = os.path.join(folder, keyword)
+        if not os.path.exists(keyword_folder):
+            os.makedirs(keyword_folder)
+        for index in range(images_per_keyword):
+            data = images[index % variants]
+            with open(os.path.join(keyword_folder, str(index) + '.png'), 'wb') as image_file:
+                image_file.write(data)
+            total += len(data)
+    return total
+
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    """ HTTP server handling each connection in a thread"""
+    daemon_threads = True
+    request_queue_size = 256
+
+
+class ImageServer(object):
+    """ Local HTTP server answering every GET with the same synthetic PNG image
+        (keep-alive, latency in seconds before each response). The path of the request
+        is appended after the end of the image, so each link has a different content
+        (as on the web) and is not deduplicated by the blob store of ImagesDownloader.
+        max_active: maximum number of requests waiting for their response at the same time"""
+
+    def __init__(self, width=256, height=256, latency=0.0):
+        self.image = synthetic_png(width, height)
+        self.latency = latency
+        self.requests = 0
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                with server.lock:
+                    server.requests += 1
+                    server.active += 1
+                    server.max_active = max(server.max_active, server.active)
+                if server.latency:
+                    time.sleep(server.latency)
+                with server.lock:  # before the response: the client cannot send its next request yet
+                    server.active -= 1
+                body = server.image + self.path.encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'image/png')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.http_server = ThreadingServer(('127.0.0.1', 0), Handler)
+        self.port = self.http_server.server_address[1]
+        self.thread = threading.Thread(target=self.http_server.serve_forever)
+        self.thread.daemon = True
+
+    @property
+    def link_template(self):
+        """ link template for the fake engines"""
+        return 'http://127.0.0.1:' + str(self.port) + '/{keyword}/{index}.png'
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.http_server.shutdown()
+        self.http_server.server_close()
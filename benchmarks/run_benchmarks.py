@@ -0,0 +1,296 @@
+#!/usr/bin/env python
+""" Offline benchmark suite of the crawl, download and dataset building paths.
+    Each case runs in its own python process (so its peak memory is measured alone),
+    against fake search engines, a local image server and synthetic image trees.
+    The results are saved as json in benchmarks/results/ and can be compared with a
+    previous run to detect regressions:
+        python benchmarks/run_benchmarks.py --label before
+        python benchmarks/run_benchmarks.py --label after --compare benchmarks/results/before.json
+    Other options: --cases crawl,download,reshape_images --quick (see --help)"""
+
+from __future__ import print_function
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+BENCHMARKS_FOLDER = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS_FOLDER, '..'))
+sys.path.insert(0, BENCHMARKS_FOLDER)
+
+DEFAULT_CONFIG = {'keywords': 4,            # number of keywords (and of folders)
+                  'links': 1000,            # links collected per keyword and engine
+                  'page_latency': 0.01,     # latency of the fake search engines (s)
+                  'images': 200,            # images per keyword (download and dataset)
+                  'size': 256,              # width and height of the synthetic images
+                  'latency': 0.005,         # latency of the image server (s)
+                  'threads': 16,            # download / crawl threads
+                  'workers': 1}             # DatasetBuilder worker processes
+QUICK_CONFIG = {'keywords': 2, 'links': 200, 'images': 30, 'size': 128}
+EXTENSIONS = ('.png',)
+
+
+def timed(function, *args, **kwargs):
+    """ run the function and return its duration in seconds"""
+    start = time.time()
+    function(*args, **kwargs)
+    return time.time() - start
+
+
+def folder_stats(folder):
+    """ number of files and total size of a folder (recursively)"""
+    files, size = 0, 0
+    for root, _, filenames in os.walk(folder):
+        for filename in filenames:
+            files += 1
+            size += os.path.getsize(os.path.join(root, filename))
+    return files, size
+
+
+def keywords_list(config):
+    return ['keyword' + str(i) for i in range(config['keywords'])]
+
+
+def bench_crawl(config, workdir):
+    """ WebCrawler.collect_links_from_web with fake Google and Flickr engines"""
+    import fixtures  # registers the fake engines
+    from web_crawler import WebCrawler
+    template = 'http://127.0.0.1:1/{keyword}/{index}.png'
+    crawler = WebCrawler({'fake_google': (template, config['page_latency']),
+                          'fake_flickr': (template, config['page_latency'])})
+    seconds = timed(crawler.collect_links_from_web, keywords_list(config), config['links'],
+                    threads=config['threads'])
+    links = sum(len(links) for links in crawler.images_links.values())
+    return {'seconds': seconds, 'links': links}
+
+
+def bench_download(config, workdir):
+    """ ImagesDownloader.download from the local image server"""
+    from fixtures import ImageServer
+    from images_downloader import ImagesDownloader
+    server = ImageServer(config['size'], config['size'], config['latency']).start()
+    links = dict((keyword, [server.link_template.format(keyword=keyword, index=index)
+                            for index in range(config['images'])])
+                 for keyword in keywords_list(config))
+    target = os.path.join(workdir, 'download')
+    try:
+        seconds = timed(ImagesDownloader().download, links, target, threads=config['threads'],
+                        max_per_host=config['threads'], resume=False)
+    finally:
+        server.stop()
+    images, size = 0, 0
+    for keyword in links:
+        files, keyword_size = folder_stats(os.path.join(target, keyword))
+        images += files
+        size += keyword_size
+    return {'seconds': seconds, 'images': images, 'bytes': size}
+
+
+def dataset_operations(config):
+    """ DatasetBuilder operations benchmarked: name -> function(source, target)"""
+    from dataset_builder import DatasetBuilder
+    from transforms import Resize, Grayscale, Format
+    workers = config['workers']
+    return {
+        'reshape_images': lambda source, target: DatasetBuilder.reshape_images(
+            source, target, 64, 64, extensions=EXTENSIONS, workers=workers),
+        'crop_images': lambda source, target: DatasetBuilder.crop_images(
+            source, target, 64, 64, extensions=EXTENSIONS, workers=workers),
+        'convert_to_grayscale': lambda source, target: DatasetBuilder.convert_to_grayscale(
+            source, target, extensions=EXTENSIONS, workers=workers),
+        'convert_format': lambda source, target: DatasetBuilder.convert_format(
+            source, target, extensions=EXTENSIONS, new_extension='.jpg', workers=workers),
+        'rename_files': lambda source, target: DatasetBuilder.rename_files(
+            source, target, extensions=EXTENSIONS),
+        'merge_folders': lambda source, target: DatasetBuilder.merge_folders(
+            source, target, extensions=EXTENSIONS),
+        'pipeline': lambda source, target: DatasetBuilder.pipeline(
+            source, target, [Resize(64, 64), Grayscale(), Format('.jpg')],
+            extensions=EXTENSIONS, workers=workers),
+        'convert_to_single_file': lambda source, target: DatasetBuilder.convert_to_single_file(
+            source, target, create_labels_file=True, extensions=EXTENSIONS),
+        'convert_to_shards': lambda source, target: DatasetBuilder.convert_to_shards(
+            source, target, shard_size=1000, extensions=EXTENSIONS),
+    }
+
+
+DATASET_CASES = ['reshape_images', 'crop_images', 'convert_to_grayscale', 'convert_format',
+                 'rename_files', 'merge_folders', 'pipeline', 'convert_to_single_file',
+                 'convert_to_shards']
+CASES = ['crawl', 'download'] + DATASET_CASES
+
+
+def bench_dataset(name, config, workdir):
+    """ a DatasetBuilder operation on a synthetic image tree"""
+    from fixtures import make_image_tree
+    source = os.path.join(workdir, 'source')
+    size = make_image_tree(source, keywords_list(config), config['images'],
+                           config['size'], config['size'])
+    operation = dataset_operations(config)[name]
+    seconds = timed(operation, source, os.path.join(workdir, 'target'))
+    return {'seconds': seconds, 'images': config['keywords'] * config['images'],
+            'bytes': size}
+
+
+def peak_rss_mb():
+    """ peak resident memory of this process (and of its finished children) in MB"""
+    try:
+        import resource
+    except ImportError:  # not available on Windows
+        return None
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    if sys.platform == 'darwin':  # bytes on macOS, kilobytes on linux
+        return peak / (1024.0 * 1024.0)
+    return peak / 1024.0
+
+
+def run_case(name, config):
+    """ run one case in this process, return its measures"""
+    workdir = tempfile.mkdtemp(prefix='bench_')
+    stdout = sys.stdout
+    sys.stdout = tempfile.TemporaryFile('w+')  # hide the progress messages
+    try:
+        if name == 'crawl':
+            result = bench_crawl(config, workdir)
+        elif name == 'download':
+            result = bench_download(config, workdir)
+        else:
+            result = bench_dataset(name, config, workdir)
+    except BaseException:  # show the messages, they explain errors reported with exit()
+        sys.stdout.seek(0)
+        stdout.write(sys.stdout.read()[-2000:])
+        raise
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+        shutil.rmtree(workdir, ignore_errors=True)
+    seconds = max(result['seconds'], 1e-9)
+    if 'links' in result:
+        result['links_per_s'] = result['links'] / seconds
+    if 'images' in result:
+        result['images_per_s'] = result['images'] / seconds
+    if 'bytes' in result:
+        result['mb_per_s'] = result['bytes'] / seconds / (1024.0 * 1024.0)
+    result['peak_rss_mb'] = peak_rss_mb()
+    return result
+
+
+def run_case_process(name, config):
+    """ run one case in a new python process, return its measures (or an error)"""
+    with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as output:
+        output_file = output.name
+    try:
+        process = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--child', name,
+                                    '--config', json.dumps(config), '--output', output_file],
+                                   stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        log = process.communicate()[0].decode('utf-8', 'replace')
+        if process.returncode != 0 or not os.path.getsize(output_file):
+            return {'error': log.strip().splitlines()[-1] if log.strip() else 'failed'}
+        with open(output_file) as json_file:
+            return json.load(json_file)
+    finally:
+        os.remove(output_file)
+
+
+def main_metric(result):
+    """ name and value of the throughput used to compare two runs"""
+    for metric in ('links_per_s', 'images_per_s'):
+        if metric in result:
+            return metric, result[metric]
+    return None, None
+
+
+def git_commit():
+    """ current commit of the repository (None if unknown)"""
+    try:
+        output = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                         cwd=BENCHMARKS_FOLDER, stderr=subprocess.STDOUT)
+        return output.decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_result(name, result, previous=None):
+    """ print one line of the results table"""
+    if 'error' in result:
+        print("%-24s error: %s" % (name, result['error']))
+        return
+    metric, value = main_metric(result)
+    line = "%-24s %10.1f %-12s %9s MB/s %9s MB RSS" % (
+        name, value, metric.replace('_per_s', '/s'),
+        '%.1f' % result['mb_per_s'] if 'mb_per_s' in result else '-',
+        '%.0f' % result['peak_rss_mb'] if result['peak_rss_mb'] is not None else '?')
+    if previous is not None and 'error' not in previous:
+        _, previous_value = main_metric(previous)
+        if previous_value:
+            line += "   %+6.1f%% vs %.1f" % ((value / previous_value - 1) * 100,
+                                              previous_value)
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the crawler, "
+                                                 "the downloader and the dataset builder")
+    parser.add_argument('--cases', default=','.join(CASES),
+                        help="comma separated cases (default: all): " + ', '.join(CASES))
+    parser.add_argument('--quick', action='store_true', help="small sizes, for a quick check")
+    parser.add_argument('--label', default=None, help="name of the results file")
+    parser.add_argument('--compare', default=None, help="previous results file to compare with")
+    for key, value in sorted(DEFAULT_CONFIG.items()):
+        parser.add_argument('--' + key.replace('_', '-'), type=type(value), default=None,
+                            help="default: " + str(value))
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--config', help=argparse.SUPPRESS)
+    parser.add_argument('--output', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # child process: run a single case and write its measures
+    if args.child:
+        result = run_case(args.child, json.loads(args.config))
+        with open(args.output, 'w') as json_file:
+            json.dump(result, json_file)
+        return
+
+    config = dict(DEFAULT_CONFIG)
+    if args.quick:
+        config.update(QUICK_CONFIG)
+    for key in DEFAULT_CONFIG:
+        if getattr(args, key) is not None:
+            config[key] = getattr(args, key)
+    cases = [case.strip() for case in args.cases.split(',') if case.strip()]
+    for case in cases:
+        if case not in CASES:
+            print("Error: unknown case '" + case + "' (cases: " + ', '.join(CASES) + ")")
+            exit()
+    previous = {}
+    if args.compare:
+        with open(args.compare) as json_file:
+            previous = json.load(json_file)['results']
+
+    print("Benchmarks (", ', '.join(key + '=' + str(value)
+                                    for key, value in sorted(config.items())), ")")
+    results = {}
+    for case in cases:
+        results[case] = run_case_process(case, config)
+        print_result(case, results[case], previous.get(case))
+
+    results_folder = os.path.join(BENCHMARKS_FOLDER, 'results')
+    if not os.path.exists(results_folder):
+        os.makedirs(results_folder)
+    label = args.label or time.strftime('%Y%m%d-%H%M%S')
+    filename = os.path.join(results_folder, label + '.json')
+    with open(filename, 'w') as json_file:
+        json.dump({'label': label, 'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+                   'commit': git_commit(), 'python': platform.python_version(),
+                   'platform': platform.platform(), 'config': config,
+                   'results': results}, json_file, indent=1, sort_keys=True)
+    print(" > Results saved to: ", filename)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+""" Benchmark: cold start time of the modules (e.g. of a download worker), each module is
+    imported in a new python process, and the heavy libraries it loads are listed
+    usage: python benchmarks/startup.py [runs]"""
+
+from __future__ import print_function
+import os
+import sys
+import json
+import subprocess
+
+PACKAGE_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+MODULES = ['work_queue', 'images_downloader', 'web_crawler', 'dataset_builder', 'transforms',
+           'stream_pipeline', 'metrics', 'dataset_reader']
+HEAVY_LIBRARIES = ['numpy', 'scipy', 'PIL', 'googleapiclient', 'flickrapi', 'multiprocessing']
+
+# run in the child process: import the module and report the time and the libraries loaded
+IMPORT_SCRIPT = """
+import json, sys, time
+start = time.time()
+import %s
+duration = time.time() - start
+print(json.dumps({'seconds': duration,
+                  'libraries': [name for name in %r if name in sys.modules]}))
+"""
+
+
+def import_time(module, runs=5):
+    """ median import time (in seconds) of the module in a new process,
+        and the heavy libraries it loads"""
+    durations = []
+    libraries = []
+    for _ in range(runs):
+        output = subprocess.check_output([sys.executable, '-c',
+                                          IMPORT_SCRIPT % (module, HEAVY_LIBRARIES)],
+                                         cwd=PACKAGE_FOLDER)
+        result = json.loads(output.decode('utf-8').strip().splitlines()[-1])
+        durations.append(result['seconds'])
+        libraries = result['libraries']
+    return sorted(durations)[len(durations) // 2], libraries
+
+
+def main(runs=5):
+    print("module               import (ms)   heavy libraries loaded")
+    for module in MODULES:
+        try:
+            seconds, libraries = import_time(module, runs)
+        except subprocess.CalledProcessError:
+            print("%-20s        failed   (missing dependency)" % module)
+            continue
+        print("%-20s %12.1f   %s" % (module, seconds * 1000, ', '.join(libraries) or '-'))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
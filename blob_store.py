@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+""" BlobStore: store each downloaded image once, under the hash of its content"""
+
+from __future__ import print_function
+import os
+import uuid
+import sqlite3
+import threading
+from shutil import copy2
+
+
+class BlobStore(object):
+    """ Content-addressed store of the images: each image is saved once as
+        <folder>/<2 first characters of its sha1>/<sha1><extension>, and the keyword
+        folders hold hard links to the stored images (copies if the filesystem does
+        not support hard links). A SQLite index records the sha1 of each downloaded
+        URL, so a URL already downloaded (for another keyword, in a previous run or
+        in another target folder sharing the store) is never downloaded again, and
+        the same image found under several URLs is stored once"""
+
+    filename = 'blobs.db'
+
+    def __init__(self, folder):
+        if folder[-1] == '/':
+            folder = folder[:-1]
+        self.folder = folder
+        if not os.path.exists(folder + '/tmp'):
+            os.makedirs(folder + '/tmp')
+        self.lock = threading.Lock()
+        self.reused = 0  # URLs found in the index (not downloaded)
+        self.deduplicated = 0  # downloaded images that were already stored
+        self.connection = sqlite3.connect(os.path.join(folder, self.filename), timeout=60,
+                                          check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS urls ("
+                                "url TEXT PRIMARY KEY, checksum TEXT, extension TEXT, "
+                                "bytes INTEGER)")
+        self.connection.commit()
+
+    def blob_path(self, checksum, extension):
+        """ path of the stored image of a checksum"""
+        return self.folder + '/' + checksum[:2] + '/' + checksum + extension
+
+    def temporary_file(self):
+        """ unique name of a file being downloaded (without extension), in the store
+            folder so it can be moved into the store without copy"""
+        return self.folder + '/tmp/' + uuid.uuid4().hex
+
+    def lookup(self, url):
+        """ (checksum, nbytes, path of the stored image) of a URL downloaded before,
+            None if the URL is unknown or its image was deleted from the store"""
+        with self.lock:
+            row = self.connection.execute("SELECT checksum, extension, bytes FROM urls "
+                                          "WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            return None
+        blob_file = self.blob_path(row[0], row[1])
+        if not os.path.isfile(blob_file):
+            return None
+        with self.lock:
+            self.reused += 1
+        return row[0], row[2], blob_file
+
+    def add(self, temp_file, checksum, extension, url, nbytes):
+        """ move a downloaded file (temp_file) into the store, unless the same image is
+            already stored, and record its URL. Return the path of the stored image"""
+        blob_file = self.blob_path(checksum, extension)
+        if os.path.isfile(blob_file):
+            os.remove(temp_file)
+            with self.lock:
+                self.deduplicated += 1
+        else:
+            if not os.path.exists(os.path.dirname(blob_file)):
+                try:
+                    os.makedirs(os.path.dirname(blob_file))
+                except OSError:  # created by another thread
+                    pass
+            try:
+                os.rename(temp_file, blob_file)
+            except OSError:  # stored by another thread meanwhile (windows)
+                os.remove(temp_file)
+        self.record(url, checksum, extension, nbytes)
+        return blob_file
+
+    def record(self, url, checksum, extension, nbytes):
+        """ record the checksum of a URL, committed at once: the write lock of the
+            index is only held during the update, so several downloads (threads or
+            processes) can share the store. If the index stays locked, the URL is
+            only downloaded again next time"""
+        with self.lock:
+            try:
+                self.connection.execute("INSERT OR REPLACE INTO urls VALUES (?, ?, ?, ?)",
+                                        (url, checksum, extension, nbytes))
+                self.connection.commit()
+            except sqlite3.OperationalError as error:
+                self.connection.rollback()
+                print("\n >> Blob store index not updated: ", error)
+
+    @staticmethod
+    def link(blob_file, folder):
+        """ hard link (or copy) a stored image into a folder, under the same name.
+            Return the path of the link"""
+        target_file = folder + '/' + os.path.basename(blob_file)
+        if not os.path.exists(target_file):
+            try:
+                os.link(blob_file, target_file)
+            except (OSError, AttributeError):  # no hard links (filesystem, python 2 on windows)
+                if not os.path.exists(target_file):
+                    copy2(blob_file, target_file)
+        return target_file
+
+    def close(self):
+        """ close the database"""
+        with self.lock:
+            self.connection.close()
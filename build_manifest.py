@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+""" BuildManifest: remember what was built in a target folder to only rebuild what changed"""
+
+from __future__ import print_function
+import os
+import json
+from atomic_file import save_json
+
+
+class BuildManifest(object):
+    """ For each operation run on a target folder (e.g. 'reshape_file'), record the
+        parameters and, for each source file, its modification time and size and the
+        output file built from it. The next runs then only process the new or modified
+        source files, and remove the outputs of the deleted ones.
+        The manifest is saved as build_manifest.json in the target folder"""
+
+    filename = 'build_manifest.json'
+
+    def __init__(self, target_folder):
+        self.path = os.path.join(target_folder, self.filename)
+        self.operations = {}
+        self.removed = 0
+        if os.path.isfile(self.path):
+            with open(self.path) as json_file:
+                self.operations = json.load(json_file)
+
+    @staticmethod
+    def signature(source_file):
+        """ modification time and size of a file"""
+        stat = os.stat(source_file)
+        return [stat.st_mtime, stat.st_size]
+
+    @staticmethod
+    def params_key(params):
+        """ comparable representation of the parameters of an operation"""
+        return repr(sorted(params.items())) if params else ''
+
+    def entries(self, operation, params=None):
+        """ {source_file: {'signature': ..., 'output': ...}} of an operation.
+            If the parameters changed, every source file has to be processed again"""
+        key = self.params_key(params)
+        state = self.operations.setdefault(operation, {'params': key, 'files': {}})
+        if state['params'] != key:
+            state['params'] = key
+            for entry in state['files'].values():
+                entry['signature'] = None
+        return state['files']
+
+    def update(self, jobs, operation, params=None, source_folder=None):
+        """ compare the (source_file, output_file) jobs with the manifest and return the
+            jobs to run (new, modified or missing outputs). The outputs of the source
+            files that are not in the jobs anymore are removed.
+            source_folder: only remove the outputs of the deleted files of this folder
+            (several source folders may be built into the same target folder)"""
+        files = self.entries(operation, params)
+        sources = set()
+        todo = []
+        for source_file, output_file in jobs:
+            sources.add(source_file)
+            entry = files.get(source_file)
+            if entry is not None and entry['output'] != output_file:
+                self.remove_output(entry['output'])
+                entry = None
+            if entry is None or entry['signature'] != self.signature(source_file) or \
+               (output_file is not None and not os.path.exists(output_file)):
+                todo.append((source_file, output_file))
+        for source_file in [source for source in files if source not in sources and
+                            self.in_folder(source, source_folder)]:
+            self.remove_output(files.pop(source_file)['output'])
+        return todo
+
+    @staticmethod
+    def in_folder(source_file, source_folder):
+        """ True if source_file is in source_folder (or if source_folder is None)"""
+        if source_folder is None:
+            return True
+        folder = os.path.abspath(source_folder)
+        return os.path.abspath(source_file).startswith(folder.rstrip(os.sep) + os.sep)
+
+    def record(self, jobs, operation):
+        """ record the (source_file, output_file) jobs that were processed"""
+        files = self.operations[operation]['files']
+        for source_file, output_file in jobs:
+            files[source_file] = {'signature': self.signature(source_file),
+                                  'output': output_file}
+
+    def reset(self, operation):
+        """ forget an operation (its outputs are kept)"""
+        self.operations.pop(operation, None)
+
+    def remove_output(self, output_file):
+        """ delete the output of a deleted (or renamed) source file"""
+        if output_file is not None and os.path.isfile(output_file):
+            os.remove(output_file)
+        self.removed += 1
+
+    def save(self):
+        """ write the manifest atomically (through a temporary file)"""
+        save_json(self.operations, self.path)
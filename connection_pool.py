@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+""" ConnectionPool: reuse keep-alive HTTP(S) connections between downloads"""
+
+from __future__ import print_function
+import socket
+import threading
+import time
+try:
+    import httplib
+except ImportError:
+    import http.client as httplib
+try:
+    from urlparse import urlparse, urljoin
+    from urllib import quote
+except ImportError:
+    from urllib.parse import urlparse, urljoin, quote
+
+
+class HTTPError(IOError):
+    """ Response with an error status (retry_after: delay asked by the server, in seconds)"""
+
+    def __init__(self, status, url, retry_after=None):
+        IOError.__init__(self, "HTTP error " + str(status) + ": " + url)
+        self.status = status
+        self.url = url
+        self.retry_after = retry_after
+
+
+class PooledResponse(object):
+    """ HTTP response that gives its connection back to the pool once fully read"""
+
+    def __init__(self, pool, key, connection, response, url):
+        self.pool = pool
+        self.key = key
+        self.connection = connection
+        self.response = response
+        self.url = url
+        self.status = response.status
+        self.complete = False
+
+    def getheader(self, name, default=None):
+        """ return the value of a response header"""
+        return self.response.getheader(name, default)
+
+    def read(self, amt=None):
+        """ read (part of) the response body"""
+        try:
+            data = self.response.read(amt) if amt else self.response.read()
+        except httplib.HTTPException as error:  # e.g. connection closed before the end
+            raise IOError("read failed: " + repr(error))
+        if not data or amt is None:
+            self.complete = True
+        return data
+
+    def close(self):
+        """ return the connection to the pool if it can be reused, close it otherwise"""
+        if self.connection is None:
+            return
+        if self.complete and not self.response.will_close:
+            self.pool.release(self.key, self.connection)
+        else:
+            self.connection.close()
+        self.connection = None
+
+
+class ConnectionPool(object):
+    """ Keep idle keep-alive connections per host and reuse them for the next requests
+        pool_size: maximum number of idle connections kept for each host
+        idle_timeout: idle connections older than this (in seconds) are closed
+        connect_timeout: maximum time to open a connection (in seconds)
+        read_timeout: maximum time waiting for data from the server (in seconds)"""
+
+    redirect_codes = (301, 302, 303, 307, 308)
+    headers = {'User-Agent': 'images-web-crawler', 'Connection': 'keep-alive'}
+
+    def __init__(self, pool_size=4, idle_timeout=30, connect_timeout=10, read_timeout=30):
+        self.pool_size = max(1, pool_size)
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.idle_connections = {}
+        self.lock = threading.Lock()
+        self.new_connections = 0
+        self.reused_connections = 0
+
+    def get_connection(self, key):
+        """ get an idle connection to the host, or create a new one"""
+        now = time.time()
+        with self.lock:
+            idle = self.idle_connections.get(key, [])
+            while idle:
+                connection, last_used = idle.pop()
+                if now - last_used <= self.idle_timeout:
+                    self.reused_connections += 1
+                    return connection, True
+                connection.close()
+            self.new_connections += 1
+        scheme, netloc = key
+        connection = None
+        try:  # invalid hosts or ports (httplib.InvalidURL) fail like unreachable hosts
+            if scheme == 'https':
+                connection = httplib.HTTPSConnection(netloc, timeout=self.connect_timeout)
+            else:
+                connection = httplib.HTTPConnection(netloc, timeout=self.connect_timeout)
+            connection.connect()
+        except (httplib.HTTPException, IOError, UnicodeError) as error:
+            if connection is not None:
+                connection.close()
+            raise IOError("connection failed: " + str(error))
+        connection.sock.settimeout(self.read_timeout)
+        return connection, False
+
+    def release(self, key, connection):
+        """ put a connection back in the pool"""
+        with self.lock:
+            idle = self.idle_connections.setdefault(key, [])
+            if len(idle) < self.pool_size:
+                idle.append((connection, time.time()))
+                return
+        connection.close()
+
+    def close(self):
+        """ close all idle connections"""
+        with self.lock:
+            for idle in self.idle_connections.values():
+                for connection, _ in idle:
+                    connection.close()
+            self.idle_connections = {}
+
+    def stats(self):
+        """ return the number of new and reused connections"""
+        return {'new_connections': self.new_connections,
+                'reused_connections': self.reused_connections}
+
+    @staticmethod
+    def quote_path(path):
+        """ percent-encode the characters not allowed in a request line (non-ASCII
+            characters as UTF-8, spaces...), keeping the already encoded ones"""
+        if not isinstance(path, str):  # unicode (python 2)
+            path = path.encode('utf-8')
+        return quote(path, safe="/%?=&;:@!$'()*+,-._~")
+
+    def request(self, url):
+        """ send a GET request on a pooled connection.
+            A reused connection may have been closed by the server meanwhile,
+            in that case the request is sent again on a new connection (but not after
+            a timeout: the slow host is left to the retries of the caller)"""
+        parsed = urlparse(url)
+        if parsed.scheme not in ('http', 'https'):
+            raise IOError("unsupported url scheme: " + url)
+        key = (parsed.scheme, parsed.netloc)
+        path = parsed.path or '/'
+        if parsed.query:
+            path += '?' + parsed.query
+        path = self.quote_path(path)
+        while True:
+            connection, reused = self.get_connection(key)
+            try:
+                connection.request('GET', path, headers=self.headers)
+                response = connection.getresponse()
+            except (httplib.HTTPException, IOError) as error:
+                connection.close()
+                if reused and not isinstance(error, socket.timeout):  # closed by the server
+                    continue
+                raise IOError("request failed: " + str(error))
+            return PooledResponse(self, key, connection, response, url)
+
+    def open(self, url, max_redirects=5):
+        """ GET the url (following redirections) and return a PooledResponse.
+            Raise IOError if the final response status is not 200"""
+        for _ in range(max_redirects + 1):
+            response = self.request(url)
+            if response.status in self.redirect_codes:
+                location = response.getheader('Location')
+                response.read()
+                response.close()
+                if not location:
+                    break
+                url = urljoin(url, location)
+                continue
+            if response.status != 200:
+                retry_after = response.getheader('Retry-After')
+                try:
+                    retry_after = float(retry_after) if retry_after else None
+                except ValueError:  # http date format, ignored
+                    retry_after = None
+                response.close()
+                raise HTTPError(response.status, url, retry_after)
+            return response
+        raise IOError("too many redirections: " + url)
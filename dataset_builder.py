@@ -3,9 +3,14 @@
 
 from __future__ import print_function
 import os
+import json
+import hashlib
 from shutil import copy2
-from scipy import ndimage, misc
-import numpy as np
+from atomic_file import save_json
+from build_manifest import BuildManifest
+from dataset_index import DatasetIndex
+from image_backend import get_backend
+from metrics import registry, reset_metrics
 
 __author__ = "Amine BENDAHMANE (@AmineHorseman)"
 __email__ = "bendahmane.amine@gmail.com"
@@ -14,10 +19,13 @@ __date__ = "May 6nd, 2016"
 
 class DatasetBuilder(object):
     """ Aggregate utilities to build large datasets (renaming files, spliting categories,
-        creating labels, loading data...) """
+        creating labels, loading data...)
+        NumPy and the image library (see image_backend.py) are imported only by the
+        methods that need them, so importing this module stays fast"""
 
+    image_backend = None  # name of the image backend, None: first available
     merge_files_counter = 1
-    rename_files_counter = 1
+    manifest_batch = 1000  # number of files processed between two saves of the manifest
     data = []
     labels = []
 
@@ -42,10 +50,116 @@ class DatasetBuilder(object):
                     print("Target folder '", folderpath, "' does not exist...")
                     print(" >> Folder created")
 
+    @classmethod
+    def decode_image(cls, source, mode="RGB"):
+        """ read an image from a file path or a file-like object (e.g. BytesIO)"""
+        with registry.timer('image_decode_seconds'):
+            return get_backend(cls.image_backend).decode(source, mode=mode)
+
+    @classmethod
+    def encode_image(cls, image, target, image_format=None):
+        """ write an image array to a file path or a file-like object
+            (image_format is required for file-like objects, e.g. 'png')"""
+        with registry.timer('image_encode_seconds'):
+            get_backend(cls.image_backend).encode(image, target, image_format)
+
+    @classmethod
+    def resize_image(cls, image, height, width):
+        """ resize an image array to height x width"""
+        with registry.timer('image_resize_seconds'):
+            return get_backend(cls.image_backend).resize(image, height, width)
+
+    @staticmethod
+    def crop_image(image, height, width):
+        """ center crop an image array to height x width"""
+        offset_h = max(0, (image.shape[0] - height) // 2)
+        offset_w = max(0, (image.shape[1] - width) // 2)
+        return image[offset_h : height + offset_h, offset_w : width + offset_w]
+
+    @staticmethod
+    def grayscale_image(image):
+        """ convert an RGB image array to grayscale (same luma weights as PIL's 'F' mode)"""
+        import numpy as np
+        if image.ndim == 2:
+            return image
+        return np.dot(image[..., :3], [0.299, 0.587, 0.114])
+
+    @staticmethod
+    def normalize_image(image, mean=0.0, std=255.0):
+        """ convert an image array to float32 and normalize it: (image - mean) / std"""
+        import numpy as np
+        return (np.asarray(image, dtype=np.float32) - mean) / std
+
+    @classmethod
+    def resize_batch(cls, images, height, width):
+        """ resize a batch of images (N x H x W or N x H x W x C array) to height x width.
+            Each image is resized by the image backend (resize_image), so the pixels
+            are the same as with the image by image transforms: the antialiased
+            resampling of the backend is faster than a NumPy implementation"""
+        import numpy as np
+        return np.array([cls.resize_image(image, height, width) for image in images])
+
+    @staticmethod
+    def crop_batch(images, height, width):
+        """ center crop a batch of images (N x H x W [x C] array) to height x width"""
+        offset_h = max(0, (images.shape[1] - height) // 2)
+        offset_w = max(0, (images.shape[2] - width) // 2)
+        return images[:, offset_h : height + offset_h, offset_w : width + offset_w]
+
+    @staticmethod
+    def grayscale_batch(images):
+        """ convert a batch of RGB images (N x H x W x C array) to grayscale"""
+        import numpy as np
+        if images.ndim == 3:
+            return images
+        return np.tensordot(images[..., :3], [0.299, 0.587, 0.114], axes=([3], [0]))
+
+    @staticmethod
+    def transform_batch(images, transforms=()):
+        """ apply a chain of transforms (see transforms.py) to a list of image arrays:
+            the images of the same shape are stacked and each transform is applied to
+            the whole stack at once (Transform.batch). Return the list of transformed
+            images, in the same order"""
+        import numpy as np
+        groups = {}
+        for i, image in enumerate(images):
+            groups.setdefault(image.shape, []).append(i)
+        results = [None] * len(images)
+        for indexes in groups.values():
+            batch = np.array([images[i] for i in indexes])
+            for transform in transforms:
+                with registry.timer('transform_batch_seconds',
+                                    transform=transform.__class__.__name__):
+                    batch = transform.batch(batch)
+            for i, image in zip(indexes, batch):
+                results[i] = image
+        return results
+
+    @classmethod
+    def iter_batches(cls, filenames, transforms=(), batch_size=64):
+        """ decode the images by batches of batch_size, transform them (transform_batch)
+            and yield (index of the first image, array of the batch).
+            The transformed images of a batch must have the same shape"""
+        import numpy as np
+        for start in range(0, len(filenames), batch_size):
+            images = [cls.decode_image(filename)
+                      for filename in filenames[start:start + batch_size]]
+            images = cls.transform_batch(images, transforms)
+            shapes = set(image.shape for image in images)
+            if len(shapes) > 1:
+                print("Error: images '" + filenames[start] + "'... have different shapes " +
+                      str(sorted(shapes)) + ", resize the images first " +
+                      "(e.g. transforms=[Resize(64, 64)])")
+                exit()
+            yield start, np.array(images)
+
     @classmethod
     def rename_files(cls, source_folder, target_folder, extensions=('.jpg', '.jpeg', '.png')):
         """ list subfolders recursively and rename files according to
-            the following the pattern: 1.jpg, 2.jpg..."""
+            the following the pattern: 1.jpg, 2.jpg...
+            The numbers are kept in the build manifest of target_folder: when run again,
+            only new or modified files are copied, new files get the next numbers and
+            the copies of deleted files are removed"""
         # check source_folder and target_folder:
         cls.check_folder_existance(source_folder, throw_error_if_no_folder=True)
         cls.check_folder_existance(target_folder, display_msg=False)
@@ -56,28 +170,210 @@ class DatasetBuilder(object):
 
         # copy files and rename:
         print("Renaming files '", source_folder, "' files...")
-        cls.rename_files_counter = 1
-        for filename in os.listdir(source_folder):
-            if os.path.isdir(source_folder + '/' + filename):
-                cls.rename_files(source_folder + '/' + filename,
-                                 target_folder + '/' + filename,
-                                 extensions=extensions)
+        files = [(folder + "/" + filename, target, extension)
+                 for folder, target, filename, extension in cls.list_files(source_folder,
+                                                                           target_folder,
+                                                                           extensions)]
+        cls.copy_numbered_files(source_folder, target_folder, 'rename_files', files)
+
+    @classmethod
+    def copy_numbered_files(cls, source_folder, target_folder, operation, files):
+        """ copy the (source_file, target_subfolder, extension) files of source_folder to
+            target_subfolder/<number><extension>, numbered from 1 in each subfolder.
+            A source file keeps its number from one run to the next (see BuildManifest),
+            and the files of other source folders copied to target_folder are kept.
+            Return the next free number of each subfolder"""
+        manifest = BuildManifest(target_folder)
+        entries = manifest.entries(operation)
+        counters = manifest.operations[operation].setdefault('counters', {})
+        for entry in entries.values():
+            folder, name = os.path.split(entry['output'])
+            number = int(os.path.splitext(name)[0])
+            counters[folder] = max(counters.get(folder, 0), number)
+        jobs = []
+        for source_file, target, extension in files:
+            entry = entries.get(source_file)
+            if entry is not None and os.path.dirname(entry['output']) == target:
+                jobs.append((source_file, entry['output']))
             else:
-                if extensions == '' and os.path.splitext(filename)[1] == '':
-                    copy2(source_folder + "/" + filename,
-                          target_folder + "/" + str(cls.rename_files_counter))
-                    cls.rename_files_counter += 1
-                else:
-                    for extension in extensions:
-                        if filename.endswith(extension):
-                            copy2(source_folder + "/" + filename,
-                                  target_folder + "/" + str(cls.rename_files_counter) + extension)
-                            cls.rename_files_counter += 1
+                counters[target] = counters.get(target, 0) + 1
+                jobs.append((source_file, target + "/" + str(counters[target]) + extension))
+        todo = manifest.update(jobs, operation, source_folder=source_folder)
+        print(" >> ", len(jobs) - len(todo), " files up to date, ", len(todo), " to copy")
+        with registry.stage(operation):
+            for source_file, target_file in todo:
+                copy2(source_file, target_file)
+                registry.stage_items(operation)
+        manifest.record(todo, operation)
+        manifest.save()
+        return dict((folder, number + 1) for folder, number in counters.items())
+
+    @classmethod
+    def list_files(cls, source_folder, target_folder, extensions=('.jpg', '.jpeg', '.png')):
+        """ list recursively the files of source_folder matching the extensions,
+            and create the corresponding subfolders in target_folder (if not None).
+            The files are read from the index of source_folder (see DatasetIndex), which
+            only lists again the subfolders modified since the previous call.
+            Return a list of (source_folder, target_folder, filename, extension)"""
+        if source_folder[-1] == "/":
+            source_folder = source_folder[:-1]
+        if target_folder is not None and target_folder[-1] == "/":
+            target_folder = target_folder[:-1]
+        index = DatasetIndex.get(source_folder)
+        if target_folder is not None:
+            for subfolder in index.subfolders():
+                cls.check_folder_existance(target_folder + '/' + subfolder.replace(os.sep, '/'),
+                                           display_msg=False)
+        folders = {}  # relative folder -> (source folder, target folder)
+        files = []
+        for relative, filename, extension in index.files(extensions):
+            if relative not in folders:
+                path = relative.replace(os.sep, '/')
+                folders[relative] = (source_folder + '/' + path if path else source_folder,
+                                     None if target_folder is None else
+                                     target_folder + '/' + path if path else target_folder)
+            folder, target = folders[relative]
+            files.append((folder, target, filename, extension))
+        return files
+
+    @classmethod
+    def run_jobs(cls, method_name, jobs, params, workers=1, chunksize=None):
+        """ apply the method (given by its name) to each (source_file, target_file) job"""
+        for _ in cls.iter_jobs(method_name, jobs, params, workers, chunksize):
+            pass
+
+    @classmethod
+    def iter_jobs(cls, method_name, jobs, params, workers=1, chunksize=None):
+        """ apply the method (given by its name) to each (source_file, target_file) job
+            and yield each job once it is done.
+            If workers > 1, the jobs are distributed in chunks over a single pool of
+            processes, and yielded in the order they finish (the metrics of the workers
+            are added to the metrics of this process)"""
+        import multiprocessing
+        tasks = [(method_name, source_file, target_file, params)
+                 for source_file, target_file in jobs]
+        if workers > 1 and len(tasks) > 1:
+            if chunksize is None:  # small chunks: the jobs done are reported regularly
+                chunksize = max(1, min(len(tasks), cls.manifest_batch) // (workers * 4))
+            pool = multiprocessing.Pool(workers, initializer=reset_metrics)
+            try:
+                for job, worker_metrics in pool.imap_unordered(run_job_metrics, tasks,
+                                                               chunksize):
+                    registry.merge(worker_metrics)
+                    yield job
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for task in tasks:
+                run_job(task)
+                yield task[1], task[2]
+
+    @classmethod
+    def run_incremental(cls, source_folder, target_folder, method_name, jobs, params,
+                        workers=1, incremental=True):
+        """ run the jobs whose source file is new or modified since the last run
+            (according to the build manifest of target_folder), and remove the outputs
+            of the source files of source_folder that were deleted. The jobs done are recorded in the
+            manifest every manifest_batch jobs, so an interrupted run is resumed.
+            incremental: if False, all the jobs are run again"""
+        manifest = BuildManifest(target_folder)
+        if not incremental:
+            manifest.reset(method_name)
+        todo = manifest.update(jobs, method_name, params, source_folder)
+        print(" >> ", len(jobs) - len(todo), " images up to date, ", len(todo),
+              " to process, ", manifest.removed, " removed")
+        with registry.stage(method_name):
+            done = []
+            for job in cls.iter_jobs(method_name, todo, params, workers):
+                done.append(job)
+                if len(done) >= cls.manifest_batch:
+                    registry.stage_items(method_name, len(done))
+                    manifest.record(done, method_name)
+                    manifest.save()
+                    done = []
+            registry.stage_items(method_name, len(done))
+            manifest.record(done, method_name)
+        manifest.save()
+
+    @classmethod
+    def reshape_file(cls, source_file, target_file, height=128, width=128):
+        """ copy an image and reshape it"""
+        copy2(source_file, target_file)
+        image = cls.decode_image(target_file)
+        cls.encode_image(cls.resize_image(image, height, width), target_file)
+
+    @classmethod
+    def crop_file(cls, source_file, target_file, height=128, width=128):
+        """ copy an image and center crop it"""
+        copy2(source_file, target_file)
+        image = cls.decode_image(target_file)
+        cls.encode_image(cls.crop_image(image, height, width), target_file)
+
+    @classmethod
+    def grayscale_file(cls, source_file, target_file):
+        """ copy an image and convert it to grayscale"""
+        copy2(source_file, target_file)
+        image = cls.decode_image(target_file)
+        cls.encode_image(cls.grayscale_image(image), target_file)
+
+    @classmethod
+    def convert_file(cls, source_file, target_file):
+        """ copy an image and save it in the format given by the target extension"""
+        copy2(source_file, target_file)
+        image = cls.decode_image(target_file, mode=None)
+        cls.encode_image(image, target_file)
+
+    @classmethod
+    def transform_file(cls, source_file, target_file, transforms=()):
+        """ decode an image once, apply the chain of transforms and encode it once"""
+        image = cls.decode_image(source_file)
+        for transform in transforms:
+            with registry.timer('transform_seconds', transform=transform.__class__.__name__):
+                image = transform(image)
+        cls.encode_image(image, target_file)
+
+    @classmethod
+    def pipeline(cls, source_folder, target_folder, transforms,
+                 extensions=('.jpg', '.jpeg', '.png'), workers=1, incremental=True):
+        """ apply a chain of transforms (see transforms.py) to the images in a single pass:
+            each image is read once, transformed in memory and written once, e.g.
+            pipeline(source, target, [Resize(64, 64), CenterCrop(55, 55), Grayscale(), Format('.png')])
+            workers: number of processes used to transform the images
+            incremental: only transform the images added or modified since the last run"""
+
+        # check source_folder and target_folder:
+        cls.check_folder_existance(source_folder, throw_error_if_no_folder=True)
+        cls.check_folder_existance(target_folder, display_msg=False)
+        if source_folder[-1] == "/":
+            source_folder = source_folder[:-1]
+        if target_folder[-1] == "/":
+            target_folder = target_folder[:-1]
+
+        # the output extension is given by the last Format transform (if any):
+        new_extension = None
+        for transform in transforms:
+            if getattr(transform, 'extension', None):
+                new_extension = transform.extension
+
+        # read, transform and write the images:
+        print("Transforming '", source_folder, "' images: ", transforms)
+        jobs = []
+        for folder, target, filename, extension in cls.list_files(source_folder, target_folder,
+                                                                  extensions):
+            new_filename = filename
+            if new_extension is not None:
+                new_filename = filename[:len(filename) - len(extension)] + new_extension
+            jobs.append((folder + "/" + filename, target + "/" + new_filename))
+        cls.run_incremental(source_folder, target_folder, 'transform_file', jobs,
+                            {'transforms': list(transforms)}, workers, incremental)
 
     @classmethod
     def reshape_images(cls, source_folder, target_folder, height=128, width=128,
-                       extensions=('.jpg', '.jpeg', '.png')):
-        """ copy images and reshape them"""
+                       extensions=('.jpg', '.jpeg', '.png'), workers=1, incremental=True):
+        """ copy images and reshape them
+            workers: number of processes used to transform the images
+            incremental: only reshape the images added or modified since the last run"""
 
         # check source_folder and target_folder:
         cls.check_folder_existance(source_folder, throw_error_if_no_folder=True)
@@ -89,31 +385,18 @@ class DatasetBuilder(object):
 
         # read images and reshape:
         print("Resizing '", source_folder, "' images...")
-        for filename in os.listdir(source_folder):
-            if os.path.isdir(source_folder + '/' + filename):
-                cls.reshape_images(source_folder + '/' + filename,
-                                   target_folder + '/' + filename,
-                                   height, width, extensions=extensions)
-            else:
-                if extensions == '' and os.path.splitext(filename)[1] == '':
-                    copy2(source_folder + "/" + filename,
-                          target_folder + "/" + filename)
-                    image = ndimage.imread(target_folder + "/" + filename, mode="RGB")
-                    image_resized = misc.imresize(image, (height, width))
-                    misc.imsave(target_folder + "/" + filename, image_resized)
-                else:
-                    for extension in extensions:
-                        if filename.endswith(extension):
-                            copy2(source_folder + "/" + filename,
-                                  target_folder + "/" + filename)
-                            image = ndimage.imread(target_folder + "/" + filename, mode="RGB")
-                            image_resized = misc.imresize(image, (height, width))
-                            misc.imsave(target_folder + "/" + filename, image_resized)
-        
-    @classmethod                       
+        jobs = [(folder + "/" + filename, target + "/" + filename)
+                for folder, target, filename, _ in cls.list_files(source_folder, target_folder,
+                                                                  extensions)]
+        cls.run_incremental(source_folder, target_folder, 'reshape_file', jobs,
+                            {'height': height, 'width': width}, workers, incremental)
+
+    @classmethod
     def crop_images(cls, source_folder, target_folder, height=128, width=128,
-                       extensions=('.jpg', '.jpeg', '.png')):
-        """ copy images and center crop them"""
+                    extensions=('.jpg', '.jpeg', '.png'), workers=1, incremental=True):
+        """ copy images and center crop them
+            workers: number of processes used to transform the images
+            incremental: only crop the images added or modified since the last run"""
 
         # check source_folder and target_folder:
         cls.check_folder_existance(source_folder, throw_error_if_no_folder=True)
@@ -125,38 +408,19 @@ class DatasetBuilder(object):
 
         # read images and crop:
         print("Cropping '", source_folder, "' images...")
-        for filename in os.listdir(source_folder):
-            if os.path.isdir(source_folder + '/' + filename):
-                cls.crop_images(source_folder + '/' + filename,
-                                   target_folder + '/' + filename,
-                                   height, width, extensions=extensions)
-            else:
-                if extensions == '' and os.path.splitext(filename)[1] == '':
-                    copy2(source_folder + "/" + filename,
-                          target_folder + "/" + filename)
-                    image = ndimage.imread(target_folder + "/" + filename, mode="RGB")
-                    [width_original, height_original, _] = image.shape
-                    offset_w = (width_original - width) / 2
-                    offset_h = (width_original - width) / 2
-                    image_cropped = image[offset_w : width + offset_w, offset_h : height + offset_h, :]
-                    misc.imsave(target_folder + "/" + filename, image_cropped)
-                else:
-                    for extension in extensions:
-                        if filename.endswith(extension):
-                            copy2(source_folder + "/" + filename,
-                                  target_folder + "/" + filename)
-                            image = ndimage.imread(target_folder + "/" + filename, mode="RGB")
-                            [width_original, height_original, _] = image.shape
-                            offset_w = (width_original - width) / 2
-                            offset_h = (width_original - width) / 2
-                            image_cropped = image[offset_w : width + offset_w, offset_h : height + offset_h, :]
-                            misc.imsave(target_folder + "/" + filename, image_cropped)
+        jobs = [(folder + "/" + filename, target + "/" + filename)
+                for folder, target, filename, _ in cls.list_files(source_folder, target_folder,
+                                                                  extensions)]
+        cls.run_incremental(source_folder, target_folder, 'crop_file', jobs,
+                            {'height': height, 'width': width}, workers, incremental)
 
     @classmethod
     def merge_folders(cls, source_folder, target_folder,
                       extensions=('.jpg', '.jpeg', '.png')):
         """ merge images in separated folders in one single folder
-            The images will be renamed"""
+            The images will be renamed (1.jpg, 2.jpg...). As with rename_files, the
+            numbers are kept from one run to the next and only new or modified
+            files are copied"""
 
         # check source_folder and target_folder:
         cls.check_folder_existance(source_folder, throw_error_if_no_folder=True)
@@ -168,26 +432,19 @@ class DatasetBuilder(object):
 
         # copy files and rename:
         print("Merging '", source_folder, "' files...")
-        for filename in os.listdir(source_folder):
-            if os.path.isdir(source_folder + '/' + filename):
-                cls.merge_folders(source_folder + '/' + filename,
-                                  target_folder, extensions=extensions)
-            else:
-                if extensions == '' and os.path.splitext(filename)[1] == '':
-                    copy2(source_folder + "/" + filename,
-                          target_folder + "/" + str(cls.merge_files_counter))
-                    cls.merge_files_counter += 1
-                else:
-                    for extension in extensions:
-                        if filename.endswith(extension):
-                            copy2(source_folder + "/" + filename,
-                                  target_folder + "/" + str(cls.merge_files_counter) + extension)
-                            cls.merge_files_counter += 1
+        files = [(folder + "/" + filename, target_folder, extension)
+                 for folder, _, filename, extension in cls.list_files(source_folder, None,
+                                                                      extensions)]
+        counters = cls.copy_numbered_files(source_folder, target_folder, 'merge_folders',
+                                           files)
+        cls.merge_files_counter = counters.get(target_folder, 1)
 
     @classmethod
     def convert_to_grayscale(cls, source_folder, target_folder,
-                             extensions=('.jpg', '.jpeg', '.png')):
-        """ convert images from RGB to Grayscale"""
+                             extensions=('.jpg', '.jpeg', '.png'), workers=1, incremental=True):
+        """ convert images from RGB to Grayscale
+            workers: number of processes used to transform the images
+            incremental: only convert the images added or modified since the last run"""
 
         # check source_folder and target_folder:
         cls.check_folder_existance(source_folder, throw_error_if_no_folder=True)
@@ -197,31 +454,21 @@ class DatasetBuilder(object):
         if target_folder[-1] == "/":
             target_folder = target_folder[:-1]
 
-        # read images and reshape:
+        # read images and convert:
         print("Convert '", source_folder, "' images to grayscale...")
-        for filename in os.listdir(source_folder):
-            if os.path.isdir(source_folder + '/' + filename):
-                cls.convert_to_grayscale(source_folder + '/' + filename,
-                                         target_folder + '/' + filename,
-                                         extensions=extensions)
-            else:
-                if extensions == '' and os.path.splitext(filename)[1] == '':
-                    copy2(source_folder + "/" + filename,
-                          target_folder + "/" + filename)
-                    image = ndimage.imread(target_folder + "/" + filename, flatten=True)
-                    misc.imsave(target_folder + "/" + filename, image)
-                else:
-                    for extension in extensions:
-                        if filename.endswith(extension):
-                            copy2(source_folder + "/" + filename,
-                                  target_folder + "/" + filename)
-                            image = ndimage.imread(target_folder + "/" + filename, flatten=True)
-                            misc.imsave(target_folder + "/" + filename, image)
+        jobs = [(folder + "/" + filename, target + "/" + filename)
+                for folder, target, filename, _ in cls.list_files(source_folder, target_folder,
+                                                                  extensions)]
+        cls.run_incremental(source_folder, target_folder, 'grayscale_file', jobs, {}, workers,
+                            incremental)
 
     @classmethod
     def convert_format(cls, source_folder, target_folder,
-                       extensions=('.jpg', '.jpeg', '.png'), new_extension='.jpg'):
-        """ change images from one format to another (eg. change png files to jpeg) """
+                       extensions=('.jpg', '.jpeg', '.png'), new_extension='.jpg', workers=1,
+                       incremental=True):
+        """ change images from one format to another (eg. change png files to jpeg)
+            workers: number of processes used to transform the images
+            incremental: only convert the images added or modified since the last run"""
 
         # check source_folder and target_folder:
         cls.check_folder_existance(source_folder, throw_error_if_no_folder=True)
@@ -231,27 +478,18 @@ class DatasetBuilder(object):
         if target_folder[-1] == "/":
             target_folder = target_folder[:-1]
 
-        # read images and reshape:
+        # read images and convert:
         print("Change format of '", source_folder, "' files...")
-        for filename in os.listdir(source_folder):
-            if os.path.isdir(source_folder + '/' + filename):
-                cls.convert_format(source_folder + '/' + filename,
-                                   target_folder + '/' + filename,
-                                   extensions=extensions, new_extension=new_extension)
+        jobs = []
+        for folder, target, filename, extension in cls.list_files(source_folder, target_folder,
+                                                                  extensions):
+            if extension == '':
+                new_filename = filename + new_extension
             else:
-                if extensions == '' and os.path.splitext(filename)[1] == '':
-                    copy2(source_folder + "/" + filename,
-                          target_folder + "/" + filename + new_extension)
-                    image = ndimage.imread(target_folder + "/" + filename + new_extension)
-                    misc.imsave(target_folder + "/" + filename + new_extension, image)
-                else:
-                    for extension in extensions:
-                        if filename.endswith(extension):
-                            new_filename = os.path.splitext(filename)[0] + new_extension
-                            copy2(source_folder + "/" + filename,
-                                  target_folder + "/" + new_filename)
-                            image = ndimage.imread(target_folder + "/" + new_filename)
-                            misc.imsave(target_folder + "/" + new_filename, image)
+                new_filename = os.path.splitext(filename)[0] + new_extension
+            jobs.append((folder + "/" + filename, target + "/" + new_filename))
+        cls.run_incremental(source_folder, target_folder, 'convert_file', jobs, {}, workers,
+                            incremental)
 
     @classmethod
     def convert_to_array(cls, source_folder, target_folder, create_labels_file=False,
@@ -268,56 +506,338 @@ class DatasetBuilder(object):
 
         # read images and concatenate:
         print("Converting '", source_folder, "' images...")
-        for filename in os.listdir(source_folder):
-            if os.path.isdir(source_folder + '/' + filename):
-                cls.convert_to_array(source_folder + '/' + filename, target_folder, 
-                    create_labels_file=create_labels_file, extensions=extensions)
+        for folder, _, filename, _ in cls.list_files(source_folder, None, extensions):
+            image = cls.decode_image(folder + "/" + filename)
+            if (flatten):
+                cls.data.append(image.flatten())
             else:
-                if extensions == '' and os.path.splitext(filename)[1] == '':
-                    image = ndimage.imread(source_folder + "/" + filename, mode="RGB")
-                    if (flatten):
-                        cls.data.append(image.flatten())
-                    else:
-                        cls.data.append(image)
-                    if create_labels_file:
-                        cls.labels.append(source_folder.replace('/', '_'))
-                else:
-                    for extension in extensions:
-                        if filename.endswith(extension):
-                            image = ndimage.imread(source_folder + "/" + filename, mode="RGB")
-                            if (flatten):
-                                cls.data.append(image.flatten())
-                            else:
-                                cls.data.append(image)
-                            if create_labels_file:
-                                cls.labels.append(source_folder.replace('/', '_'))
+                cls.data.append(image)
+            if create_labels_file:
+                cls.labels.append(folder.replace('/', '_'))
+
+    @classmethod
+    def write_memmap(cls, filenames, data_file, flatten=False, transforms=(), batch_size=64):
+        """ decode the images by batches (see iter_batches) and write them in a
+            preallocated memory-mapped .npy file (the shape is given by the first batch).
+            Without images, an empty array is saved (as by np.save([]))"""
+        import numpy as np
+        if not filenames:
+            np.save(data_file, np.array([]))
+            return
+        data = None
+        with registry.stage('convert_to_memmap'):
+            for start, batch in cls.iter_batches(filenames, transforms, batch_size):
+                if flatten:
+                    batch = batch.reshape(len(batch), -1)
+                if data is None:
+                    data = np.lib.format.open_memmap(data_file, mode='w+', dtype=batch.dtype,
+                                                     shape=(len(filenames),) + batch.shape[1:])
+                if batch.shape[1:] != data.shape[1:]:
+                    print("Error: image '" + filenames[start] + "' has shape " +
+                          str(batch.shape[1:]) + " instead of " + str(data.shape[1:]) +
+                          ", resize the images first")
+                    exit()
+                data[start:start + len(batch)] = batch
+                registry.stage_items('convert_to_memmap', len(batch))
+                print("\r >> Converting: ", (start + len(batch)) * 100 / len(filenames), "%...",
+                      end="")
+        data.flush()
+        del data
+        print("")
 
     @classmethod
     def convert_to_single_file(cls, source_folder, target_folder, create_labels_file=False,
-                       flatten=False, extensions=('.jpg', '.jpeg', '.png')):
+                       flatten=False, extensions=('.jpg', '.jpeg', '.png'), memmap=False,
+                       incremental=True, transforms=(), batch_size=64, splits=None, seed=0,
+                       shuffle=False, max_per_class=None, balance=False):
         """ Convert dataset images to a single file (array of images)
-            The algorithm generates labels automatically according to subfolders"""
+            The algorithm generates labels automatically according to subfolders
+            (their ids are kept in label_ids.json, so they stay the same from one run
+            to the next, new subfolders getting the next ids)
+            memmap: write the images directly to disk instead of loading the whole
+                    dataset in memory (all the images must have the same size)
+            incremental: do nothing if no image was added, modified or deleted since
+                    the last conversion (see convert_to_shards to add images to a dataset)
+            transforms: chain of transforms (see transforms.py) applied by batches of
+                    batch_size images of the same shape, with vectorized operations
+                    (implies memmap)
+            splits: fraction of the images of each class in each split, e.g.
+                    {'train': 0.8, 'val': 0.1, 'test': 0.1}: each split is saved in its
+                    own files (train_data.npy, train_labels.npy...) instead of data.npy
+            seed: seed of the selection of the images of each split (and of the shuffle),
+                  the same seed and images always give the same splits
+            shuffle: save the images in a random order (seeded) instead of folder by folder
+            max_per_class: keep at most this number of images of each class
+            balance: keep the same number of images in each class (the size of the
+                     smallest class)"""
+        import numpy as np
 
-        # convert files in source_folder to data array and labels array:
-        print("Converting images to single file...")
-        cls.data = []
-        cls.labels = []
-        cls.convert_to_array(source_folder, target_folder, create_labels_file=create_labels_file, 
-            flatten=flatten, extensions=extensions)
+        # check if the images changed since the last conversion:
+        cls.check_folder_existance(source_folder, throw_error_if_no_folder=True)
+        cls.check_folder_existance(target_folder, display_msg=False)
+        if source_folder[-1] == "/":
+            source_folder = source_folder[:-1]
+        if target_folder[-1] == "/":
+            target_folder = target_folder[:-1]
+        split_names = [name for name, _ in cls.split_fractions(splits)]
+        prefixes = [name + '_' for name in split_names] if splits else ['']
+        manifest = BuildManifest(target_folder)
+        params = {'create_labels_file': create_labels_file, 'flatten': flatten,
+                  'extensions': list(extensions), 'transforms': list(transforms),
+                  'splits': cls.split_fractions(splits), 'seed': seed, 'shuffle': shuffle,
+                  'max_per_class': max_per_class, 'balance': balance}
+        files = cls.list_files(source_folder, None, extensions)
+        jobs = [(folder + "/" + filename, None) for folder, _, filename, _ in files]
+        todo = manifest.update(jobs, 'convert_to_single_file', params)
+        if incremental and not todo and not manifest.removed and \
+           all(os.path.isfile(target_folder + '/' + prefix + 'data.npy') for prefix in prefixes):
+            print("Images of '", source_folder, "' unchanged since the last conversion: ",
+                  target_folder + '/' + prefixes[0] + 'data.npy', " is up to date")
+            return
 
-        # convert string labels to numeric type:
-        if create_labels_file:
-            print("Converting Labels to numeric type...")
-            keys = list(set(cls.labels)) # unique list of labels
-            numeric_labels = dict(zip(keys, range(len(keys))))
-            for i in xrange(len(cls.labels)):
-                cls.labels[i] = numeric_labels[cls.labels[i]]
-
-        # save files:
-        print(" Saving...")
-        np.save(target_folder + '/data.npy', cls.data)
-        print(" > Images saved to: ", target_folder + '/data.npy')
+        # choose the images of each split and give their ids to the labels:
+        label_ids = cls.load_label_ids(target_folder, files, source_folder,
+                                       save=create_labels_file)
+        samples = [(folder + "/" + filename, label_ids[cls.label_name(folder, source_folder)])
+                   for folder, _, filename, _ in files]
+        selected = cls.split_samples(samples, splits, seed, shuffle, max_per_class, balance,
+                                     source_folder)
+
+        # convert the images of each split to a data array and a labels array:
+        print("Converting images to single file...")
+        memmap = memmap or bool(transforms)
+        for name, prefix in zip(split_names, prefixes):
+            split_samples = selected[name]
+            if splits:
+                print(" >> ", name, ": ", len(split_samples), " images")
+            filenames = [filename for filename, _ in split_samples]
+            cls.labels = [label for _, label in split_samples]
+            cls.data = []
+            if memmap:
+                cls.write_memmap(filenames, target_folder + '/' + prefix + 'data.npy',
+                                 flatten, transforms, batch_size)
+            else:
+                with registry.stage('convert_to_array'):
+                    for filename in filenames:
+                        image = cls.decode_image(filename)
+                        cls.data.append(image.flatten() if flatten else image)
+                registry.stage_items('convert_to_array', len(cls.data))
+                np.save(target_folder + '/' + prefix + 'data.npy', cls.data)
+            print(" > Images saved to: ", target_folder + '/' + prefix + 'data.npy')
+            if create_labels_file:
+                np.save(target_folder + '/' + prefix + 'labels.npy',
+                        np.array(cls.labels, dtype=np.int64))
+                print(" > Labels saved to: ", target_folder + '/' + prefix + 'labels.npy')
         if create_labels_file:
-            np.save(target_folder + '/labels.npy', cls.labels)
-            print(" > Labels saved to: ", target_folder + '/labels.npy')
+            print(" > Label ids saved to: ", target_folder + '/label_ids.json')
+        manifest.record(jobs, 'convert_to_single_file')
+        manifest.save()
+
+    @staticmethod
+    def label_name(folder, source_folder):
+        """ label of the images of a folder: its path relative to source_folder"""
+        return os.path.relpath(folder, source_folder).replace(os.sep, '/')
+
+    @classmethod
+    def load_label_ids(cls, target_folder, files, source_folder, save=True):
+        """ {label: id} of the labels of the files (see list_files). The ids are read
+            from target_folder/label_ids.json, and the new labels get the next ids
+            (in alphabetical order). The file is updated if save is True"""
+        filename = target_folder + '/label_ids.json'
+        label_ids = {}
+        if os.path.isfile(filename):
+            with open(filename) as json_file:
+                label_ids = json.load(json_file)
+        names = set(cls.label_name(folder, source_folder) for folder, _, _, _ in files)
+        for name in sorted(names - set(label_ids)):
+            label_ids[name] = len(label_ids)
+        if save:
+            cls.save_json(label_ids, filename)
+        return label_ids
+
+    @staticmethod
+    def split_fractions(splits):
+        """ [(split name, fraction)] of splits (dict or list of pairs), the fractions
+            being normalized to sum to 1. No splits: [('data', 1.0)]"""
+        if not splits:
+            return [('data', 1.0)]
+        if isinstance(splits, dict):
+            splits = sorted(splits.items())
+        total = float(sum(fraction for _, fraction in splits))
+        if total <= 0:
+            print("Error: the fractions of the splits must be positive")
+            exit()
+        return [(name, fraction / total) for name, fraction in splits]
+
+    @staticmethod
+    def sample_key(seed, filename, source_folder=None):
+        """ pseudo-random but reproducible sort key of a file (the same on every
+            platform and python version, unlike the random module). The path of the file
+            relative to source_folder is hashed, so the key does not depend on how
+            source_folder is given (relative or absolute path)"""
+        if source_folder is not None and filename.startswith(source_folder + '/'):
+            filename = filename[len(source_folder) + 1:]
+        return hashlib.sha1((str(seed) + ':' + filename).encode('utf-8')).hexdigest()
+
+    @classmethod
+    def split_samples(cls, samples, splits=None, seed=0, shuffle=False, max_per_class=None,
+                      balance=False, source_folder=None):
+        """ distribute the (filename, label) samples between the splits, class by class
+            (each split gets the same fraction of each class), after capping the classes
+            to max_per_class images (and to the size of the smallest class if balance).
+            The images kept and their split only depend on the seed and on the paths of
+            the files relative to source_folder (the folder of the samples, if given).
+            Return {split name: [(filename, label)]}, in the order of samples (or in a
+            random order if shuffle)"""
+        classes = {}
+        for sample in samples:
+            classes.setdefault(sample[1], []).append(sample)
+        cap = max_per_class
+        if balance and classes:
+            smallest = min(len(class_samples) for class_samples in classes.values())
+            cap = smallest if cap is None else min(cap, smallest)
+        fractions = cls.split_fractions(splits)
+        chosen = dict((name, set()) for name, _ in fractions)
+        for class_samples in classes.values():
+            if cap is not None or len(fractions) > 1:
+                class_samples = sorted(class_samples,
+                                       key=lambda sample: cls.sample_key(seed, sample[0],
+                                                                         source_folder))
+            if cap is not None:
+                class_samples = class_samples[:cap]
+            # number of images of each split (largest remainders, so they sum exactly):
+            sizes = [int(fraction * len(class_samples)) for _, fraction in fractions]
+            remainders = sorted(range(len(fractions)), reverse=True,
+                                key=lambda i: fractions[i][1] * len(class_samples) - sizes[i])
+            for i in remainders[:len(class_samples) - sum(sizes)]:
+                sizes[i] += 1
+            start = 0
+            for (name, _), size in zip(fractions, sizes):
+                chosen[name].update(filename for filename, _ in
+                                    class_samples[start:start + size])
+                start += size
+        selected = {}
+        for name, _ in fractions:
+            selected[name] = [sample for sample in samples if sample[0] in chosen[name]]
+            if shuffle:
+                selected[name].sort(key=lambda sample: cls.sample_key(str(seed) + ':order',
+                                                                      sample[0], source_folder))
+        return selected
+
+    @staticmethod
+    def save_json(content, filename):
+        """ write a json file atomically (see atomic_file.py)"""
+        save_json(content, filename, indent=1)
+
+    @classmethod
+    def convert_to_shards(cls, source_folder, target_folder, shard_size=10000, flatten=False,
+                          extensions=('.jpg', '.jpeg', '.png'), append=False, transforms=(),
+                          batch_size=64):
+        """ Convert dataset images to fixed-size shards (shard_00000_data.npy and
+            shard_00000_labels.npy, shard_00001_data.npy...) described by an index.json
+            file (offset, count and shape of each shard, and the label names), so the
+            samples can be streamed or read partially without loading the whole dataset.
+            Labels are generated from the subfolders' names.
+            append: add only the images which are not in the shards yet (according to the
+                    build manifest), as new shards. Images already in the shards are not
+                    updated or removed: convert again with append=False for that
+            transforms: chain of transforms (see transforms.py) applied by batches of
+                    batch_size images of the same shape, with vectorized operations
+            All the images must have the same size (after the transforms)"""
+        import numpy as np
+
+        # check source_folder and target_folder:
+        cls.check_folder_existance(source_folder, throw_error_if_no_folder=True)
+        cls.check_folder_existance(target_folder, display_msg=False)
+        if source_folder[-1] == "/":
+            source_folder = source_folder[:-1]
+        if target_folder[-1] == "/":
+            target_folder = target_folder[:-1]
+
+        # load the existing index and keep only the new images:
+        index_file = target_folder + '/index.json'
+        index = {'labels': [], 'shards': [], 'total': 0}
+        manifest = BuildManifest(target_folder)
+        if append and os.path.isfile(index_file):
+            with open(index_file) as json_file:
+                index = json.load(json_file)
+            # labels written with the separator of the system by older versions:
+            index['labels'] = [label.replace(os.sep, '/') for label in index['labels']]
+        else:
+            manifest.reset('convert_to_shards')
+        recorded = manifest.entries('convert_to_shards', {'flatten': flatten,
+                                                          'transforms': list(transforms)})
+        print("Converting '", source_folder, "' images to shards...")
+        files = []
+        known_labels = set(index['labels'])
+        for folder, _, filename, _ in cls.list_files(source_folder, None, extensions):
+            label = cls.label_name(folder, source_folder)
+            if recorded:
+                if folder + "/" + filename not in recorded:
+                    files.append((folder + "/" + filename, label))
+            elif label not in known_labels:  # index written without manifest
+                files.append((folder + "/" + filename, label))
+        if not files:
+            print(" >> No new images to add")
+            return
+        for _, label in files:
+            if label not in index['labels']:
+                index['labels'].append(label)
+        label_ids = dict((label, i) for i, label in enumerate(index['labels']))
+        expected_shape = None
+        if index['shards']:
+            expected_shape = tuple(index['shards'][0]['shape'])
+
+        # write the shards one by one:
+        with registry.stage('convert_to_shards'):
+            for start in range(0, len(files), shard_size):
+                chunk = files[start:start + shard_size]
+                name = 'shard_%05d' % len(index['shards'])
+                data = None
+                labels = np.array([label_ids[label] for _, label in chunk], dtype=np.int32)
+                filenames = [filename for filename, _ in chunk]
+                for i, batch in cls.iter_batches(filenames, transforms, batch_size):
+                    if flatten:
+                        batch = batch.reshape(len(batch), -1)
+                    if expected_shape is None:
+                        expected_shape = batch.shape[1:]
+                    if batch.shape[1:] != expected_shape:
+                        print("Error: image '" + filenames[i] + "' has shape " +
+                              str(batch.shape[1:]) + " instead of " + str(expected_shape) +
+                              ", resize the images first")
+                        exit()
+                    if data is None:
+                        data = np.lib.format.open_memmap(target_folder + '/' + name + '_data.npy',
+                                                         mode='w+', dtype=batch.dtype,
+                                                         shape=(len(chunk),) + expected_shape)
+                    data[i:i + len(batch)] = batch
+                    registry.stage_items('convert_to_shards', len(batch))
+                data.flush()
+                np.save(target_folder + '/' + name + '_labels.npy', labels)
+                index['shards'].append({'data': name + '_data.npy',
+                                        'labels': name + '_labels.npy',
+                                        'offset': index['total'],
+                                        'count': len(chunk),
+                                        'shape': list(expected_shape),
+                                        'dtype': str(data.dtype)})
+                index['total'] += len(chunk)
+                del data
+                cls.save_json(index, index_file)
+                manifest.record([(filename, None) for filename, _ in chunk], 'convert_to_shards')
+                manifest.save()
+                print("\r >> ", index['total'], " images saved in ", len(index['shards']),
+                      " shards...", end="")
+        print("\n > Index saved to: ", index_file)
+
+
+def run_job(task):
+    """ run a DatasetBuilder job (module level function, so it can be sent to worker processes)"""
+    method_name, source_file, target_file, params = task
+    getattr(DatasetBuilder, method_name)(source_file, target_file, **params)
+
 
+def run_job_metrics(task):
+    """ run a DatasetBuilder job in a worker process and return the job
+        (source_file, target_file) and the metrics it produced"""
+    run_job(task)
+    return (task[1], task[2]), registry.drain()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+""" DatasetIndex: list the files of a dataset folder once, and keep the list up to date"""
+
+from __future__ import print_function
+import os
+import json
+import time
+try:
+    from os import scandir
+except ImportError:  # python < 3.5
+    scandir = None
+from atomic_file import save_json
+
+loaded_indexes = {}  # root folder -> DatasetIndex, shared by the calls of this process
+
+
+class DatasetIndex(object):
+    """ Index of the subfolders and files of a dataset folder, saved as .dataset_index.json
+        in the folder. Each folder is listed with a single os.scandir call and its
+        modification time is recorded: when the index is refreshed, the folders whose
+        modification time did not change (no file added, removed or renamed) are not
+        listed again, only stat'ed.
+        The index only knows the names of the files: a file modified in place is
+        still detected by BuildManifest, which compares the files' signatures"""
+
+    filename = '.dataset_index.json'
+
+    def __init__(self, root):
+        self.root = root
+        self.path = os.path.join(root, self.filename)
+        self.folders = {}  # relative folder -> {'mtime', 'files', 'folders'}
+        self.scanned = 0  # folders listed by the last refresh
+        self.changed = False  # the last refresh changed the index (it has to be saved)
+        if os.path.isfile(self.path):
+            try:
+                with open(self.path) as json_file:
+                    self.folders = json.load(json_file)
+            except ValueError:  # interrupted write: rebuild the index
+                self.folders = {}
+
+    @classmethod
+    def get(cls, root):
+        """ index of a folder, loaded once per process and refreshed at each call
+            (and saved if it changed)"""
+        if root not in loaded_indexes:
+            loaded_indexes[root] = cls(root)
+        index = loaded_indexes[root]
+        index.refresh()
+        if index.changed:
+            index.save()
+        return index
+
+    @staticmethod
+    def list_folder(path):
+        """ names of the files and of the subfolders of a folder. Hidden subfolders
+            (e.g. the .blobs folder of ImagesDownloader) are ignored"""
+        files, folders = [], []
+        if scandir is not None:
+            for entry in scandir(path):
+                (folders if entry.is_dir() else files).append(entry.name)
+        else:
+            for name in os.listdir(path):
+                (folders if os.path.isdir(os.path.join(path, name)) else files).append(name)
+        return sorted(files), sorted(name for name in folders if not name.startswith('.'))
+
+    def refresh(self):
+        """ list again the folders modified since the last refresh (or new), and forget
+            the deleted ones. Return the number of folders listed.
+            Saving the index modifies the root folder, so the root folder is listed
+            again by the next refresh (a single folder, usually small)"""
+        self.scanned = 0
+        self.changed = False
+        now = time.time()
+        folders = {}
+        stack = ['']
+        while stack:
+            relative = stack.pop()
+            path = os.path.join(self.root, relative) if relative else self.root
+            mtime = os.stat(path).st_mtime
+            entry = self.folders.get(relative)
+            if entry is None or entry['mtime'] != mtime:
+                files, subfolders = self.list_folder(path)
+                if not relative:
+                    files = [name for name in files if not name.startswith(self.filename)]
+                # a folder modified during the last second may change again within the
+                # same mtime (coarse timestamps): list it again next time
+                new_entry = {'mtime': mtime if now - mtime > 1 else None,
+                             'files': files, 'folders': subfolders}
+                self.scanned += 1
+                if entry is None or entry['files'] != files or \
+                   entry['folders'] != subfolders or \
+                   (relative and entry['mtime'] is None and new_entry['mtime'] is not None):
+                    self.changed = True
+                entry = new_entry
+            folders[relative] = entry
+            stack += [os.path.join(relative, name) for name in entry['folders']]
+        if len(folders) != len(self.folders):
+            self.changed = True
+        self.folders = folders
+        return self.scanned
+
+    def files(self, extensions=('.jpg', '.jpeg', '.png')):
+        """ list the (relative folder, filename, extension) of the files matching the
+            extensions ('': files without extension), in the order of a sorted
+            recursive listing (files and subfolders sorted by name together).
+            The extensions are compared with a set lookup"""
+        extensions = set(['']) if extensions == '' else set(extensions)
+        files = []
+        stack = [('', iter(self.merged_names('')))]
+        while stack:
+            relative, names = stack[-1]
+            for name, is_folder in names:
+                if is_folder:
+                    subfolder = os.path.join(relative, name)
+                    stack.append((subfolder, iter(self.merged_names(subfolder))))
+                    break
+                dot = name.rfind('.')
+                extension = name[dot:] if dot > 0 else ''
+                if extension in extensions:
+                    files.append((relative, name, extension))
+            else:
+                stack.pop()
+        return files
+
+    def merged_names(self, relative):
+        """ (name, is_folder) of the files and subfolders of a folder, sorted by name"""
+        entry = self.folders[relative]
+        return sorted([(name, False) for name in entry['files']] +
+                      [(name, True) for name in entry['folders']])
+
+    def subfolders(self):
+        """ relative paths of all the subfolders"""
+        return sorted(relative for relative in self.folders if relative)
+
+    def save(self):
+        """ write the index atomically (through a temporary file). Read-only datasets
+            are indexed in memory only"""
+        try:
+            save_json(self.folders, self.path)
+        except (IOError, OSError):
+            pass
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+""" DatasetReader: read the arrays written by DatasetBuilder without loading them in memory"""
+
+from __future__ import print_function
+import os
+import json
+from bisect import bisect_right
+
+
+class DatasetReader(object):
+    """ Read a dataset written by DatasetBuilder.convert_to_single_file (data.npy and
+        labels.npy, or the files of a split: train_data.npy...) or by convert_to_shards
+        (index.json and its shards).
+        The arrays are memory-mapped: opening a dataset takes the same time whatever
+        its size, the images are read from the disk when they are accessed, and the
+        processes reading the same dataset (e.g. the workers of a data loader) share
+        the pages of the files through the page cache instead of holding a copy each.
+            reader = DatasetReader("./data_single_file", split='train')
+            image, label = reader[0]
+            images, labels = reader[0:64]  # views on the files, no copy
+        The readers can be used as map-style datasets of PyTorch (torch.utils.data.DataLoader)
+        and sent to worker processes: the files are opened again in each process"""
+
+    def __init__(self, folder, split=None, mmap_mode='r'):
+        """ split: name of the split to read (see convert_to_single_file), None: data.npy
+            mmap_mode: 'r' (read-only) or 'c' (copy-on-write: the arrays can be modified
+                       in memory, e.g. for libraries expecting writable arrays)"""
+        if folder[-1] == "/":
+            folder = folder[:-1]
+        self.folder = folder
+        self.split = split
+        self.mmap_mode = mmap_mode
+        self.shards = None
+        self.offsets = None
+        prefix = split + '_' if split else ''
+        if split is None and os.path.isfile(folder + '/index.json'):
+            with open(folder + '/index.json') as json_file:
+                index = json.load(json_file)
+            self.shards = index['shards']
+            self.offsets = [shard['offset'] for shard in self.shards]
+            self.length = index['total']
+            self.label_names = index['labels']
+        elif os.path.isfile(folder + '/' + prefix + 'data.npy'):
+            self.data_file = folder + '/' + prefix + 'data.npy'
+            self.labels_file = folder + '/' + prefix + 'labels.npy'
+            self.length = len(self.load(self.data_file))
+            self.label_names = self.load_label_names()
+        else:
+            print("Error: no dataset found in '" + folder + "' (" + prefix + "data.npy or " +
+                  "index.json)")
+            exit()
+        self.arrays = None  # opened lazily, in each process
+
+    def load(self, filename):
+        """ memory-map an array file"""
+        import numpy as np
+        return np.load(filename, mmap_mode=self.mmap_mode)
+
+    def load_label_names(self):
+        """ names of the labels, indexed by their ids (from label_ids.json)"""
+        filename = self.folder + '/label_ids.json'
+        if not os.path.isfile(filename):
+            return []
+        with open(filename) as json_file:
+            label_ids = json.load(json_file)
+        names = [None] * len(label_ids)
+        for name, label in label_ids.items():
+            names[label] = name
+        return names
+
+    def open(self):
+        """ memory-map the arrays: [(data, labels or None)], one pair per shard"""
+        if self.arrays is None:
+            if self.shards is None:
+                labels = None
+                if os.path.isfile(self.labels_file):
+                    labels = self.load(self.labels_file)
+                self.arrays = [(self.load(self.data_file), labels)]
+            else:
+                self.arrays = [(self.load(self.folder + '/' + shard['data']),
+                                self.load(self.folder + '/' + shard['labels'])
+                                if shard['labels'] else None)
+                               for shard in self.shards]
+        return self.arrays
+
+    def __getstate__(self):
+        """ the memory-mapped arrays are not sent to other processes (pickling them
+            would copy their content), they are opened again where they are used"""
+        state = self.__dict__.copy()
+        state['arrays'] = None
+        return state
+
+    def __len__(self):
+        return self.length
+
+    @property
+    def has_labels(self):
+        return self.open()[0][1] is not None
+
+    def __getitem__(self, item):
+        """ reader[i]: (image, label), reader[start:stop]: (images, labels) views on the
+            files (copies if the slice has a step or spans several shards),
+            reader[[i, j...]]: (images, labels) copies.
+            Without labels file, only the image(s) are returned"""
+        if isinstance(item, slice):
+            start, stop, step = item.indices(self.length)
+            if step != 1:
+                return self.take(range(start, stop, step))
+            return self.batch(start, stop)
+        if hasattr(item, '__len__'):
+            return self.take(item)
+        if item < 0:
+            item += self.length
+        if not 0 <= item < self.length:
+            raise IndexError("index " + str(item) + " out of range (" + str(self.length) +
+                             " samples)")
+        shard, position = self.locate(item)
+        data, labels = self.open()[shard]
+        if labels is None:
+            return data[position]
+        return data[position], labels[position]
+
+    def locate(self, item):
+        """ (shard number, position in the shard) of a sample"""
+        if self.offsets is None:
+            return 0, item
+        shard = bisect_right(self.offsets, item) - 1
+        return shard, item - self.offsets[shard]
+
+    def batch(self, start, stop):
+        """ samples start to stop-1: views on the files if they are in the same shard"""
+        import numpy as np
+        start, stop = max(0, start), min(stop, self.length)
+        parts = []
+        while start < stop:
+            shard, position = self.locate(start)
+            data, labels = self.open()[shard]
+            count = min(stop - start, len(data) - position)
+            parts.append((data[position:position + count],
+                          None if labels is None else labels[position:position + count]))
+            start += count
+        if not parts:
+            data, labels = self.open()[0]
+            parts = [(data[:0], None if labels is None else labels[:0])]
+        if len(parts) == 1:
+            data, labels = parts[0]
+        else:
+            data = np.concatenate([part[0] for part in parts])
+            labels = None if parts[0][1] is None else np.concatenate([part[1] for part in parts])
+        return data if labels is None else (data, labels)
+
+    def take(self, indexes):
+        """ samples at the given indexes (copied, in the order of the indexes)"""
+        import numpy as np
+        indexes = np.asarray(indexes, dtype=np.int64)
+        indexes = np.where(indexes < 0, indexes + self.length, indexes)
+        if len(indexes) and (indexes.min() < 0 or indexes.max() >= self.length):
+            raise IndexError("index out of range (" + str(self.length) + " samples)")
+        arrays = self.open()
+        if self.offsets is None:
+            data, labels = arrays[0]
+            return data[indexes] if labels is None else (data[indexes], labels[indexes])
+        shards = np.searchsorted(self.offsets, indexes, side='right') - 1
+        first_data, first_labels = arrays[0]
+        data = np.empty((len(indexes),) + first_data.shape[1:], dtype=first_data.dtype)
+        labels = None if first_labels is None else \
+                 np.empty(len(indexes), dtype=first_labels.dtype)
+        for shard in np.unique(shards):
+            selected = np.nonzero(shards == shard)[0]
+            positions = indexes[selected] - self.offsets[shard]
+            data[selected] = arrays[shard][0][positions]
+            if labels is not None:
+                labels[selected] = arrays[shard][1][positions]
+        return data if labels is None else (data, labels)
+
+    def worker_range(self, worker_id=None, num_workers=None):
+        """ (start, stop) of the contiguous block of samples read by a worker.
+            By default, the worker is the current worker of a PyTorch DataLoader
+            (if any), otherwise the whole dataset is read"""
+        if worker_id is None or num_workers is None:
+            worker_id, num_workers = 0, 1
+            try:
+                from torch.utils.data import get_worker_info
+                info = get_worker_info()
+                if info is not None:
+                    worker_id, num_workers = info.id, info.num_workers
+            except ImportError:  # PyTorch is optional
+                pass
+        size = (self.length + num_workers - 1) // num_workers
+        return min(self.length, worker_id * size), min(self.length, (worker_id + 1) * size)
+
+    def iter_batches(self, batch_size=64, worker_id=None, num_workers=None, shuffle=False,
+                     seed=0, drop_last=False):
+        """ yield the batches of samples of a worker (see worker_range): views on the
+            files, read sequentially. shuffle: the order of the batches is shuffled
+            (seeded), the samples of a batch stay contiguous on the disk"""
+        import numpy as np
+        start, stop = self.worker_range(worker_id, num_workers)
+        starts = list(range(start, stop, batch_size))
+        if drop_last and starts and stop - starts[-1] < batch_size:
+            starts.pop()
+        if shuffle:
+            np.random.RandomState(seed).shuffle(starts)
+        for batch_start in starts:
+            yield self.batch(batch_start, min(batch_start + batch_size, stop))
+
+    def __iter__(self):
+        """ iterate over the samples of the current worker, one by one"""
+        start, stop = self.worker_range()
+        for item in range(start, stop):
+            yield self[item]
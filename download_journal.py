@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+""" DownloadJournal: keep track of downloaded links on disk to resume interrupted downloads"""
+
+from __future__ import print_function
+import os
+import sqlite3
+import threading
+
+
+class DownloadJournal(object):
+    """ Record the state of each link (pending, done or failed), the number of
+        downloaded bytes and the checksum of the file in a SQLite database
+        stored in the target folder"""
+
+    filename = 'download_journal.db'
+    PENDING = 'pending'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __init__(self, folder):
+        self.path = os.path.join(folder, self.filename)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS downloads ("
+                                "keyword TEXT, url TEXT, target_file TEXT, state TEXT, "
+                                "attempts INTEGER DEFAULT 0, bytes INTEGER, checksum TEXT, "
+                                "PRIMARY KEY (keyword, url))")
+        self.connection.commit()
+
+    def add_pending(self, jobs):
+        """ add (keyword, url, target_file) jobs that are not in the journal yet"""
+        with self.lock:
+            self.connection.executemany("INSERT OR IGNORE INTO downloads "
+                                        "(keyword, url, target_file, state) VALUES (?, ?, ?, ?)",
+                                        [job + (self.PENDING,) for job in jobs])
+            self.connection.commit()
+
+    def state(self, keyword, url):
+        """ return the (state, attempts, target_file) of a link,
+            (None, 0, None) if not in the journal"""
+        with self.lock:
+            row = self.connection.execute("SELECT state, attempts, target_file FROM downloads "
+                                          "WHERE keyword = ? AND url = ?",
+                                          (keyword, url)).fetchone()
+        return row if row is not None else (None, 0, None)
+
+    def mark_done(self, keyword, url, nbytes, checksum, target_file):
+        """ record a successful download (target_file: name of the saved file)"""
+        self.update("UPDATE downloads SET state = ?, attempts = attempts + 1, bytes = ?, "
+                    "checksum = ?, target_file = ? WHERE keyword = ? AND url = ?",
+                    (self.DONE, nbytes, checksum, target_file, keyword, url))
+
+    def mark_failed(self, keyword, url):
+        """ record a failed download"""
+        self.update("UPDATE downloads SET state = ?, attempts = attempts + 1 "
+                    "WHERE keyword = ? AND url = ?", (self.FAILED, keyword, url))
+
+    def update(self, query, params):
+        """ execute an update query and commit it at once: the write lock of the
+            database is only held during the update, so another process (e.g. a second
+            download into the same folder) can write to the journal between two updates
+            (in WAL mode, a commit does not wait for the data to be written to the disk)"""
+        with self.lock:
+            self.connection.execute(query, params)
+            self.connection.commit()
+
+    def close(self):
+        """ close the database"""
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+""" DuplicatesDetector: find identical and near-duplicate images in a dataset"""
+
+from __future__ import print_function
+import os
+import hashlib
+from dataset_builder import DatasetBuilder
+
+
+def hamming_distance(hash1, hash2):
+    """ number of different bits between two integer hashes"""
+    return bin(hash1 ^ hash2).count('1')
+
+
+class BKTree(object):
+    """ Burkhard-Keller tree over 64-bit hashes: finds the hashes within a given
+        hamming distance without comparing against every stored hash"""
+
+    def __init__(self):
+        self.root = None  # node: [hash, item, {distance: child node}]
+
+    def add(self, image_hash, item):
+        """ insert a hash and its associated item"""
+        if self.root is None:
+            self.root = [image_hash, item, {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming_distance(image_hash, node[0])
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [image_hash, item, {}]
+                return
+            node = child
+
+    def search(self, image_hash, max_distance):
+        """ return the (distance, item) pairs whose hash is within max_distance"""
+        results = []
+        if self.root is None:
+            return results
+        candidates = [self.root]
+        while candidates:
+            node = candidates.pop()
+            distance = hamming_distance(image_hash, node[0])
+            if distance <= max_distance:
+                results.append((distance, node[1]))
+            for child_distance, child in node[2].items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    candidates.append(child)
+        return results
+
+
+class DuplicatesDetector(object):
+    """ Find duplicated images: exact copies (same bytes) and near-duplicates
+        (same picture with a different size or compression), using a perceptual hash"""
+
+    @staticmethod
+    def file_hash(filename):
+        """ sha1 of the file content"""
+        checksum = hashlib.sha1()
+        with open(filename, 'rb') as image_file:
+            for chunk in iter(lambda: image_file.read(64 * 1024), b''):
+                checksum.update(chunk)
+        return checksum.hexdigest()
+
+    @staticmethod
+    def perceptual_hash(filename):
+        """ 64-bit difference hash (dHash): the grayscale image is resized to 9x8 and
+            each bit tells if a pixel is brighter than its right neighbour"""
+        image = DatasetBuilder.grayscale_image(DatasetBuilder.decode_image(filename))
+        pixels = DatasetBuilder.resize_image(image, 8, 9).astype(int)
+        image_hash = 0
+        for row in range(8):
+            for col in range(8):
+                image_hash = (image_hash << 1) | int(pixels[row, col] > pixels[row, col + 1])
+        return image_hash
+
+    @classmethod
+    def find_duplicates(cls, source_folder, max_distance=5, across_folders=True,
+                        extensions=('.jpg', '.jpeg', '.png')):
+        """ Return a list of (duplicate_file, original_file, distance) tuples.
+            distance is 0 for exact copies, and the hamming distance between the
+            perceptual hashes for near-duplicates (max_distance=0 keeps exact copies only).
+            across_folders: also compare images of different subfolders (keywords)"""
+        DatasetBuilder.check_folder_existance(source_folder, throw_error_if_no_folder=True)
+        if source_folder[-1] == "/":
+            source_folder = source_folder[:-1]
+        print("Looking for duplicates in '", source_folder, "'...")
+        files = DatasetBuilder.list_files(source_folder, None, extensions)
+        exact_hashes = {}
+        trees = {}
+        duplicates = []
+        for i, (folder, _, filename, _) in enumerate(files):
+            image_file = folder + "/" + filename
+            scope = source_folder if across_folders else folder
+
+            # exact copies:
+            key = (scope, cls.file_hash(image_file))
+            if key in exact_hashes:
+                duplicates.append((image_file, exact_hashes[key], 0))
+                continue
+            exact_hashes[key] = image_file
+
+            # near-duplicates:
+            if max_distance > 0:
+                try:
+                    image_hash = cls.perceptual_hash(image_file)
+                except (IOError, ValueError):
+                    continue
+                tree = trees.setdefault(scope, BKTree())
+                matches = tree.search(image_hash, max_distance)
+                if matches:
+                    distance, original_file = min(matches)
+                    duplicates.append((image_file, original_file, distance))
+                else:
+                    tree.add(image_hash, image_file)
+            print("\r >> ", i + 1, " images checked, ", len(duplicates), " duplicates...", end="")
+        print("")
+        return duplicates
+
+    @classmethod
+    def remove_duplicates(cls, source_folder, max_distance=5, across_folders=True,
+                          extensions=('.jpg', '.jpeg', '.png'), remove=False):
+        """ Find the duplicated images, save the report in source_folder/duplicates.txt
+            (one tab-separated "duplicate original distance" line per duplicate) and delete the
+            duplicates if remove=True (the first image found is kept)"""
+        duplicates = cls.find_duplicates(source_folder, max_distance, across_folders, extensions)
+        if source_folder[-1] == "/":
+            source_folder = source_folder[:-1]
+        with open(source_folder + "/duplicates.txt", 'w') as report:
+            for duplicate_file, original_file, distance in duplicates:
+                report.write(duplicate_file + "\t" + original_file + "\t" + str(distance) + "\n")
+        print(" >> ", len(duplicates), " duplicates found (report saved to: '",
+              source_folder, "/duplicates.txt')")
+        if remove:
+            for duplicate_file, _, _ in duplicates:
+                os.remove(duplicate_file)
+            print(" >> ", len(duplicates), " duplicates removed")
+        return duplicates
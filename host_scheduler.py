@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+""" HostScheduler: per-host download queues with adaptive concurrency and backoff"""
+
+from __future__ import print_function
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+
+
+class HostScheduler(object):
+    """ Give download jobs to the workers, host by host (round robin), so that:
+        - each host has at most 'limit' simultaneous downloads. The limit starts at
+          max_per_host, is halved each time the host throttles us (e.g. HTTP 429/503)
+          and grows back by one after increase_after successful downloads
+        - a throttled host is paused (Retry-After or backoff delay)
+        - retried jobs wait for a jittered exponential backoff delay
+        max_pending: put() blocks while this number of jobs is waiting (None: no limit)"""
+
+    increase_after = 10
+
+    def __init__(self, max_per_host=4, backoff_base=1.0, backoff_max=300, max_pending=None):
+        self.max_per_host = max(1, max_per_host)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_pending = max_pending
+        self.queues = OrderedDict()  # host -> deque of (ready_time, job)
+        self.limits = {}
+        self.active = {}
+        self.successes = {}
+        self.paused_until = {}
+        self.pending = 0
+        self.running = 0
+        self.closed = False
+        self.throttled = 0
+        self.condition = threading.Condition()
+
+    def backoff_delay(self, attempt):
+        """ exponential delay of a retry, with a random jitter of +/- 50%"""
+        delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return delay * random.uniform(0.5, 1.5)
+
+    def put(self, host, job, delay=0, retry=False):
+        """ add a job for the host, available after delay seconds.
+            Retries are always accepted (max_pending is ignored), so that a worker
+            never waits for itself"""
+        with self.condition:
+            while not retry and self.max_pending is not None and \
+                  self.pending >= self.max_pending:
+                self.condition.wait()
+            if host not in self.queues:
+                self.queues[host] = deque()
+                self.limits.setdefault(host, self.max_per_host)
+                self.active.setdefault(host, 0)
+            self.queues[host].append((time.time() + delay, job))
+            self.pending += 1
+            self.condition.notify_all()
+
+    def close(self):
+        """ no more jobs will be added (except retries of running jobs)"""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def get(self):
+        """ wait for a job ready to be downloaded and return (host, job).
+            Return None when all the jobs are done"""
+        with self.condition:
+            while True:
+                now = time.time()
+                next_time = None
+                for host, queue in self.queues.items():
+                    if self.active[host] >= self.limits[host]:
+                        continue
+                    ready_time = max(queue[0][0], self.paused_until.get(host, 0))
+                    if ready_time <= now:
+                        _, job = queue.popleft()
+                        del self.queues[host]  # round robin: the host goes to the end
+                        if queue:
+                            self.queues[host] = queue
+                        self.active[host] += 1
+                        self.pending -= 1
+                        self.running += 1
+                        self.condition.notify_all()
+                        return host, job
+                    if next_time is None or ready_time < next_time:
+                        next_time = ready_time
+                if self.closed and self.pending == 0 and self.running == 0:
+                    return None
+                self.condition.wait(None if next_time is None else max(0.01, next_time - now))
+
+    def done(self, host, throttled=False, retry_after=None):
+        """ a job of the host is finished; throttled=True if the host asked us to slow down
+            (retry_after: pause requested by the host, in seconds)"""
+        with self.condition:
+            self.active[host] -= 1
+            self.running -= 1
+            if throttled:
+                self.throttled += 1
+                self.limits[host] = max(1, self.limits[host] // 2)
+                self.successes[host] = 0
+                pause = retry_after if retry_after is not None else \
+                        self.backoff_delay(self.max_per_host - self.limits[host])
+                self.paused_until[host] = max(self.paused_until.get(host, 0),
+                                              time.time() + pause)
+            else:
+                self.successes[host] = self.successes.get(host, 0) + 1
+                if self.successes[host] >= self.increase_after and \
+                   self.limits[host] < self.max_per_host:
+                    self.limits[host] += 1
+                    self.successes[host] = 0
+            if not self.queues.get(host) and self.active[host] == 0:
+                self.queues.pop(host, None)  # forget idle hosts
+            self.condition.notify_all()
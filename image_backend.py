@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+""" Image backends: read, write and resize images with the library available (Pillow, SciPy...)"""
+
+from __future__ import print_function
+import os
+
+BACKENDS = {}  # name -> backend class
+PREFERRED_BACKENDS = ('pillow', 'scipy')  # tried in this order when no backend is chosen
+loaded_backends = {}  # name -> backend instance
+NO_ALPHA_FORMATS = ('JPEG', 'PPM')  # images with transparency are flattened in these formats
+
+
+def register_backend(backend_class):
+    """ class decorator: make an image backend available under its name"""
+    BACKENDS[backend_class.name] = backend_class
+    return backend_class
+
+
+def get_backend(name=None):
+    """ return the image backend with this name, or the first available backend
+        of PREFERRED_BACKENDS. The image libraries are only imported here, the first
+        time an image is read or written"""
+    if name is None:
+        for preferred in PREFERRED_BACKENDS:
+            if preferred in loaded_backends or BACKENDS[preferred].available():
+                name = preferred
+                break
+        else:
+            print("Error: no image library found, please install Pillow and NumPy " +
+                  "(pip install pillow numpy)")
+            exit()
+    if name not in loaded_backends:
+        if name not in BACKENDS:
+            print("Error: unknown image backend '" + name + "' (available: " +
+                  ', '.join(sorted(BACKENDS)) + ")")
+            exit()
+        loaded_backends[name] = BACKENDS[name]()
+    return loaded_backends[name]
+
+
+class ImageBackend(object):
+    """ Base class of the image backends. Images are NumPy arrays (height x width [x channels])
+        To add a backend, subclass ImageBackend, implement load, decode, encode and resize,
+        and decorate the class with @register_backend"""
+
+    name = None
+
+    def __init__(self):
+        self.load()
+
+    @classmethod
+    def load(cls):
+        """ import the libraries of the backend (raise ImportError if they are missing)"""
+        raise NotImplementedError
+
+    @classmethod
+    def available(cls):
+        """ check if the libraries of the backend are installed"""
+        try:
+            cls.load()
+        except ImportError:
+            return False
+        return True
+
+    def decode(self, source, mode="RGB"):
+        """ read an image from a file path or a file-like object
+            (mode=None keeps the mode of the file if it is L, RGB or RGBA, the other
+            modes, e.g. palette images, are converted to one of these)"""
+        raise NotImplementedError
+
+    def encode(self, image, target, image_format=None):
+        """ write an image array to a file path or a file-like object
+            (the transparency is flattened for the formats without alpha, e.g. JPEG)"""
+        raise NotImplementedError
+
+    def resize(self, image, height, width):
+        """ resize an image array to height x width"""
+        raise NotImplementedError
+
+
+@register_backend
+class PillowBackend(ImageBackend):
+    """ Pillow (PIL) backend"""
+
+    name = 'pillow'
+
+    @classmethod
+    def load(cls):
+        from PIL import Image  # imported only when images are processed
+        import numpy
+        cls.Image = Image
+        cls.np = numpy
+
+    def to_pil(self, image):
+        """ convert an image array to a PIL image (float images are rounded to 8 bits)"""
+        if image.dtype != self.np.uint8:
+            image = self.np.clip(self.np.rint(image), 0, 255).astype(self.np.uint8)
+        return self.Image.fromarray(image)
+
+    def decode(self, source, mode="RGB"):
+        image = self.Image.open(source)
+        if mode is None and image.mode not in ('L', 'RGB', 'RGBA'):
+            # e.g. palette images: keep the colors, not the indices of the palette
+            if 'A' in image.getbands() or 'transparency' in image.info:
+                mode = 'RGBA'
+            elif image.mode != 'P' and len(image.getbands()) == 1:  # e.g. 1 bit, 16 bits
+                mode = 'L'
+            else:
+                mode = 'RGB'
+        if mode is not None:
+            image = image.convert(mode)
+        return self.np.array(image)
+
+    def encode(self, image, target, image_format=None):
+        pil_image = self.to_pil(image)
+        if pil_image.mode in ('LA', 'RGBA') and \
+           self.image_format(target, image_format) in NO_ALPHA_FORMATS:
+            pil_image = self.flatten(pil_image)
+        pil_image.save(target, format=image_format)
+
+    def image_format(self, target, image_format=None):
+        """ Pillow name of the format of a file (given, or from its extension)"""
+        if image_format is None:
+            if hasattr(target, 'write'):  # file-like object without format
+                return None
+            self.Image.init()
+            return self.Image.EXTENSION.get(os.path.splitext(target)[1].lower())
+        image_format = image_format.upper()
+        return 'JPEG' if image_format == 'JPG' else image_format
+
+    def flatten(self, pil_image):
+        """ composite an image with transparency over a white background"""
+        pil_image = pil_image.convert('RGBA')
+        background = self.Image.new('RGB', pil_image.size, (255, 255, 255))
+        background.paste(pil_image, mask=pil_image.split()[3])
+        return background
+
+    def resize(self, image, height, width):
+        if image.ndim == 2 and image.dtype != self.np.uint8:  # float grayscale image
+            pil_image = self.Image.fromarray(image.astype(self.np.float32), mode='F')
+        else:
+            pil_image = self.to_pil(image)
+        return self.np.array(pil_image.resize((width, height), self.Image.BILINEAR))
+
+
+@register_backend
+class ScipyBackend(ImageBackend):
+    """ scipy.misc / scipy.ndimage backend (SciPy < 1.2 with Pillow)"""
+
+    name = 'scipy'
+
+    @classmethod
+    def load(cls):
+        from scipy import misc, ndimage
+        if not hasattr(misc, 'imresize'):  # removed from recent SciPy versions
+            raise ImportError("scipy.misc.imresize is not available")
+        cls.misc = misc
+        cls.ndimage = ndimage
+
+    def decode(self, source, mode="RGB"):
+        return self.ndimage.imread(source, mode=mode)
+
+    def encode(self, image, target, image_format=None):
+        self.misc.imsave(target, image, format=image_format)
+
+    def resize(self, image, height, width):
+        return self.misc.imresize(image, (height, width))
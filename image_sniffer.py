@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+""" ImageSniffer: recognize images from their first bytes to reject bad downloads early"""
+
+from __future__ import print_function
+import struct
+
+
+class InvalidImage(IOError):
+    """ The downloaded content is not an acceptable image (not retried)"""
+    pass
+
+
+class ImageSniffer(object):
+    """ Check a download while it is transferred:
+        - the Content-Type and Content-Length headers (before reading the body)
+        - the magic bytes of the first chunk, which also give the file extension
+        - the image dimensions read from the image header (optional)
+        max_bytes: maximum size of an image (None: no limit)
+        min_width, min_height: minimum resolution of an image (0: no limit)"""
+
+    # (extension, signature offset, signature)
+    signatures = [('.jpg', 0, b'\xff\xd8\xff'),
+                  ('.png', 0, b'\x89PNG\r\n\x1a\n'),
+                  ('.gif', 0, b'GIF87a'),
+                  ('.gif', 0, b'GIF89a'),
+                  ('.webp', 8, b'WEBP'),
+                  ('.bmp', 0, b'BM'),
+                  ('.tif', 0, b'II*\x00'),
+                  ('.tif', 0, b'MM\x00*'),
+                  ('.ico', 0, b'\x00\x00\x01\x00')]
+    accepted_types = ('application/octet-stream', 'binary/octet-stream')
+    magic_size = 12  # number of bytes needed to recognize a format
+    header_limit = 256 * 1024  # stop looking for the dimensions after this number of bytes
+    jpeg_sof_markers = set(range(0xC0, 0xD0)) - set([0xC4, 0xC8, 0xCC])
+
+    def __init__(self, max_bytes=None, min_width=0, min_height=0):
+        self.max_bytes = max_bytes
+        self.min_width = min_width
+        self.min_height = min_height
+
+    def check_headers(self, response):
+        """ reject a response whose Content-Type is not an image or whose
+            Content-Length is too big, before downloading its body"""
+        content_type = (response.getheader('Content-Type') or '').split(';')[0].strip().lower()
+        if content_type and not content_type.startswith('image/') and \
+           content_type not in self.accepted_types:
+            raise InvalidImage("not an image (" + content_type + "): " + response.url)
+        length = response.getheader('Content-Length')
+        if self.max_bytes and length and length.isdigit() and int(length) > self.max_bytes:
+            raise InvalidImage("image too large (" + length + " bytes): " + response.url)
+
+    def check_size(self, nbytes):
+        """ reject a download once it exceeds max_bytes"""
+        if self.max_bytes and nbytes > self.max_bytes:
+            raise InvalidImage("image too large (more than " + str(self.max_bytes) + " bytes)")
+
+    def check(self, head, complete=False):
+        """ check the first bytes of a download (complete: head is the whole content).
+            Return the extension of the image, or None if more bytes are needed"""
+        if len(head) < self.magic_size and not complete:
+            return None
+        extension = self.sniff_format(head)
+        if extension is None:
+            raise InvalidImage("unknown image format")
+        if self.min_width or self.min_height:
+            size = self.image_size(head)
+            if size is None:
+                if not complete and len(head) < self.header_limit:
+                    return None
+                return extension  # dimensions not found, the image is kept
+            if size[0] < self.min_width or size[1] < self.min_height:
+                raise InvalidImage("image too small (" + str(size[0]) + "x" + str(size[1]) + ")")
+        return extension
+
+    @classmethod
+    def sniff_format(cls, data):
+        """ return the extension of the image format from its magic bytes (None if unknown)"""
+        for extension, offset, signature in cls.signatures:
+            if data[offset:offset + len(signature)] == signature:
+                if extension == '.webp' and data[:4] != b'RIFF':
+                    continue
+                return extension
+        return None
+
+    @classmethod
+    def image_size(cls, data):
+        """ return the (width, height) of the image read from its header,
+            None if unknown or if data is too short"""
+        try:
+            if data[:8] == b'\x89PNG\r\n\x1a\n':
+                return struct.unpack('>II', data[16:24])
+            if data[:6] in (b'GIF87a', b'GIF89a'):
+                return struct.unpack('<HH', data[6:10])
+            if data[:2] == b'BM':
+                width, height = struct.unpack('<ii', data[18:26])
+                return width, abs(height)
+            if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+                return cls.webp_size(data)
+            if data[:3] == b'\xff\xd8\xff':
+                return cls.jpeg_size(data)
+        except struct.error:  # header not complete yet
+            return None
+        return None
+
+    @staticmethod
+    def webp_size(data):
+        """ dimensions of a WebP image (lossy, lossless or extended)"""
+        chunk = data[12:16]
+        if chunk == b'VP8 ':
+            width, height = struct.unpack('<HH', data[26:30])
+            return width & 0x3fff, height & 0x3fff
+        if chunk == b'VP8L':
+            bits = struct.unpack('<I', data[21:25])[0]
+            return (bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1
+        if chunk == b'VP8X':
+            width = struct.unpack('<I', data[24:27] + b'\x00')[0]
+            height = struct.unpack('<I', data[27:30] + b'\x00')[0]
+            return width + 1, height + 1
+        return None
+
+    @classmethod
+    def jpeg_size(cls, data):
+        """ dimensions of a JPEG image, read from its start of frame segment"""
+        data = bytearray(data)
+        i = 2
+        while i + 9 <= len(data):
+            if data[i] != 0xff:
+                return None  # corrupted segment
+            marker = data[i + 1]
+            if marker == 0xff:  # padding
+                i += 1
+                continue
+            if marker == 0x01 or 0xd0 <= marker <= 0xd8:  # segments without length
+                i += 2
+                continue
+            if marker in cls.jpeg_sof_markers:
+                height, width = struct.unpack('>HH', bytes(data[i + 5:i + 9]))
+                return width, height
+            i += 2 + struct.unpack('>H', bytes(data[i + 2:i + 4]))[0]
+        return None
@@ -2,62 +2,538 @@
 """ ImagesDownloader: get a list of links, download the images and order them in a folder"""
 
 from __future__ import print_function
-import urllib
+import os
 import sys
+import time
+import socket
+import sqlite3
+import threading
+import hashlib
+from io import BytesIO
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+try:
+    from urlparse import urlparse
+except ImportError:
+    from urllib.parse import urlparse
 from dataset_builder import DatasetBuilder
+from connection_pool import ConnectionPool, HTTPError
+from download_journal import DownloadJournal
+from host_scheduler import HostScheduler
+from image_sniffer import ImageSniffer, InvalidImage
+from blob_store import BlobStore
+from metrics import registry, BYTES_BUCKETS
 
 __author__ = "Amine BENDAHMANE (@AmineHorseman)"
 __email__ = "bendahmane.amine@gmail.com"
 __license__ = "GPL"
 __date__ = "May 6nd, 2016"
 
+
 class ImagesDownloader(object):
     """Download a list of images, rename them and save them to the specified folder"""
 
     images_links = []
     failed_links = []
     default_target_folder = 'images'
+    chunk_size = 64 * 1024
+    retry_codes = (429, 500, 502, 503, 504)  # HTTP errors worth retrying
+    throttle_codes = (429, 503)  # HTTP errors meaning that the host is overloaded
 
     def __init__(self):
         print("Preparing to download images...")
+        self.lock = threading.Lock()
+        self.progress = 0
+        self.failed_nbr = 0
+        self.shared_nbr = 0
+        self.images_nbr = 0
+        self.retries = 0
+        self.connection_pool = None
+        self.scheduler = None
+        self.sniffer = ImageSniffer()
+        self.blob_store = None
+        self.shared_links = {}
 
-    def download(self, links, target_folder='./data'):
-        """Download images from a lisk of links"""
+    def download(self, links, target_folder='./data', threads=1, max_per_host=4,
+                 pool_size=None, idle_timeout=30, resume=True, retry_failed=True,
+                 max_attempts=3, append_failed_list=False, connect_timeout=10,
+                 read_timeout=30, max_retries=3, backoff_base=1.0, max_bytes=32 * 1024 * 1024,
+                 min_width=0, min_height=0, blob_store=True, connection_pool=None):
+        """Download images from a lisk of links ({keyword: links} dict or LinkStore)
+            threads: number of simultaneous downloads (global concurrency limit)
+            max_per_host: maximum number of simultaneous downloads from the same host
+                (lowered automatically while the host answers 429/503)
+            pool_size: number of keep-alive connections kept per host (default: max_per_host)
+            idle_timeout: keep-alive connections unused for this time (seconds) are closed
+            connect_timeout, read_timeout: give up a link if the host does not answer in time
+            max_retries: number of retries of a link after a timeout or a temporary error
+            backoff_base: delay (seconds) before the first retry, doubled at each retry
+            max_bytes: images bigger than this are aborted (None: no limit)
+            min_width, min_height: images smaller than this resolution are aborted
+                (the dimensions are read from the image header, during the download)
+            The images are saved with the extension of their real format
+            (read from their first bytes); other contents (e.g. html pages) are rejected
+            resume: skip the links already downloaded according to the download journal
+            retry_failed: download again the links that failed in previous runs
+            max_attempts: links that failed this number of times are not retried
+            append_failed_list: add the failed links to failed_list.txt instead of replacing it
+            blob_store: store each image once in target_folder/.blobs, named by the sha1 of
+                its content, and hard link it into the keyword folders (<sha1>.jpg...):
+                the links already downloaded (for another keyword or in a previous run)
+                are not downloaded again. Give the path of a folder to share the store
+                between several target folders, or False to save the images directly
+                in the keyword folders, named after their URL
+            connection_pool: ConnectionPool to use and keep open (e.g. reused by the next
+                calls), instead of a new pool closed at the end of the download
+                (pool_size, idle_timeout and the timeouts are then ignored)"""
 
         # check links and folder:
         if len(links) < 1:
             print("Error: Empty list, no links provided")
             exit()
         self.images_links = links
+        self.failed_links = []
         DatasetBuilder.check_folder_existance(target_folder)
         if target_folder[-1] == '/':
             target_folder = target_folder[:-1]
+        journal = DownloadJournal(target_folder)
 
-        # start downloading:
-        print("Downloading files...")
-        progress = 0
-        images_nbr = sum([len(self.images_links[key]) for key in self.images_links])
+        # prepare the download jobs (skip the links completed in previous runs):
+        self.scheduler = HostScheduler(max_per_host, backoff_base)
+        self.sniffer = ImageSniffer(max_bytes, min_width, min_height)
+        self.blob_store = None
+        if blob_store:
+            self.blob_store = BlobStore(target_folder + '/.blobs' if blob_store is True
+                                        else blob_store)
+        self.shared_links = {}  # link -> [(keyword, folder)] waiting for the same download
+        new_jobs = []
+        stored_jobs = []
+        skipped = 0
         for keyword, links in self.images_links.items():
             DatasetBuilder.check_folder_existance(target_folder + '/' + keyword, display_msg=False)
             for link in links:
-                target_file = target_folder + '/' + keyword + '/' + link.split('/')[-1]
-                try:
-                    f = urllib.URLopener()
-                    f.retrieve(link, target_file)
-                except IOError:
+                target_file = target_folder + '/' + keyword + '/' + self.link_name(link)
+                state, attempts, saved_file = journal.state(keyword, link) if resume \
+                                              else (None, 0, None)
+                if state == DownloadJournal.DONE and saved_file and os.path.isfile(saved_file):
+                    skipped += 1
+                elif state == DownloadJournal.FAILED and \
+                     (not retry_failed or attempts >= max_attempts):
                     self.failed_links.append(link)
-                progress = progress + 1
-                print("\r >> Download progress: ", (progress * 100 / images_nbr), "%...", end="")
-                sys.stdout.flush()
+                else:
+                    if state is None:
+                        new_jobs.append((keyword, link, target_file))
+                    if self.blob_store is not None:
+                        stored = self.blob_store.lookup(link)
+                        if stored is not None:  # downloaded for another keyword or run
+                            checksum, nbytes, blob_file = stored
+                            saved_file = self.blob_store.link(blob_file, target_folder + '/' +
+                                                              keyword)
+                            stored_jobs.append((keyword, link, nbytes, checksum, saved_file))
+                            continue
+                        if link in self.shared_links:  # same link, another keyword
+                            self.shared_links[link].append((keyword,
+                                                            target_folder + '/' + keyword))
+                            continue
+                        self.shared_links[link] = []
+                    self.scheduler.put(urlparse(link).netloc, (keyword, link, target_file, 0))
+        self.scheduler.close()
+        journal.add_pending(new_jobs)
+        for keyword, link, nbytes, checksum, saved_file in stored_jobs:
+            journal.mark_done(keyword, link, nbytes, checksum, saved_file)
+        if skipped or self.failed_links:
+            print(" >> Resuming: ", skipped, " images already downloaded, ",
+                  len(self.failed_links), " failed links not retried")
+        if stored_jobs:
+            print(" >> ", len(stored_jobs), " images already in the blob store (not downloaded)")
+            registry.inc('download_reused_total', len(stored_jobs))
+
+        # start downloading:
+        print("Downloading files...")
+        self.progress = 0
+        self.failed_nbr = 0
+        self.shared_nbr = 0
+        self.retries = 0
+        self.images_nbr = self.scheduler.pending
+        threads = max(1, int(threads))
+        if connection_pool is None:
+            if pool_size is None:
+                pool_size = max_per_host
+            self.connection_pool = ConnectionPool(pool_size, idle_timeout,
+                                                  connect_timeout, read_timeout)
+        else:
+            self.connection_pool = connection_pool
+        self.watch_queue()
+        with registry.stage('download'):
+            workers = []
+            for _ in range(threads):
+                worker = threading.Thread(target=self.download_worker,
+                                          args=(journal, max_retries))
+                worker.daemon = True
+                worker.start()
+                workers.append(worker)
+            for worker in workers:
+                worker.join()
+        self.watch_queue(False)
+        if connection_pool is None:
+            self.connection_pool.close()
+        journal.close()
+        if self.blob_store is not None:
+            self.blob_store.close()
 
-        print("\r >> Download progress: ", (progress * 100 / images_nbr), "%")
-        print(" >> ", (progress - len(self.failed_links)), " images downloaded")
+        if self.images_nbr:
+            print("\r >> Download progress: ", (self.progress * 100 / self.images_nbr), "%")
+        print(" >> ", (skipped + len(stored_jobs) + self.shared_nbr + self.progress -
+                       self.failed_nbr), " images downloaded")
+        if self.blob_store is not None and self.blob_store.deduplicated:
+            print(" >> ", self.blob_store.deduplicated, " downloaded images were already ",
+                  "stored (same content, other link)")
+        print(" >> Connections: ", self.connection_pool.new_connections, " new, ",
+              self.connection_pool.reused_connections, " reused")
+        if self.retries or self.scheduler.throttled:
+            print(" >> Retries: ", self.retries, " (hosts throttled ", self.scheduler.throttled,
+                  " times)")
 
         # save failed links:
         if len(self.failed_links):
-            f2 = open(target_folder + "/failed_list.txt", 'w')
+            f2 = open(target_folder + "/failed_list.txt", 'a' if append_failed_list else 'w')
             for link in self.failed_links:
                 f2.write(link + "\n")
+            f2.close()
             print(" >> Failed to download ", len(self.failed_links),
-                  " images: access not granted ",
+                  " images: access not granted or not an image ",
                   "(links saved to: '", target_folder, "/failed_list.txt')")
+
+    def download_from_queue(self, work_queue, target_folder='./data', worker_id=None,
+                            poll_interval=10, **download_options):
+        """ Download the work units of a WorkQueue shared with other workers (processes or
+            nodes) until all the units are done. Units leased by other workers are waited
+            for, and taken over if their lease expires (e.g. the worker died).
+            The lease of the unit being downloaded is renewed every third of
+            lease_seconds, and the keep-alive connections are reused between the units.
+            download_options are passed to download (threads, max_per_host...)"""
+        if worker_id is None:
+            worker_id = work_queue.default_worker_id()
+        download_options['append_failed_list'] = True
+        connection_pool = ConnectionPool(download_options.pop('pool_size', None) or
+                                         download_options.get('max_per_host', 4),
+                                         download_options.pop('idle_timeout', 30),
+                                         download_options.pop('connect_timeout', 10),
+                                         download_options.pop('read_timeout', 30))
+        units_nbr = 0
+        while True:
+            unit = work_queue.lease(worker_id)
+            if unit is None:
+                progress = work_queue.progress()
+                if progress[work_queue.LEASED] == 0 and progress[work_queue.PENDING] == 0:
+                    break
+                time.sleep(poll_interval)  # wait for the other workers (or expired leases)
+                continue
+            unit_id, keyword, links = unit
+            print("\nWorker ", worker_id, ": unit ", unit_id, " (", len(links), " '", keyword,
+                  "' links)")
+            stop = threading.Event()
+            renewer = threading.Thread(target=self.renew_lease,
+                                       args=(work_queue, unit_id, worker_id, stop))
+            renewer.daemon = True
+            renewer.start()
+            try:
+                self.download({keyword: links}, target_folder, connection_pool=connection_pool,
+                              **download_options)
+            finally:
+                stop.set()
+                renewer.join()
+            if work_queue.complete(unit_id, worker_id):
+                units_nbr += 1
+            else:
+                print(" >> Lease of unit ", unit_id, " lost (taken over by another worker), ",
+                      "the unit is not marked as done by this worker")
+        connection_pool.close()
+        print("\nWorker ", worker_id, ": all units done (", units_nbr, " downloaded by this worker)")
+
+    @staticmethod
+    def renew_lease(work_queue, unit_id, worker_id, stop):
+        """ renew the lease of a unit every third of the lease duration until stop is set
+            (or the lease is lost), with its own connection to the queue database"""
+        queue = work_queue.__class__(work_queue.filename, work_queue.lease_seconds)
+        try:
+            while not stop.wait(work_queue.lease_seconds / 3.0):
+                if not queue.renew(unit_id, worker_id):
+                    break
+        finally:
+            queue.close()
+
+    def download_worker(self, journal, max_retries=3):
+        """ Take download jobs from the scheduler until all the jobs are done.
+            An unexpected error on a link (not an IOError) fails the link without
+            retry; the job is always reported done to the scheduler, so the other
+            workers never wait for it"""
+        while True:
+            task = self.scheduler.get()
+            if task is None:
+                break
+            host, (keyword, link, target_file, attempt) = task
+            shared = self.shared_links.get(link, [])
+            reported = False  # scheduler.done called (by retry_later)
+            try:
+                try:
+                    with registry.timer('download_request_seconds'):
+                        if self.blob_store is None:
+                            nbytes, checksum, saved_file = self.download_link(link, target_file)
+                        else:
+                            nbytes, checksum, blob_file = self.download_blob(link)
+                            saved_file = self.blob_store.link(blob_file,
+                                                              os.path.dirname(target_file))
+                    self.record_request(host, nbytes)
+                    self.update_journal(journal.mark_done, keyword, link, nbytes, checksum,
+                                        saved_file)
+                    for other_keyword, folder in shared:
+                        self.update_journal(journal.mark_done, other_keyword, link, nbytes,
+                                            checksum, self.blob_store.link(blob_file, folder))
+                    with self.lock:
+                        self.shared_nbr += len(shared)
+                except IOError as error:
+                    self.record_request(host, error=error)
+                    retried = self.retry_later(host, (keyword, link, target_file, attempt + 1),
+                                               error, max_retries)
+                    reported = True
+                    if retried:
+                        continue
+                    self.fail_link(journal, keyword, link, shared)
+                except Exception as error:  # bug or malformed link: fail the link only
+                    self.record_request(host, error=error)
+                    print("\n >> Unexpected error on ", link, ": ", repr(error))
+                    self.fail_link(journal, keyword, link, shared)
+            finally:
+                if not reported:
+                    self.scheduler.done(host)
+            with self.lock:
+                self.progress = self.progress + 1
+                print("\r >> Download progress: ", (self.progress * 100 / self.images_nbr),
+                      "%...", end="")
+                sys.stdout.flush()
+
+    def fail_link(self, journal, keyword, link, shared=()):
+        """ record a link that could not be downloaded (for all its keywords)"""
+        self.update_journal(journal.mark_failed, keyword, link)
+        for other_keyword, _ in shared:
+            self.update_journal(journal.mark_failed, other_keyword, link)
+        with self.lock:
+            self.failed_links.append(link)
+            self.failed_nbr += 1
+
+    @staticmethod
+    def update_journal(update, *args):
+        """ record a link in the journal (update: journal.mark_done or mark_failed).
+            If the journal stays locked (e.g. by another download into the same folder),
+            the download goes on: the link is only downloaded again when resuming"""
+        try:
+            update(*args)
+        except sqlite3.OperationalError as error:
+            print("\n >> Download journal not updated: ", error)
+
+    @staticmethod
+    def record_request(host, nbytes=0, error=None):
+        """ update the metrics of the downloads: requests and errors per host
+            (error reason: HTTP status, 'invalid', 'timeout', 'network' or 'error' for
+            unexpected errors), bytes and size of the images"""
+        registry.inc('download_requests_total', host=host)
+        if error is None:
+            registry.inc('download_bytes_total', nbytes)
+            registry.observe('download_image_bytes', nbytes, BYTES_BUCKETS)
+            registry.stage_items('download')
+        else:
+            if isinstance(error, HTTPError):
+                reason = str(error.status)
+            elif isinstance(error, InvalidImage):
+                reason = 'invalid'
+            elif isinstance(error, socket.timeout):
+                reason = 'timeout'
+            elif isinstance(error, IOError):
+                reason = 'network'
+            else:
+                reason = 'error'
+            registry.inc('download_errors_total', host=host, reason=reason)
+
+    def watch_queue(self, watch=True):
+        """ publish (or stop publishing) the depth of the download queue as gauges"""
+        scheduler = self.scheduler
+        registry.gauge_function('download_queue_depth',
+                                (lambda: scheduler.pending) if watch else None)
+        registry.gauge_function('download_running',
+                                (lambda: scheduler.running) if watch else None)
+
+    def retry_later(self, host, job, error, max_retries):
+        """ Tell the scheduler that a job of the host failed, and put the job back
+            (after a backoff delay) if the error is temporary and retries are left.
+            The last element of job is its attempt number. Return True if retried"""
+        status = error.status if isinstance(error, HTTPError) else None
+        retry_after = error.retry_after if status is not None else None
+        retry = job[-1] <= max_retries and not isinstance(error, InvalidImage) and \
+                (status is None or status in self.retry_codes)
+        if retry:
+            delay = max(retry_after or 0, self.scheduler.backoff_delay(job[-1] - 1))
+            self.scheduler.put(host, job, delay, retry=True)
+            with self.lock:
+                self.retries += 1
+            registry.inc('download_retries_total')
+        self.scheduler.done(host, throttled=status in self.throttle_codes,
+                            retry_after=retry_after)
+        return retry
+
+    def iter_download(self, links, threads=8, max_per_host=4, pool_size=None,
+                      idle_timeout=30, queue_size=64, connect_timeout=10, read_timeout=30,
+                      max_retries=3, backoff_base=1.0, max_bytes=32 * 1024 * 1024,
+                      min_width=0, min_height=0):
+        """ Download the (keyword, link) pairs of an iterable (e.g. WebCrawler.iter_links_from_web)
+            and yield (keyword, link, data) as soon as each image is downloaded.
+            Nothing is written to disk, and at most queue_size links and queue_size
+            downloaded images are waiting in memory at the same time
+            (see download for the other options).
+            An exception raised by the links iterable is raised again here, after the
+            images of the links already found"""
+        self.failed_links = []
+        self.retries = 0
+        threads = max(1, int(threads))
+        self.scheduler = HostScheduler(max_per_host, backoff_base, max_pending=queue_size)
+        self.sniffer = ImageSniffer(max_bytes, min_width, min_height)
+        if pool_size is None:
+            pool_size = max_per_host
+        self.connection_pool = ConnectionPool(pool_size, idle_timeout,
+                                              connect_timeout, read_timeout)
+        results = Queue(queue_size)
+        feed_errors = []
+
+        def feed_jobs():
+            """ give the links to the scheduler as they arrive. An error of the links
+                iterable (e.g. quota of a search engine) ends the jobs and is raised
+                to the caller once the links already given are downloaded"""
+            try:
+                for keyword, link in links:
+                    self.scheduler.put(urlparse(link).netloc, (keyword, link, 0))
+            except Exception as error:
+                feed_errors.append(error)
+            finally:
+                self.scheduler.close()
+
+        def fetch_jobs():
+            """ download the links in memory (an unexpected error fails the link, see
+                download_worker)"""
+            while True:
+                task = self.scheduler.get()
+                if task is None:
+                    results.put(None)
+                    break
+                host, (keyword, link, attempt) = task
+                data = None
+                reported = False
+                try:
+                    try:
+                        with registry.timer('download_request_seconds'):
+                            data = self.fetch_link(link)
+                        self.record_request(host, len(data))
+                    except IOError as error:
+                        self.record_request(host, error=error)
+                        retried = self.retry_later(host, (keyword, link, attempt + 1), error,
+                                                   max_retries)
+                        reported = True
+                        if retried:
+                            continue
+                    except Exception as error:
+                        self.record_request(host, error=error)
+                        print("\n >> Unexpected error on ", link, ": ", repr(error))
+                finally:
+                    if not reported:
+                        self.scheduler.done(host)
+                results.put((keyword, link, data))
+
+        workers = [threading.Thread(target=feed_jobs)]
+        workers += [threading.Thread(target=fetch_jobs) for _ in range(threads)]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        self.watch_queue()
+        with registry.stage('download'):
+            finished = 0
+            while finished < threads:
+                result = results.get()
+                if result is None:
+                    finished += 1
+                elif result[2] is None:
+                    self.failed_links.append(result[1])
+                else:
+                    yield result
+        self.watch_queue(False)
+        self.connection_pool.close()
+        if feed_errors:
+            raise feed_errors[0]
+
+    @staticmethod
+    def link_name(link):
+        """ name of the file of a link, without extension (the extension is given
+            by the content of the file)"""
+        name = os.path.splitext(urlparse(link).path.split('/')[-1])[0]
+        if not name:
+            name = hashlib.sha1(link.encode('utf-8')).hexdigest()[:16]
+        return name
+
+    def fetch_link(self, link):
+        """ Download a single link in memory and return its content"""
+        output = BytesIO()
+        self.read_image(self.connection_pool.open(link), output)
+        return output.getvalue()
+
+    def download_blob(self, link):
+        """ Download a single link into the blob store.
+            Return the number of bytes, the sha1 checksum and the path of the stored image"""
+        nbytes, checksum, temp_file = self.download_link(link,
+                                                         self.blob_store.temporary_file())
+        extension = os.path.splitext(temp_file)[1]
+        return nbytes, checksum, self.blob_store.add(temp_file, checksum, extension, link,
+                                                     nbytes)
+
+    def download_link(self, link, target_file):
+        """ Download a single link to target_file (+ extension of the image format)
+            using a pooled connection. The file is written under a temporary name
+            and renamed once complete, so an interrupted or rejected download never
+            leaves a truncated image.
+            Return the number of bytes, the sha1 checksum and the name of the file"""
+        try:
+            with open(target_file + '.part', 'wb') as f:
+                nbytes, checksum, extension = self.read_image(self.connection_pool.open(link), f)
+        except Exception:
+            if os.path.exists(target_file + '.part'):
+                os.remove(target_file + '.part')
+            raise
+        os.rename(target_file + '.part', target_file + extension)
+        return nbytes, checksum, target_file + extension
+
+    def read_image(self, response, output):
+        """ Copy the body of the response to output, checking with the sniffer that
+            it is an image as soon as the first bytes arrive. The transfer is aborted
+            (InvalidImage) as soon as the content is rejected.
+            Return the number of bytes, the sha1 checksum and the image extension"""
+        checksum = hashlib.sha1()
+        nbytes = 0
+        head = b''
+        extension = None
+        try:
+            self.sniffer.check_headers(response)
+            while True:
+                chunk = response.read(self.chunk_size)
+                if not chunk:
+                    break
+                nbytes += len(chunk)
+                self.sniffer.check_size(nbytes)
+                if extension is None:
+                    head += chunk
+                    extension = self.sniffer.check(head)
+                output.write(chunk)
+                checksum.update(chunk)
+            if extension is None:
+                extension = self.sniffer.check(head, complete=True)
+        finally:
+            response.close()  # an aborted transfer closes the connection
+        return nbytes, checksum.hexdigest(), extension
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+""" LinkStore: store millions of images links on disk, grouped by keyword"""
+
+from __future__ import print_function
+import os
+import json
+import sqlite3
+import threading
+
+
+class LinkStore(object):
+    """ SQLite store of (keyword, link) pairs. Duplicated links of a keyword are ignored,
+        and the links are read back in insertion order without loading them all in memory.
+        It can be used instead of the images_links dict: store[keyword] = links,
+        store.items(), len(store) (number of keywords) and (keyword, link) in store"""
+
+    batch_size = 10000  # number of rows read or inserted at once
+
+    def __init__(self, filename='./links.db'):
+        folder, _ = os.path.split(filename)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(filename, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS links ("
+                                "id INTEGER PRIMARY KEY, keyword TEXT, url TEXT, "
+                                "UNIQUE (keyword, url))")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS links_keyword ON links (keyword, id)")
+        self.connection.commit()
+
+    def add(self, keyword, links):
+        """ add links to a keyword, return the number of new links"""
+        added = 0
+        batch = []
+        with self.lock:
+            for link in links:
+                batch.append((keyword, link))
+                if len(batch) >= self.batch_size:
+                    added += self.insert(batch)
+                    batch = []
+            added += self.insert(batch)
+            self.connection.commit()
+        return added
+
+    def insert(self, rows):
+        """ insert (keyword, link) rows, return the number of new rows"""
+        if not rows:
+            return 0
+        before = self.connection.total_changes
+        self.connection.executemany("INSERT OR IGNORE INTO links (keyword, url) VALUES (?, ?)",
+                                    rows)
+        return self.connection.total_changes - before
+
+    def __setitem__(self, keyword, links):
+        """ replace the links of a keyword"""
+        with self.lock:
+            self.connection.execute("DELETE FROM links WHERE keyword = ?", (keyword,))
+            self.connection.commit()
+        self.add(keyword, links)
+
+    def __getitem__(self, keyword):
+        return self.iter_links(keyword)
+
+    def __contains__(self, item):
+        """ (keyword, link) in store: check if the link is stored for the keyword,
+            keyword in store: check if the keyword has links"""
+        with self.lock:
+            if isinstance(item, tuple):
+                row = self.connection.execute("SELECT 1 FROM links WHERE keyword = ? AND url = ?",
+                                              item).fetchone()
+            else:
+                row = self.connection.execute("SELECT 1 FROM links WHERE keyword = ? LIMIT 1",
+                                              (item,)).fetchone()
+        return row is not None
+
+    def __len__(self):
+        return len(self.keywords())
+
+    def keywords(self):
+        """ list of the keywords (in insertion order)"""
+        with self.lock:
+            rows = self.connection.execute("SELECT keyword, MIN(id) FROM links "
+                                           "GROUP BY keyword ORDER BY MIN(id)").fetchall()
+        return [row[0] for row in rows]
+
+    def count(self, keyword=None):
+        """ number of links (of a keyword, or in total)"""
+        with self.lock:
+            if keyword is None:
+                return self.connection.execute("SELECT COUNT(*) FROM links").fetchone()[0]
+            return self.connection.execute("SELECT COUNT(*) FROM links WHERE keyword = ?",
+                                           (keyword,)).fetchone()[0]
+
+    def iter_links(self, keyword=None):
+        """ yield the links (of a keyword, or (keyword, link) pairs for all keywords),
+            reading them by batches"""
+        last_id = 0
+        while True:
+            with self.lock:
+                if keyword is None:
+                    rows = self.connection.execute("SELECT id, keyword, url FROM links WHERE "
+                                                   "id > ? ORDER BY id LIMIT ?",
+                                                   (last_id, self.batch_size)).fetchall()
+                else:
+                    rows = self.connection.execute("SELECT id, keyword, url FROM links WHERE "
+                                                   "keyword = ? AND id > ? ORDER BY id LIMIT ?",
+                                                   (keyword, last_id,
+                                                    self.batch_size)).fetchall()
+            if not rows:
+                return
+            for row_id, row_keyword, url in rows:
+                yield url if keyword is not None else (row_keyword, url)
+            last_id = rows[-1][0]
+
+    def items(self):
+        """ (keyword, links iterator) pairs, like dict.items()"""
+        return [(keyword, self.iter_links(keyword)) for keyword in self.keywords()]
+
+    def import_text(self, filename, default_keyword='images'):
+        """ add the links of a text file (one 'keyword<TAB>link' or 'link' per line),
+            return the number of new links"""
+        added = 0
+        batch = []
+        with open(filename) as links_file:
+            with self.lock:
+                for line in links_file:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    if '\t' in line:
+                        keyword, link = line.split('\t', 1)
+                    else:
+                        keyword, link = default_keyword, line
+                    batch.append((keyword, link))
+                    if len(batch) >= self.batch_size:
+                        added += self.insert(batch)
+                        batch = []
+                added += self.insert(batch)
+                self.connection.commit()
+        return added
+
+    def import_json(self, filename):
+        """ add the links of a json file ({keyword: [links]}), return the number of new links.
+            The file is parsed incrementally (iter_json_links), so only batch_size links
+            are in memory at a time"""
+        added = 0
+        batch = []
+        with self.lock:
+            for keyword, link in iter_json_links(filename):
+                batch.append((keyword, link))
+                if len(batch) >= self.batch_size:
+                    added += self.insert(batch)
+                    batch = []
+            added += self.insert(batch)
+            self.connection.commit()
+        return added
+
+    def close(self):
+        """ close the database"""
+        with self.lock:
+            self.connection.close()
+
+
+def iter_json_links(filename, chunk_size=64 * 1024):
+    """ yield the (keyword, link) pairs of a json file of links ({keyword: [links]}, see
+        WebCrawler.save_urls_to_json) while reading it by chunks of chunk_size characters,
+        without loading the whole file in memory"""
+    decoder = json.JSONDecoder()
+    with open(filename) as links_file:
+        state = {'buffer': '', 'position': 0, 'end': False}
+
+        def next_char():
+            """ skip the whitespaces and return the next character ('' at the end)"""
+            while True:
+                buffer, position = state['buffer'], state['position']
+                while position < len(buffer) and buffer[position] in ' \t\r\n':
+                    position += 1
+                state['position'] = position
+                if position < len(buffer) or not read_more():
+                    return buffer[position:position + 1]
+
+        def read_more():
+            """ append the next chunk to the buffer (dropping the parsed part)"""
+            if state['end']:
+                return False
+            chunk = links_file.read(chunk_size)
+            state['buffer'] = state['buffer'][state['position']:] + chunk
+            state['position'] = 0
+            state['end'] = not chunk
+            return bool(chunk)
+
+        def expect(characters):
+            """ consume one of the characters and return it"""
+            char = next_char()
+            if not char or char not in characters:
+                raise ValueError("invalid json links file '" + filename + "': expected '" +
+                                 "' or '".join(characters) + "', found '" + char + "'")
+            state['position'] += 1
+            return char
+
+        def read_string():
+            """ decode the next json string"""
+            expect('"')
+            state['position'] -= 1
+            while True:
+                try:
+                    value, end = decoder.raw_decode(state['buffer'], state['position'])
+                    state['position'] = end
+                    return value
+                except ValueError:  # string cut at the end of the buffer
+                    if not read_more():
+                        raise
+
+        expect('{')
+        if next_char() == '}':
+            return
+        while True:
+            keyword = read_string()
+            expect(':')
+            expect('[')
+            if next_char() == ']':
+                state['position'] += 1
+            else:
+                while True:
+                    yield keyword, read_string()
+                    if expect(',]') == ']':
+                        break
+            if expect(',}') == '}':
+                return
@@ -0,0 +1,448 @@
+#!/usr/bin/env python
+""" Metrics: counters, gauges and histograms of the crawl, download and build stages,
+    exported to pluggable sinks (json lines file, Prometheus text endpoint) and
+    optional profiling hooks around the hot paths"""
+
+from __future__ import print_function
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+# upper bounds of the histogram buckets:
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BYTES_BUCKETS = (1024, 10 * 1024, 100 * 1024, 512 * 1024, 1024 * 1024, 4 * 1024 * 1024,
+                 16 * 1024 * 1024)
+
+
+class Histogram(object):
+    """ Distribution of observed values: count, sum, max and cumulative buckets"""
+
+    def __init__(self, buckets=SECONDS_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.bucket_counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.bucket_counts[i] += 1
+                break
+
+    def quantile(self, q):
+        """ approximate quantile (upper bound of the bucket containing it)"""
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.bucket_counts):
+            seen += count
+            if seen >= rank and seen:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {'count': self.count, 'sum': self.sum, 'max': self.max,
+                'buckets': list(self.buckets), 'bucket_counts': list(self.bucket_counts)}
+
+    def merge(self, state):
+        """ add the values of another histogram (to_dict) with the same buckets"""
+        self.count += state['count']
+        self.sum += state['sum']
+        self.max = max(self.max, state['max'])
+        for i, count in enumerate(state['bucket_counts']):
+            self.bucket_counts[i] += count
+
+
+class MetricsRegistry(object):
+    """ Thread-safe store of the metrics. Each metric has a name and optional labels
+        (e.g. host='example.com'):
+            counters: values that only increase (requests, bytes, errors...)
+            gauges: current values (queue depth...), set or computed when collected
+            histograms: distributions (latency, size...)
+        Timed sections (timer) also call the profiling hooks and, if enabled,
+        the per-thread cProfile profilers"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.enabled = True
+        self.hooks = []  # functions(name, labels, seconds) called after each timed section
+        self.profiler = None
+        self.reset()
+
+    def reset(self):
+        """ forget all the values (e.g. in a new worker process)"""
+        with self.lock:
+            self.counters = {}
+            self.gauges = {}
+            self.gauge_functions = {}
+            self.histograms = {}
+            self.stages = {}
+            self.start_time = time.time()
+
+    @staticmethod
+    def key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        """ increase a counter"""
+        if not self.enabled:
+            return
+        key = self.key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        """ set the current value of a gauge"""
+        with self.lock:
+            self.gauges[self.key(name, labels)] = value
+
+    def gauge_function(self, name, function, **labels):
+        """ gauge computed by function() each time the metrics are collected
+            (function=None removes it)"""
+        key = self.key(name, labels)
+        with self.lock:
+            if function is None:
+                self.gauge_functions.pop(key, None)
+            else:
+                self.gauge_functions[key] = function
+
+    def observe(self, name, value, buckets=SECONDS_BUCKETS, **labels):
+        """ add a value to a histogram"""
+        if not self.enabled:
+            return
+        key = self.key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """ measure the duration of a block of code in the histogram name (in seconds):
+                with registry.timer('image_decode_seconds'):
+                    ..."""
+        if not self.enabled:
+            yield
+            return
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.enable()
+        start = time.time()
+        try:
+            yield
+        finally:
+            seconds = time.time() - start
+            if profiler is not None:
+                profiler.disable()
+            self.observe(name, seconds, **labels)
+            for hook in self.hooks:
+                hook(name, labels, seconds)
+
+    def timed(self, name, **labels):
+        """ decorator: measure each call of a function (see timer)"""
+        def decorator(function):
+            def wrapper(*args, **kwargs):
+                with self.timer(name, **labels):
+                    return function(*args, **kwargs)
+            wrapper.__name__ = function.__name__
+            wrapper.__doc__ = function.__doc__
+            return wrapper
+        return decorator
+
+    @contextmanager
+    def stage(self, name):
+        """ measure a stage of a job (crawl, download, reshape_images...): its duration,
+            and with stage_items the number of items processed, to compute its throughput"""
+        start = time.time()
+        with self.lock:
+            self.stages[name] = self.stages.get(name, {'seconds': 0.0, 'items': 0})
+            self.stages[name]['running_since'] = start
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.stages[name]['seconds'] += time.time() - start
+                self.stages[name].pop('running_since', None)
+
+    def stage_items(self, name, items=1):
+        """ count the items processed by a stage"""
+        if not self.enabled:
+            return
+        with self.lock:
+            stage = self.stages.setdefault(name, {'seconds': 0.0, 'items': 0})
+            stage['items'] += items
+
+    def enable_profiling(self):
+        """ profile the timed sections with cProfile (one profiler per thread),
+            see save_profile"""
+        self.profiler = ThreadProfiler()
+
+    def save_profile(self, filename):
+        """ save the statistics of the profiled sections (read them with pstats)"""
+        if self.profiler is not None:
+            self.profiler.save(filename)
+
+    def snapshot(self):
+        """ current values of all the metrics, as a json serializable dict"""
+        with self.lock:
+            gauge_functions = list(self.gauge_functions.items())
+            gauges = dict(self.gauges)
+            counters = dict(self.counters)
+            histograms = dict((key, histogram.to_dict())
+                              for key, histogram in self.histograms.items())
+            stages = dict((name, dict(stage)) for name, stage in self.stages.items())
+        for key, function in gauge_functions:
+            try:
+                gauges[key] = function()
+            except Exception:  # e.g. the measured object was closed
+                pass
+        now = time.time()
+        for stage in stages.values():
+            seconds = stage['seconds'] + now - stage.pop('running_since', now)
+            stage['seconds'] = seconds
+            stage['items_per_second'] = stage['items'] / seconds if seconds > 0 else 0.0
+
+        def to_list(values):
+            return [{'name': name, 'labels': dict(labels), 'value': value}
+                    for (name, labels), value in sorted(values.items(), key=str)]
+        return {'time': now, 'uptime': now - self.start_time, 'counters': to_list(counters),
+                'gauges': to_list(gauges), 'histograms': to_list(histograms),
+                'stages': stages}
+
+    def drain(self):
+        """ return the counters, histograms and stage items, and reset them
+            (used by the worker processes to send their metrics to the parent)"""
+        with self.lock:
+            state = {'counters': list(self.counters.items()),
+                     'histograms': [(key, histogram.to_dict())
+                                    for key, histogram in self.histograms.items()],
+                     'stages': [(name, stage['items']) for name, stage in self.stages.items()]}
+            self.counters = {}
+            self.histograms = {}
+            self.stages = {}
+        return state
+
+    def merge(self, state):
+        """ add the metrics drained from another registry"""
+        with self.lock:
+            for key, value in state['counters']:
+                self.counters[key] = self.counters.get(key, 0) + value
+            for key, histogram in state['histograms']:
+                if key not in self.histograms:
+                    self.histograms[key] = Histogram(histogram['buckets'])
+                self.histograms[key].merge(histogram)
+        for name, items in state['stages']:
+            self.stage_items(name, items)
+
+    def prometheus_text(self):
+        """ metrics in the Prometheus text exposition format"""
+        snapshot = self.snapshot()
+        lines = []
+
+        def labels_text(labels, extra=None):
+            items = sorted(labels.items()) + (extra or [])
+            if not items:
+                return ''
+            return '{' + ','.join('%s="%s"' % (key, str(value).replace('\\', '\\\\')
+                                               .replace('"', '\\"')) for key, value in items) + '}'
+
+        for kind, metrics in (('counter', snapshot['counters']), ('gauge', snapshot['gauges'])):
+            declared = set()
+            for metric in metrics:
+                if metric['name'] not in declared:
+                    lines.append('# TYPE %s %s' % (metric['name'], kind))
+                    declared.add(metric['name'])
+                lines.append('%s%s %s' % (metric['name'], labels_text(metric['labels']),
+                                          metric['value']))
+        declared = set()
+        for metric in snapshot['histograms']:
+            name, labels, histogram = metric['name'], metric['labels'], metric['value']
+            if name not in declared:
+                lines.append('# TYPE %s histogram' % name)
+                declared.add(name)
+            cumulated = 0
+            for bound, count in zip(histogram['buckets'], histogram['bucket_counts']):
+                cumulated += count
+                lines.append('%s_bucket%s %d' % (name, labels_text(labels, [('le', bound)]),
+                                                 cumulated))
+            lines.append('%s_bucket%s %d' % (name, labels_text(labels, [('le', '+Inf')]),
+                                             histogram['count']))
+            lines.append('%s_sum%s %s' % (name, labels_text(labels), histogram['sum']))
+            lines.append('%s_count%s %d' % (name, labels_text(labels), histogram['count']))
+        for name, stage in sorted(snapshot['stages'].items()):
+            for field in ('items', 'seconds', 'items_per_second'):
+                lines.append('stage_%s{stage="%s"} %s' % (field, name, stage[field]))
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """ short text summary: throughput of the stages and latency of the timed sections"""
+        snapshot = self.snapshot()
+        lines = []
+        for name, stage in sorted(snapshot['stages'].items()):
+            if stage['seconds'] > 0:
+                lines.append(" >> %s: %d items in %.1fs (%.1f/s)" % (
+                    name, stage['items'], stage['seconds'], stage['items_per_second']))
+            else:  # items counted outside of a timed stage (e.g. streamed links)
+                lines.append(" >> %s: %d items" % (name, stage['items']))
+        with self.lock:
+            histograms = sorted(self.histograms.items(), key=str)
+        for (name, labels), histogram in histograms:
+            if not name.endswith('_seconds') or not histogram.count:
+                continue
+            lines.append(" >> %s%s: %d, mean %.1fms, p95 %.1fms, total %.1fs" % (
+                name, ' ' + str(dict(labels)) if labels else '', histogram.count,
+                histogram.sum * 1000 / histogram.count, histogram.quantile(0.95) * 1000,
+                histogram.sum))
+        return '\n'.join(lines)
+
+
+class ThreadProfiler(object):
+    """ cProfile profilers of the timed sections, one per thread (a profiler only sees
+        the thread that enabled it). Nested sections are profiled once.
+        Since Python 3.12, only one profiler can be active at a time in a process: the
+        sections starting while another thread is profiled are not profiled (skipped)"""
+
+    def __init__(self):
+        self.local = threading.local()
+        self.profiles = []
+        self.skipped = 0
+        self.lock = threading.Lock()
+
+    def enable(self):
+        depth = getattr(self.local, 'depth', 0)
+        if depth == 0:
+            if not hasattr(self.local, 'profile'):
+                import cProfile
+                self.local.profile = cProfile.Profile()
+                with self.lock:
+                    self.profiles.append(self.local.profile)
+            try:
+                self.local.profile.enable()
+                self.local.active = True
+            except ValueError:  # another profiler is active (python >= 3.12)
+                self.local.active = False
+                with self.lock:
+                    self.skipped += 1
+        self.local.depth = depth + 1
+
+    def disable(self):
+        self.local.depth -= 1
+        if self.local.depth == 0 and self.local.active:
+            self.local.profile.disable()
+
+    def save(self, filename):
+        import pstats
+        with self.lock:
+            profiles = list(self.profiles)
+        if profiles:
+            pstats.Stats(*profiles).dump_stats(filename)
+
+
+class JsonLinesSink(object):
+    """ Append a snapshot of the metrics (one json object per line) to a file"""
+
+    def __init__(self, filename):
+        self.filename = filename
+
+    def emit(self, registry):
+        with open(self.filename, 'a') as f:
+            f.write(json.dumps(registry.snapshot(), sort_keys=True) + '\n')
+
+    def close(self):
+        pass
+
+
+class PrometheusSink(object):
+    """ Serve the metrics in the Prometheus text format on http://host:port/metrics
+        (the metrics are read when the endpoint is scraped)"""
+
+    def __init__(self, registry, port=9100, host='127.0.0.1'):
+        try:  # imported here: the HTTP server is only needed by this sink
+            from http.server import HTTPServer, BaseHTTPRequestHandler
+            from socketserver import ThreadingMixIn
+        except ImportError:
+            from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+            from SocketServer import ThreadingMixIn
+
+        class ThreadingServer(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.prometheus_text().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingServer((host, port), Handler)
+        self.port = self.server.server_address[1]
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def emit(self, registry):
+        pass
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class MetricsReporter(object):
+    """ Send the metrics to the sinks every interval seconds (in a background thread),
+        and once more when stopped"""
+
+    def __init__(self, registry, sinks, interval=10):
+        self.registry = registry
+        self.sinks = sinks
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.emit()
+
+    def emit(self):
+        for sink in self.sinks:
+            sink.emit(self.registry)
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.emit()
+        for sink in self.sinks:
+            sink.close()
+
+
+registry = MetricsRegistry()  # metrics of this process, used by all the modules
+
+
+def report_metrics(filename=None, port=None, interval=10, host='127.0.0.1'):
+    """ start exporting the metrics: a snapshot appended to filename (json lines)
+        every interval seconds, and/or a Prometheus endpoint on http://host:port/metrics.
+        Return the MetricsReporter (call its stop method at the end of the job)"""
+    sinks = []
+    if filename is not None:
+        sinks.append(JsonLinesSink(filename))
+    if port is not None:
+        sinks.append(PrometheusSink(registry, port, host))
+    return MetricsReporter(registry, sinks, interval)
+
+
+def reset_metrics():
+    """ reset the metrics of this process (initializer of the worker processes)"""
+    registry.reset()
@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+""" TokenBucket: limit the number of requests per second sent to an API"""
+
+from __future__ import print_function
+import threading
+import time
+
+
+class TokenBucket(object):
+    """ Allow on average 'rate' requests per second, with bursts of up to 'capacity'
+        requests. The clock and sleep functions can be replaced (e.g. in tests)"""
+
+    def __init__(self, rate, capacity=1, clock=time.time, sleep=time.sleep):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.clock = clock
+        self.sleep = sleep
+        self.last_update = clock()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """ wait until a token is available and take it"""
+        while True:
+            with self.lock:
+                now = self.clock()
+                self.tokens = min(self.capacity,
+                                  self.tokens + (now - self.last_update) * self.rate)
+                self.last_update = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            self.sleep(wait)
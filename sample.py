@@ -23,6 +23,7 @@ crawler.save_urls(download_folder + "/links.txt")
 
 # 4. Download the images:
 crawler.download_images(target_folder=download_folder)
+#crawler.download_images(target_folder=download_folder, threads=32, max_per_host=4)
 
 
 ### Build the dataset ###
@@ -66,4 +67,10 @@ dataset_builder.convert_format(source_folder, target_folder, new_extension='.png
 source_folder = download_folder
 target_folder = download_folder + "_single_file"
 dataset_builder.convert_to_single_file(source_folder, target_folder, flatten=False, create_labels_file=True)
-#dataset_builder.convert_to_single_file(source_folder, target_folder, flatten=False, create_labels_file=True, extensions=('.jpg', '.jpeg', '.png', '.gif')) 
\ No newline at end of file
+#dataset_builder.convert_to_single_file(source_folder, target_folder, flatten=False, create_labels_file=True, extensions=('.jpg', '.jpeg', '.png', '.gif')) 
+
+# 8. (alternative to steps 2, 3, 5 and 6) Resize, crop, convert to grayscale and to .png in a single pass:
+#from transforms import Resize, CenterCrop, Grayscale, Format
+#source_folder = download_folder
+#target_folder = download_folder + "_transformed"
+#dataset_builder.pipeline(source_folder, target_folder, [Resize(64, 64), CenterCrop(55, 55), Grayscale(), Format('.png')])
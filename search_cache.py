@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+""" SearchCache: keep the result pages of the search engines on disk"""
+
+from __future__ import print_function
+import os
+import json
+import sqlite3
+import threading
+import time
+
+
+class SearchCache(object):
+    """ Store the links of each result page in a SQLite database, keyed by engine
+        (SearchEngine.cache_name: name and hash of the request parameters), keyword,
+        page number and page size, so a crawl run again (or extended to more links)
+        only queries the pages that were not fetched before.
+        ttl: pages older than ttl seconds are fetched again (None: never expire)
+        max_entries: the least recently used pages are evicted beyond this number"""
+
+    def __init__(self, filename='./search_cache.db', ttl=7 * 24 * 3600, max_entries=100000):
+        folder, _ = os.path.split(filename)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(filename, check_same_thread=False)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS pages ("
+                                "engine TEXT, keyword TEXT, page INTEGER, items_per_page INTEGER, "
+                                "links TEXT, created REAL, accessed REAL, "
+                                "PRIMARY KEY (engine, keyword, page, items_per_page))")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS pages_accessed ON pages (accessed)")
+        self.connection.commit()
+        self.count = self.connection.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+
+    def get(self, engine, keyword, page, items_per_page):
+        """ return the cached links of a page, or None if not cached (or expired)"""
+        key = (engine, keyword, page, items_per_page)
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute("SELECT links, created FROM pages WHERE engine = ? "
+                                          "AND keyword = ? AND page = ? AND items_per_page = ?",
+                                          key).fetchone()
+            if row is None or (self.ttl is not None and now - row[1] > self.ttl):
+                self.misses += 1
+                return None
+            self.connection.execute("UPDATE pages SET accessed = ? WHERE engine = ? AND "
+                                    "keyword = ? AND page = ? AND items_per_page = ?",
+                                    (now,) + key)
+            self.connection.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, engine, keyword, page, items_per_page, links):
+        """ store the links of a page and evict the least recently used pages if the cache
+            is full (the number of pages is counted once, then kept up to date)"""
+        now = time.time()
+        with self.lock:
+            cursor = self.connection.execute("UPDATE pages SET links = ?, created = ?, "
+                                             "accessed = ? WHERE engine = ? AND keyword = ? "
+                                             "AND page = ? AND items_per_page = ?",
+                                             (json.dumps(links), now, now, engine, keyword,
+                                              page, items_per_page))
+            if cursor.rowcount == 0:
+                self.connection.execute("INSERT INTO pages VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                        (engine, keyword, page, items_per_page,
+                                         json.dumps(links), now, now))
+                self.count += 1
+            if self.count > self.max_entries:
+                cursor = self.connection.execute("DELETE FROM pages WHERE rowid IN (SELECT "
+                                                 "rowid FROM pages ORDER BY accessed LIMIT ?)",
+                                                 (self.count - self.max_entries,))
+                self.count -= cursor.rowcount
+            self.connection.commit()
+
+    def clear_expired(self):
+        """ remove the expired pages"""
+        if self.ttl is None:
+            return
+        with self.lock:
+            cursor = self.connection.execute("DELETE FROM pages WHERE created < ?",
+                                             (time.time() - self.ttl,))
+            self.count -= cursor.rowcount
+            self.connection.commit()
+
+    def close(self):
+        """ close the database"""
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+""" Search engines backends: each engine is a SearchEngine subclass registered by name"""
+
+from __future__ import print_function
+import json
+import hashlib
+import time
+
+ENGINES = {}
+
+
+def register_engine(engine_class):
+    """ Class decorator adding a search engine to the registry (by its name),
+        so it can be used by WebCrawler without modifying it"""
+    ENGINES[engine_class.name] = engine_class
+    return engine_class
+
+
+def get_engine_class(name):
+    """ Return the registered search engine class, or None"""
+    return ENGINES.get(name)
+
+
+class SearchEngine(object):
+    """ Base class of the search engines.
+        Subclasses define their name, limits and fetch_page(); the API client
+        is created lazily by create_client(), once per instance"""
+
+    name = None
+    items_per_page = 10         # maximum number of results per page
+    max_results = None          # maximum number of results per keyword (None: no limit)
+    requests_per_second = 1.0   # default rate limit
+    max_concurrency = 4         # maximum number of simultaneous requests
+
+    def __init__(self, key, secret):
+        self.key = key
+        self.secret = secret
+        self.client = None
+
+    def create_client(self):
+        """ Create the API client (called once, before the first request)"""
+        return None
+
+    def request_params(self):
+        """ Parameters of the requests, other than the keyword and the page, that change
+            the results (e.g. the search engine id of Google). By default the key and
+            the secret, so engines sharing a cache never share pages they should not"""
+        return {'key': self.key, 'secret': self.secret}
+
+    def cache_name(self):
+        """ Name of the engine in the search cache: its name and a hash of its
+            request parameters"""
+        params = json.dumps(self.request_params(), sort_keys=True, default=str)
+        return self.name + ':' + hashlib.sha1(params.encode('utf-8')).hexdigest()[:16]
+
+    def get_client(self):
+        """ Return the API client, create it if needed"""
+        if self.client is None:
+            self.client = self.create_client()
+        return self.client
+
+    def fetch_page(self, keyword, page, items_per_page):
+        """ Return the images links of one result page (page numbers start at 0)"""
+        raise NotImplementedError
+
+    @classmethod
+    def count_pages(cls, number_links):
+        """ Return the number of items per page and the number of pages to fetch.
+            Pages always have the maximum size, so the same pages are requested
+            (and found in the cache) whatever the number of links"""
+        if cls.max_results is not None:
+            number_links = min(number_links, cls.max_results)
+        pages_nbr = (number_links + cls.items_per_page - 1) // cls.items_per_page
+        return cls.items_per_page, pages_nbr
+
+    def iter_pages(self, keyword, number_links, fetch_page=None):
+        """ Yield the links page by page (a list of links per page),
+            stop after the last page of results.
+            fetch_page: function used instead of self.fetch_page (e.g. to use a cache)"""
+        if fetch_page is None:
+            fetch_page = self.fetch_page
+        items_per_page, pages_nbr = self.count_pages(number_links)
+        for page in range(pages_nbr):
+            links = fetch_page(keyword, page, items_per_page)
+            yield links
+            if len(links) < items_per_page:
+                break
+
+
+@register_engine
+class GoogleEngine(SearchEngine):
+    """ Google Custom Search (key: API key, secret: search engine id)"""
+
+    name = 'google'
+    items_per_page = 10         # max 10 for google api
+    max_results = 100           # the api returns at most 100 results per query
+    requests_per_second = 5.0
+    max_concurrency = 4
+
+    def create_client(self):
+        from googleapiclient.discovery import build  # no need to import the package if the user didn't choose google in the list
+        print("Crawling Google Search Engine...")
+        return build("customsearch", "v1", developerKey=self.key)
+
+    def request_params(self):
+        return {'cx': self.secret, 'searchType': 'image',
+                'fileType': 'jpg&img;png&img;bmp&img;gif&img'}
+
+    def fetch_page(self, keyword, page, items_per_page):
+        response = self.get_client().cse().list(q=keyword,
+                                                num=items_per_page,
+                                                fields='items/link, queries',
+                                                start=page * items_per_page + 1,
+                                                **self.request_params()
+                                               ).execute()
+        return [image['link'] for image in response.get('items', [])]
+
+
+@register_engine
+class FlickrEngine(SearchEngine):
+    """ Flickr search (key: API key, secret: API secret)"""
+
+    name = 'flickr'
+    items_per_page = 200        # max 200 for flikr
+    max_results = 4000          # flickr returns at most 4000 results per query
+    requests_per_second = 1.0   # 3600 queries per hour
+    max_concurrency = 4
+
+    def create_client(self):
+        from flickrapi import FlickrAPI # we import flikcr API only if needed
+        print("Carwling Flickr Search...")
+        return FlickrAPI(self.key, self.secret)
+
+    def request_params(self):
+        return {'media': 'photos', 'sort': 'relevance'}
+
+    def fetch_page(self, keyword, page, items_per_page):
+        response = self.get_client().photos_search(api_key=self.key,
+                                                   text=keyword,
+                                                   per_page=items_per_page,
+                                                   page=page + 1,
+                                                   **self.request_params())
+        images = [im for im in list(response.iter()) if im.tag == 'photo']
+        links = []
+        for photo in images:
+            photo_url = "https://farm{0}.staticflickr.com/{1}/{2}_{3}.jpg". format(
+                photo.get('farm'), photo.get('server'), photo.get('id'), photo.get('secret'))
+            links.append(photo_url)
+        return links
+
+
+@register_engine
+class FakeEngine(SearchEngine):
+    """ Local engine generating links without any API, for tests and load tests
+        (key: link template such as 'http://127.0.0.1:8000/{keyword}/{index}.jpg',
+        secret: latency of each page request in seconds)"""
+
+    name = 'fake'
+    items_per_page = 100
+    max_results = None
+    requests_per_second = 1000.0
+    max_concurrency = 16
+
+    def request_params(self):
+        return {'key': self.key}  # the secret is a latency, it does not change the links
+
+    def fetch_page(self, keyword, page, items_per_page):
+        if self.secret:
+            time.sleep(float(self.secret))
+        start = page * items_per_page
+        return [self.key.format(keyword=keyword, index=index)
+                for index in range(start, start + items_per_page)]
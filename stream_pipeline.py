@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+""" StreamingPipeline: crawl, download, transform and store images in a single stream"""
+
+from __future__ import print_function
+import sys
+from io import BytesIO
+import numpy as np
+from dataset_builder import DatasetBuilder
+from images_downloader import ImagesDownloader
+from metrics import registry
+
+
+class FolderSink(object):
+    """ Save the images in target_folder/keyword/ as 1.jpg, 2.jpg..."""
+
+    def __init__(self, target_folder, extension='.jpg'):
+        if target_folder[-1] == '/':
+            target_folder = target_folder[:-1]
+        DatasetBuilder.check_folder_existance(target_folder)
+        self.target_folder = target_folder
+        self.extension = extension
+        self.counters = {}
+
+    def write(self, keyword, image):
+        """ save one image"""
+        if keyword not in self.counters:
+            DatasetBuilder.check_folder_existance(self.target_folder + '/' + keyword,
+                                                  display_msg=False)
+            self.counters[keyword] = 1
+        DatasetBuilder.encode_image(image, self.target_folder + '/' + keyword + '/' +
+                                    str(self.counters[keyword]) + self.extension)
+        self.counters[keyword] += 1
+
+    def close(self):
+        """ nothing to do, the images are already saved"""
+        pass
+
+
+class ArraySink(object):
+    """ Gather the images in fixed-size shards (shard_00000_data.npy and
+        shard_00000_labels.npy, shard_00001_data.npy...) described by an index.json file,
+        the format of DatasetBuilder.convert_to_shards (see DatasetReader).
+        The labels are the keywords' indexes.
+        The images are written as they arrive: at most shard_size images are kept in
+        memory. All the images must have the shape of the first one (use a resize
+        stage), the other ones are rejected"""
+
+    def __init__(self, target_folder, flatten=False, create_labels_file=True, shard_size=1024):
+        if target_folder[-1] == '/':
+            target_folder = target_folder[:-1]
+        DatasetBuilder.check_folder_existance(target_folder)
+        self.target_folder = target_folder
+        self.flatten = flatten
+        self.create_labels_file = create_labels_file
+        self.shard_size = shard_size
+        self.index = {'labels': [], 'shards': [], 'total': 0}
+        self.data = None  # images of the current shard (preallocated)
+        self.labels = []
+        self.label_ids = {}
+
+    def write(self, keyword, image):
+        """ add one image to the current shard (ValueError if its shape differs)"""
+        if self.flatten:
+            image = image.reshape(-1)
+        if self.data is None:
+            if self.index['shards'] and \
+               tuple(self.index['shards'][0]['shape']) != image.shape:
+                raise ValueError("image shape " + str(image.shape) + " instead of " +
+                                 str(tuple(self.index['shards'][0]['shape'])))
+            self.data = np.empty((self.shard_size,) + image.shape, dtype=image.dtype)
+        elif image.shape != self.data.shape[1:]:
+            raise ValueError("image shape " + str(image.shape) + " instead of " +
+                             str(self.data.shape[1:]))
+        if keyword not in self.label_ids:
+            self.label_ids[keyword] = len(self.index['labels'])
+            self.index['labels'].append(keyword)
+        self.data[len(self.labels)] = image
+        self.labels.append(self.label_ids[keyword])
+        if len(self.labels) == self.shard_size:
+            self.save_shard()
+
+    def save_shard(self):
+        """ save the images of the current shard and update index.json"""
+        count = len(self.labels)
+        name = 'shard_%05d' % len(self.index['shards'])
+        np.save(self.target_folder + '/' + name + '_data.npy', self.data[:count])
+        shard = {'data': name + '_data.npy', 'labels': None, 'offset': self.index['total'],
+                 'count': count, 'shape': list(self.data.shape[1:]),
+                 'dtype': str(self.data.dtype)}
+        if self.create_labels_file:
+            shard['labels'] = name + '_labels.npy'
+            np.save(self.target_folder + '/' + shard['labels'],
+                    np.array(self.labels, dtype=np.int32))
+        self.index['shards'].append(shard)
+        self.index['total'] += count
+        self.labels = []
+        DatasetBuilder.save_json(self.index, self.target_folder + '/index.json')
+
+    def close(self):
+        """ save the last (partial) shard"""
+        if self.labels:
+            self.save_shard()
+        self.data = None
+        print(" > ", self.index['total'], " images saved in ", len(self.index['shards']),
+              " shards, index saved to: ", self.target_folder + '/index.json')
+
+
+class StreamingPipeline(object):
+    """ Stream the links found by a WebCrawler to the downloader, then each downloaded
+        image through the stages (functions taking and returning an image array,
+        e.g. DatasetBuilder.grayscale_image) and into a sink (FolderSink or ArraySink).
+        The images are processed as soon as they arrive: no intermediate folders
+        are written, and only a bounded number of images is kept in memory"""
+
+    def __init__(self, crawler, sink, stages=(), threads=8, max_per_host=4, queue_size=64):
+        self.crawler = crawler
+        self.sink = sink
+        self.stages = list(stages)
+        self.threads = threads
+        self.max_per_host = max_per_host
+        self.queue_size = queue_size
+        self.failed_links = []
+
+    def run(self, keywords, number_links_per_engine, remove_duplicated_links=True):
+        """ Crawl, download, transform and store the images matching the keywords.
+            Return the number of images stored. An error of the crawler is raised
+            once the images of the links already found are stored"""
+        links = self.crawler.iter_links_from_web(keywords, number_links_per_engine,
+                                                 remove_duplicated_links=remove_duplicated_links)
+        downloader = ImagesDownloader()
+        images_nbr = 0
+        self.failed_links = []
+        print("Streaming images...")
+        try:
+            with registry.stage('stream'):
+                for keyword, link, data in downloader.iter_download(
+                        links, threads=self.threads, max_per_host=self.max_per_host,
+                        queue_size=self.queue_size):
+                    try:
+                        image = DatasetBuilder.decode_image(BytesIO(data))
+                        for stage in self.stages:
+                            with registry.timer('transform_seconds', transform=getattr(
+                                    stage, '__name__', stage.__class__.__name__)):
+                                image = stage(image)
+                        self.sink.write(keyword, image)
+                    except (IOError, ValueError):
+                        self.failed_links.append(link)
+                        registry.inc('stream_decode_errors_total')  # or wrong shape
+                        continue
+                    registry.stage_items('stream')
+                    images_nbr += 1
+                    print("\r >> ", images_nbr, " images processed...", end="")
+                    sys.stdout.flush()
+        finally:  # keep the images stored before an error (e.g. of the crawler)
+            self.sink.close()
+        self.failed_links += downloader.failed_links
+        print("\r >> ", images_nbr, " images processed")
+        if self.failed_links:
+            print(" >> ", len(self.failed_links), " links failed (download or decoding error)")
+        return images_nbr
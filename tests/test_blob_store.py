@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+""" Tests of the blob store shared by concurrent writers"""
+
+from __future__ import print_function
+import os
+import sys
+import shutil
+import hashlib
+import tempfile
+import unittest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from blob_store import BlobStore
+
+
+class BlobStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    @staticmethod
+    def add_blob(store, url, data):
+        temp_file = store.temporary_file()
+        with open(temp_file, 'wb') as blob_file:
+            blob_file.write(data)
+        return store.add(temp_file, hashlib.sha1(data).hexdigest(), '.png', url, len(data))
+
+    def test_two_concurrent_writers(self):
+        stores = [BlobStore(self.folder), BlobStore(self.folder)]
+        try:
+            for store in stores:
+                store.connection.execute("PRAGMA busy_timeout = 100")  # fail fast if locked
+            for index in range(20):  # the writers take turns
+                for number, store in enumerate(stores):
+                    self.add_blob(store, 'http://%d/%d.png' % (number, index),
+                                  ('image %d' % (index % 10)).encode())
+            # 10 different images, each stored once:
+            self.assertEqual(sum(store.deduplicated for store in stores), 30)
+            for number, store in enumerate(reversed(stores)):
+                for index in range(20):
+                    stored = store.lookup('http://%d/%d.png' % (number, index))
+                    self.assertIsNotNone(stored)
+                    self.assertTrue(os.path.isfile(stored[2]))
+        finally:
+            for store in stores:
+                store.close()
+        self.assertEqual(len(os.listdir(os.path.join(self.folder, 'tmp'))), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
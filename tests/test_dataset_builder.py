@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+""" Tests of the incremental operations of DatasetBuilder on local image trees"""
+
+from __future__ import print_function
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from benchmarks.fixtures import make_image_tree
+from dataset_builder import DatasetBuilder
+
+
+class DatasetBuilderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def path(self, *names):
+        return os.path.join(self.folder, *names)
+
+    def test_merge_two_sources_into_one_target(self):
+        make_image_tree(self.path('a'), ('cats',), 3, 8, 8, 3)
+        make_image_tree(self.path('b'), ('dogs',), 2, 8, 8, 2)
+        DatasetBuilder.merge_folders(self.path('a'), self.path('merged'))
+        DatasetBuilder.merge_folders(self.path('b'), self.path('merged'))
+        self.assertEqual(sorted(os.listdir(self.path('merged'))),
+                         ['1.png', '2.png', '3.png', '4.png', '5.png', 'build_manifest.json'])
+        # running again, or deleting a file of one source, keeps the files of the other:
+        DatasetBuilder.merge_folders(self.path('a'), self.path('merged'))
+        os.remove(self.path('b', 'dogs', '0.png'))
+        DatasetBuilder.merge_folders(self.path('b'), self.path('merged'))
+        self.assertEqual(sorted(os.listdir(self.path('merged'))),
+                         ['1.png', '2.png', '3.png', '5.png', 'build_manifest.json'])
+
+    def test_reshape_two_sources_into_one_target(self):
+        make_image_tree(self.path('a'), ('cats',), 2, 8, 8, 2)
+        make_image_tree(self.path('b'), ('dogs',), 2, 8, 8, 2)
+        DatasetBuilder.reshape_images(self.path('a'), self.path('reshaped'), 4, 4)
+        DatasetBuilder.reshape_images(self.path('b'), self.path('reshaped'), 4, 4)
+        self.assertEqual(sorted(os.listdir(self.path('reshaped', 'cats'))), ['0.png', '1.png'])
+        self.assertEqual(sorted(os.listdir(self.path('reshaped', 'dogs'))), ['0.png', '1.png'])
+
+    def test_splits_do_not_depend_on_the_source_path(self):
+        import numpy
+        make_image_tree(self.path('data'), ('cats', 'dogs'), 10, 8, 8, 10)
+        splits = {'train': 0.7, 'test': 0.3}
+        DatasetBuilder.convert_to_single_file(self.path('data'), self.path('absolute'),
+                                              True, splits=splits, seed=3, shuffle=True)
+        current_folder = os.getcwd()
+        os.chdir(self.folder)
+        try:
+            DatasetBuilder.convert_to_single_file('data', 'relative', True, splits=splits,
+                                                  seed=3, shuffle=True)
+        finally:
+            os.chdir(current_folder)
+        for name in ('train_data.npy', 'train_labels.npy', 'test_data.npy'):
+            self.assertTrue(numpy.array_equal(numpy.load(self.path('absolute', name)),
+                                              numpy.load(self.path('relative', name))))
+
+    def test_shards_of_nested_folders(self):
+        from dataset_reader import DatasetReader
+        make_image_tree(self.path('data'), ('cats', os.path.join('dogs', 'small')), 3, 8, 8, 3)
+        DatasetBuilder.convert_to_shards(self.path('data'), self.path('shards'), shard_size=4)
+        make_image_tree(self.path('data'), ('birds',), 2, 8, 8, 2)
+        DatasetBuilder.convert_to_shards(self.path('data'), self.path('shards'), shard_size=4,
+                                         append=True)
+        reader = DatasetReader(self.path('shards'))
+        self.assertEqual(reader.label_names, ['cats', 'dogs/small', 'birds'])
+        self.assertEqual(len(reader), 8)
+        _, labels = reader[0:8]
+        self.assertEqual(labels.tolist(), [0, 0, 0, 1, 1, 1, 2, 2])
+
+    def test_convert_palette_and_transparent_images(self):
+        from PIL import Image
+        os.makedirs(self.path('source', 'cats'))
+        palette = Image.new('P', (8, 8))
+        palette.putpalette([0, 0, 0, 200, 30, 40] + [0] * 762)
+        palette.paste(1, (0, 0, 8, 8))
+        palette.save(self.path('source', 'cats', 'palette.png'))
+        Image.new('RGBA', (8, 8), (200, 30, 40, 0)).save(self.path('source', 'cats',
+                                                                   'transparent.png'))
+        DatasetBuilder.convert_format(self.path('source'), self.path('jpg'), new_extension='.jpg')
+        DatasetBuilder.convert_format(self.path('source'), self.path('png'), new_extension='.png')
+        # palette: the colors are kept (not the indices), transparency: white background
+        for name, color in (('palette', (200, 30, 40)), ('transparent', (255, 255, 255))):
+            image = DatasetBuilder.decode_image(self.path('jpg', 'cats', name + '.jpg'))
+            self.assertLess(abs(image[4, 4].astype(int) - color).max(), 8)
+        image = DatasetBuilder.decode_image(self.path('png', 'cats', 'palette.png'))
+        self.assertEqual(tuple(image[4, 4]), (200, 30, 40))
+        image = DatasetBuilder.decode_image(self.path('png', 'cats', 'transparent.png'), None)
+        self.assertEqual(image.shape, (8, 8, 4))
+
+
+if __name__ == '__main__':
+    unittest.main()
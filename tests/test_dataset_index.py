@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+""" Tests of the index of the dataset folders (incremental listing, hidden folders)"""
+
+from __future__ import print_function
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import dataset_index
+from dataset_index import DatasetIndex
+
+
+class DatasetIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        for name in ('cats/1.png', 'cats/2.jpg', 'dogs/1.png', 'dogs/small/1.png',
+                     '.blobs/ab/ab12.png', 'dogs/.thumbnails/1.png', 'notes.txt'):
+            self.touch(name)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def touch(self, name):
+        path = os.path.join(self.folder, name)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        open(path, 'w').close()
+
+    def age_folders(self, past=1000000000):
+        """ move the modification time of the folders to the past (the folders
+            modified during the last second are always listed again)"""
+        for folder, _, _ in os.walk(self.folder):
+            os.utime(folder, (past, past))
+
+    def test_hidden_subfolders_are_skipped(self):
+        index = DatasetIndex(self.folder)
+        index.refresh()
+        self.assertEqual(index.subfolders(), ['cats', 'dogs', os.path.join('dogs', 'small')])
+        self.assertEqual([(relative.replace(os.sep, '/'), name)
+                          for relative, name, _ in index.files()],
+                         [('cats', '1.png'), ('cats', '2.jpg'), ('dogs', '1.png'),
+                          ('dogs/small', '1.png')])
+        self.assertEqual([name for _, name, _ in index.files(('.txt',))], ['notes.txt'])
+
+    def test_listing_without_scandir(self):
+        expected = DatasetIndex.list_folder(os.path.join(self.folder, 'dogs'))
+        self.assertEqual(expected, (['1.png'], ['small']))
+        scandir = dataset_index.scandir
+        dataset_index.scandir = None  # python < 3.5
+        try:
+            self.assertEqual(DatasetIndex.list_folder(os.path.join(self.folder, 'dogs')),
+                             expected)
+        finally:
+            dataset_index.scandir = scandir
+
+    def test_only_modified_folders_are_listed_again(self):
+        index = DatasetIndex(self.folder)
+        self.age_folders()
+        self.assertEqual(index.refresh(), 4)
+        index.save()  # modifies the root folder
+        self.assertEqual(index.refresh(), 1)
+        self.age_folders()
+        index = DatasetIndex(self.folder)  # loaded from .dataset_index.json
+        self.assertEqual(index.refresh(), 0)
+        self.assertFalse(index.changed)
+        self.touch('cats/3.png')
+        self.assertEqual(index.refresh(), 1)
+        self.assertTrue(index.changed)
+        self.assertIn(('cats', '3.png', '.png'), index.files())
+        self.age_folders()
+        shutil.rmtree(os.path.join(self.folder, 'dogs', 'small'))
+        self.assertEqual(index.refresh(), 2)  # cats (aged again) and dogs
+        self.assertEqual(index.subfolders(), ['cats', 'dogs'])
+
+    def test_folders_modified_recently_are_listed_again(self):
+        index = DatasetIndex(self.folder)
+        index.refresh()
+        self.touch('cats/3.png')  # within the same second: the mtime may not change
+        index.refresh()
+        self.assertIn(('cats', '3.png', '.png'), index.files())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+""" Tests of the memory-mapped reader of the datasets written by DatasetBuilder"""
+
+from __future__ import print_function
+import os
+import sys
+import pickle
+import shutil
+import tempfile
+import unittest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from benchmarks.fixtures import make_image_tree
+from dataset_builder import DatasetBuilder
+from dataset_reader import DatasetReader
+
+
+class DatasetReaderTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.folder = tempfile.mkdtemp()
+        make_image_tree(cls.folder + '/images', ('cats', 'dogs'), 10, 8, 8, 10)
+        DatasetBuilder.convert_to_single_file(cls.folder + '/images', cls.folder + '/single',
+                                              create_labels_file=True)
+        DatasetBuilder.convert_to_shards(cls.folder + '/images', cls.folder + '/shards',
+                                         shard_size=6)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.folder)
+
+    def test_single_file(self):
+        import numpy as np
+        reader = DatasetReader(self.folder + '/single')
+        data = np.load(self.folder + '/single/data.npy')
+        labels = np.load(self.folder + '/single/labels.npy')
+        self.assertEqual(len(reader), 20)
+        self.assertEqual(sorted(reader.label_names), ['cats', 'dogs'])
+        image, label = reader[-1]
+        self.assertTrue(np.array_equal(image, data[19]))
+        self.assertEqual(label, labels[19])
+        images, batch_labels = reader[4:12]
+        self.assertIsInstance(images, np.memmap)  # a view on the file, not a copy
+        self.assertTrue(np.array_equal(images, data[4:12]))
+        self.assertTrue(np.array_equal(batch_labels, labels[4:12]))
+        images, batch_labels = reader[[3, 0, -1]]
+        self.assertTrue(np.array_equal(images, data[[3, 0, 19]]))
+        with self.assertRaises(IndexError):
+            reader[20]
+
+    def test_shards_give_the_same_samples(self):
+        import numpy as np
+        single = DatasetReader(self.folder + '/single')
+        shards = DatasetReader(self.folder + '/shards')
+        self.assertEqual(len(shards), 20)
+        self.assertEqual([shard['count'] for shard in shards.shards], [6, 6, 6, 2])
+        for item in (slice(0, 20), slice(5, 13), slice(1, 19, 3), [19, 6, 5, 0]):
+            self.assertTrue(np.array_equal(shards[item][0], single[item][0]))
+            self.assertTrue(np.array_equal(shards[item][1], single[item][1]))
+
+    def test_workers(self):
+        import numpy as np
+        reader = DatasetReader(self.folder + '/shards')
+        reader[0]  # open the files before sending the reader to a worker
+        copy = pickle.loads(pickle.dumps(reader))
+        self.assertIsNone(copy.arrays)
+        self.assertLess(len(pickle.dumps(reader)), 4096)  # the arrays are not pickled
+        ranges = [reader.worker_range(worker, 3) for worker in range(3)]
+        self.assertEqual(ranges, [(0, 7), (7, 14), (14, 20)])
+        images = [images for worker in range(3)
+                  for images, _ in copy.iter_batches(4, worker, 3)]
+        self.assertTrue(np.array_equal(np.concatenate(images), reader[0:20][0]))
+        batches = list(reader.iter_batches(8, shuffle=True, drop_last=True))
+        self.assertEqual([len(batch[0]) for batch in batches], [8, 8])
+
+
+if __name__ == '__main__':
+    unittest.main()
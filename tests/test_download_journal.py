@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+""" Tests of the download journal: concurrent writers and resumed downloads"""
+
+from __future__ import print_function
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from benchmarks.fixtures import ImageServer
+from download_journal import DownloadJournal
+from images_downloader import ImagesDownloader
+
+
+class DownloadJournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_two_journals_in_the_same_folder(self):
+        first = DownloadJournal(self.folder)
+        second = DownloadJournal(self.folder)
+        try:
+            second.connection.execute("PRAGMA busy_timeout = 100")  # fail fast if locked
+            first.add_pending([('cats', 'http://a/1.png', 'cats/1.png')])
+            first.mark_done('cats', 'http://a/1.png', 10, 'sum', 'cats/1.png')
+            second.add_pending([('dogs', 'http://a/2.png', 'dogs/2.png')])
+            second.mark_failed('dogs', 'http://a/2.png')
+            first.mark_failed('cats', 'http://a/3.png')
+            self.assertEqual(second.state('cats', 'http://a/1.png'),
+                             (DownloadJournal.DONE, 1, 'cats/1.png'))
+            self.assertEqual(first.state('dogs', 'http://a/2.png'),
+                             (DownloadJournal.FAILED, 1, 'dogs/2.png'))
+        finally:
+            first.close()
+            second.close()
+
+
+class ResumeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ImageServer(width=8, height=8).start()
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.folder)
+
+    def attempts(self, keyword, link):
+        journal = DownloadJournal(self.folder)
+        try:
+            return journal.state(keyword, link)[:2]
+        finally:
+            journal.close()
+
+    def test_rerun_skips_done_links_and_retries_failed_links(self):
+        failed = 'http://127.0.0.1:1/refused.png'
+        links = {'cats': [self.server.link_template.format(keyword='cats', index=index)
+                          for index in range(4)] + [failed]}
+        ImagesDownloader().download(links, self.folder, threads=2, max_retries=0)
+        self.assertEqual(self.server.requests, 4)
+        self.assertEqual(self.attempts('cats', failed), (DownloadJournal.FAILED, 1))
+        ImagesDownloader().download(links, self.folder, threads=2, max_retries=0)
+        self.assertEqual(self.server.requests, 4)  # done links skipped
+        self.assertEqual(self.attempts('cats', failed), (DownloadJournal.FAILED, 2))
+        ImagesDownloader().download(links, self.folder, threads=2, max_retries=0,
+                                    retry_failed=False)
+        self.assertEqual(self.attempts('cats', failed), (DownloadJournal.FAILED, 2))
+        # a done link whose file was deleted is restored from the blob store:
+        images = sorted(os.listdir(self.folder + '/cats'))
+        os.remove(self.folder + '/cats/' + images[0])
+        ImagesDownloader().download(links, self.folder, threads=2, max_retries=0)
+        self.assertEqual(sorted(os.listdir(self.folder + '/cats')), images)
+        self.assertEqual(self.server.requests, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+""" Tests of the download scheduler, retries and timeouts against a local HTTP server
+    that throttles (HTTP 429) and answers slowly"""
+
+from __future__ import print_function
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+try:
+    from http.server import BaseHTTPRequestHandler
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from benchmarks.fixtures import ThreadingServer, synthetic_png
+from host_scheduler import HostScheduler
+from images_downloader import ImagesDownloader
+
+
+class FlakyServer(object):
+    """ Local HTTP server serving a PNG image on every path, except:
+        /throttled/...: answers 429 (Retry-After: 0) to the first 'throttle' requests
+        /slow/...: waits 'latency' seconds before answering"""
+
+    def __init__(self, throttle=2, latency=1.0):
+        self.image = synthetic_png(8, 8)
+        self.throttle = throttle
+        self.latency = latency
+        self.requests = {}
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                with server.lock:
+                    server.requests[self.path] = server.requests.get(self.path, 0) + 1
+                    count = server.requests[self.path]
+                if self.path.startswith('/throttled/') and count <= server.throttle:
+                    self.send_response(429)
+                    self.send_header('Retry-After', '0')
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                if self.path.startswith('/slow/'):
+                    time.sleep(server.latency)
+                body = server.image + self.path.encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'image/png')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.http_server = ThreadingServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:' + str(self.http_server.server_address[1])
+        self.thread = threading.Thread(target=self.http_server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.http_server.shutdown()
+        self.http_server.server_close()
+
+
+def run_download(links, folder, timeout=30, **options):
+    """ run ImagesDownloader.download in a thread; return the downloader, or None if
+        the download did not finish within timeout seconds"""
+    downloader = ImagesDownloader()
+    worker = threading.Thread(target=downloader.download, args=(links, folder),
+                              kwargs=options)
+    worker.daemon = True
+    worker.start()
+    worker.join(timeout)
+    return None if worker.is_alive() else downloader
+
+
+class HostSchedulerTest(unittest.TestCase):
+
+    def test_limit_per_host(self):
+        scheduler = HostScheduler(max_per_host=2)
+        for index in range(3):
+            scheduler.put('a', index)
+        scheduler.put('b', 3)
+        scheduler.close()
+        jobs = [scheduler.get() for _ in range(3)]
+        self.assertEqual(sorted(host for host, _ in jobs), ['a', 'a', 'b'])
+        self.assertEqual(scheduler.active['a'], 2)
+        scheduler.done('a')
+        self.assertEqual(scheduler.get(), ('a', 2))
+
+    def test_throttled_host_is_slowed_down(self):
+        scheduler = HostScheduler(max_per_host=4, backoff_base=0.01)
+        scheduler.put('a', 0)
+        scheduler.put('a', 1)
+        scheduler.close()
+        host, _ = scheduler.get()
+        scheduler.done(host, throttled=True, retry_after=0.2)
+        self.assertEqual(scheduler.limits['a'], 2)
+        self.assertEqual(scheduler.throttled, 1)
+        start = time.time()
+        self.assertEqual(scheduler.get(), ('a', 1))
+        self.assertGreaterEqual(time.time() - start, 0.15)
+
+    def test_backoff_delay_grows(self):
+        scheduler = HostScheduler(backoff_base=1.0, backoff_max=300)
+        for attempt in range(5):
+            delay = scheduler.backoff_delay(attempt)
+            self.assertTrue(0.5 * 2 ** attempt <= delay <= 1.5 * 2 ** attempt)
+        self.assertLessEqual(scheduler.backoff_delay(20), 450)
+
+    def test_get_returns_none_when_done(self):
+        scheduler = HostScheduler()
+        scheduler.put('a', 0)
+        scheduler.close()
+        scheduler.get()
+        scheduler.done('a')
+        self.assertIsNone(scheduler.get())
+
+
+class DownloadRetryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FlakyServer(throttle=2, latency=1.0)
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.folder)
+
+    def test_throttled_links_are_retried(self):
+        links = {'cats': [self.server.url + '/throttled/' + str(index) + '.png'
+                          for index in range(3)]}
+        downloader = run_download(links, self.folder, threads=2, backoff_base=0.01,
+                                  max_retries=3)
+        self.assertIsNotNone(downloader)
+        self.assertEqual(downloader.failed_links, [])
+        self.assertEqual(downloader.retries, 6)
+        self.assertGreater(downloader.scheduler.throttled, 0)
+        self.assertEqual(len(os.listdir(self.folder + '/cats')), 3)
+
+    def test_too_many_throttles_fail(self):
+        links = {'cats': [self.server.url + '/throttled/0.png']}
+        downloader = run_download(links, self.folder, backoff_base=0.01, max_retries=1)
+        self.assertEqual(downloader.failed_links, links['cats'])
+        self.assertEqual(self.server.requests['/throttled/0.png'], 2)
+
+    def test_read_timeout(self):
+        links = {'cats': [self.server.url + '/slow/0.png', self.server.url + '/0.png']}
+        downloader = run_download(links, self.folder, threads=2, read_timeout=0.2,
+                                  backoff_base=0.01, max_retries=1)
+        self.assertEqual(downloader.failed_links, [self.server.url + '/slow/0.png'])
+        self.assertEqual(self.server.requests['/slow/0.png'], 2)
+
+    def test_malformed_links_do_not_block_the_workers(self):
+        links = {'cats': [self.server.url + '/café.png', 'http://127.0.0.1:port/1.png',
+                          self.server.url + '/2.png', self.server.url + '/3.png']}
+        downloader = run_download(links, self.folder, threads=2, max_retries=0)
+        self.assertIsNotNone(downloader)
+        self.assertEqual(downloader.failed_links, ['http://127.0.0.1:port/1.png'])
+        self.assertIn('/caf%C3%A9.png', self.server.requests)
+        with open(self.folder + '/failed_list.txt') as failed_file:
+            self.assertEqual(failed_file.read().split(), ['http://127.0.0.1:port/1.png'])
+
+    def test_unexpected_errors_fail_the_link(self):
+        downloader = ImagesDownloader()
+        read_image = downloader.read_image
+
+        def broken_read_image(response, output):
+            if response.url.endswith('/1.png'):
+                response.close()
+                raise ValueError("unexpected")
+            return read_image(response, output)
+
+        downloader.read_image = broken_read_image
+        links = {'cats': [self.server.url + '/' + str(index) + '.png' for index in range(4)]}
+        worker = threading.Thread(target=downloader.download, args=(links, self.folder),
+                                  kwargs={'threads': 2})
+        worker.daemon = True
+        worker.start()
+        worker.join(30)
+        self.assertFalse(worker.is_alive())
+        self.assertEqual(downloader.failed_links, [self.server.url + '/1.png'])
+        self.assertEqual(downloader.scheduler.running, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
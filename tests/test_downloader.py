@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+""" Tests of the concurrent downloads (global and per-host limits, failed links) and of
+    the rate limits of the crawler, against local servers and fake search engines"""
+
+from __future__ import print_function
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from benchmarks.fixtures import ImageServer
+from images_downloader import ImagesDownloader
+from rate_limiter import TokenBucket
+from web_crawler import WebCrawler
+
+
+class FakeClock(object):
+    """ clock of a TokenBucket: sleeping moves the time forward instantly"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class DownloadLimitsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.servers = [ImageServer(width=8, height=8, latency=0.1).start() for _ in range(2)]
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        for server in self.servers:
+            server.stop()
+        shutil.rmtree(self.folder)
+
+    def links(self, links_per_host=8):
+        return {'cats': [server.link_template.format(keyword='cats', index=100 * i + index)
+                         for index in range(links_per_host)
+                         for i, server in enumerate(self.servers)]}
+
+    def test_per_host_limit(self):
+        ImagesDownloader().download(self.links(), self.folder, threads=8, max_per_host=2)
+        self.assertEqual([server.max_active for server in self.servers], [2, 2])
+        self.assertEqual(len(os.listdir(self.folder + '/cats')), 16)
+
+    def test_global_limit(self):
+        links = {'cats': [self.servers[0].link_template.format(keyword='cats', index=index)
+                          for index in range(16)]}
+        ImagesDownloader().download(links, self.folder, threads=3, max_per_host=8)
+        self.assertEqual(self.servers[0].max_active, 3)
+        self.assertEqual(len(os.listdir(self.folder + '/cats')), 16)
+
+    def test_concurrent_downloads_are_faster(self):
+        start = time.time()
+        ImagesDownloader().download(self.links(4), self.folder + '/1', threads=1)
+        sequential = time.time() - start
+        start = time.time()
+        ImagesDownloader().download(self.links(4), self.folder + '/8', threads=8)
+        self.assertLess(time.time() - start, sequential / 2)
+
+    def test_failed_list(self):
+        failed = ['http://127.0.0.1:1/refused.png', 'ftp://127.0.0.1/unsupported.png']
+        links = self.links(2)
+        links['dogs'] = failed
+        downloader = ImagesDownloader()
+        downloader.download(links, self.folder, threads=4, max_retries=0)
+        with open(self.folder + '/failed_list.txt') as failed_file:
+            self.assertEqual(sorted(failed_file.read().split()), sorted(failed))
+        self.assertEqual(len(os.listdir(self.folder + '/cats')), 4)
+        ImagesDownloader().download(links, self.folder, retry_failed=False,
+                                    append_failed_list=True)
+        with open(self.folder + '/failed_list.txt') as failed_file:
+            self.assertEqual(len(failed_file.read().split()), 4)
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def test_rate(self):
+        clock = FakeClock()
+        bucket = TokenBucket(5, capacity=1, clock=clock.time, sleep=clock.sleep)
+        for _ in range(11):
+            bucket.acquire()
+        self.assertAlmostEqual(clock.now - 1000.0, 2.0)
+
+    def test_burst(self):
+        clock = FakeClock()
+        bucket = TokenBucket(2, capacity=4, clock=clock.time, sleep=clock.sleep)
+        for _ in range(4):
+            bucket.acquire()
+        self.assertEqual(clock.sleeps, [])
+        bucket.acquire()
+        self.assertAlmostEqual(clock.sleeps[0], 0.5)
+
+    def test_tokens_refill_while_idle(self):
+        clock = FakeClock()
+        bucket = TokenBucket(1, capacity=3, clock=clock.time, sleep=clock.sleep)
+        for _ in range(3):
+            bucket.acquire()
+        clock.now += 10  # idle: the bucket is full again, but not above its capacity
+        for _ in range(3):
+            bucket.acquire()
+        self.assertEqual(clock.sleeps, [])
+        bucket.acquire()
+        self.assertAlmostEqual(sum(clock.sleeps), 1.0)
+
+
+class CrawlerRateLimitTest(unittest.TestCase):
+
+    def test_engine_rate_limit(self):
+        crawler = WebCrawler({'fake': ('http://127.0.0.1/{keyword}/{index}.png', 0)})
+        start = time.time()
+        crawler.collect_links_from_web(['cats'], 1000, threads=8, rate_limits={'fake': 5})
+        elapsed = time.time() - start
+        self.assertEqual(len(crawler.images_links['cats']), 1000)
+        self.assertGreaterEqual(elapsed, 0.9)  # 10 pages: a burst of 5, then 5 per second
+
+    def test_concurrent_crawl_is_faster(self):
+        crawler = WebCrawler({'fake': ('http://127.0.0.1/{keyword}/{index}.png', 0.1)})
+        start = time.time()
+        crawler.collect_links_from_web(['cats', 'dogs'], 500, threads=10)
+        self.assertLess(time.time() - start, 0.6)  # 10 pages of 0.1s, fetched together
+        self.assertEqual(sorted(crawler.images_links), ['cats', 'dogs'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+""" Tests of the detection of exact and near-duplicate images"""
+
+from __future__ import print_function
+import os
+import sys
+import random
+import shutil
+import tempfile
+import unittest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from duplicates_detector import BKTree, DuplicatesDetector, hamming_distance
+
+
+def random_blocks(seed, size=64):
+    """ image of random gray blocks (8x8 blocks, so resizing keeps its structure)"""
+    from PIL import Image
+    rng = random.Random(seed)
+    image = Image.new('L', (8, 8))
+    image.putdata([rng.randint(0, 255) for _ in range(64)])
+    return image.resize((size, size), Image.NEAREST).convert('RGB')
+
+
+class DuplicatesDetectorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        for keyword in ('cats', 'dogs'):
+            os.makedirs(os.path.join(self.folder, keyword))
+        original = random_blocks(1)
+        original.save(self.path('cats', 'a.png'))
+        shutil.copy(self.path('cats', 'a.png'), self.path('cats', 'b.png'))
+        original.resize((48, 48)).save(self.path('cats', 'c.jpg'), quality=80)
+        random_blocks(2).save(self.path('cats', 'd.png'))
+        shutil.copy(self.path('cats', 'a.png'), self.path('dogs', 'e.png'))
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def path(self, *names):
+        return '/'.join((self.folder,) + names)
+
+    def test_exact_and_near_duplicates(self):
+        duplicates = DuplicatesDetector.find_duplicates(self.folder)
+        found = dict((duplicate, (original, distance))
+                     for duplicate, original, distance in duplicates)
+        self.assertEqual(sorted(found), [self.path('cats', 'b.png'), self.path('cats', 'c.jpg'),
+                                         self.path('dogs', 'e.png')])
+        self.assertEqual(found[self.path('cats', 'b.png')], (self.path('cats', 'a.png'), 0))
+        self.assertEqual(found[self.path('dogs', 'e.png')], (self.path('cats', 'a.png'), 0))
+        self.assertEqual(found[self.path('cats', 'c.jpg')][0], self.path('cats', 'a.png'))
+        self.assertLessEqual(found[self.path('cats', 'c.jpg')][1], 5)
+        exact = DuplicatesDetector.find_duplicates(self.folder, max_distance=0)
+        self.assertEqual(len(exact), 2)
+
+    def test_remove_duplicates_of_each_folder(self):
+        DuplicatesDetector.remove_duplicates(self.folder, across_folders=False, remove=True)
+        self.assertEqual(sorted(os.listdir(self.path('cats'))), ['a.png', 'd.png'])
+        self.assertEqual(os.listdir(self.path('dogs')), ['e.png'])
+        with open(self.path('duplicates.txt')) as report:
+            self.assertEqual(len(report.readlines()), 2)
+
+    def test_bk_tree_matches_brute_force(self):
+        rng = random.Random(0)
+        hashes = [rng.getrandbits(64) for _ in range(300)]
+        hashes += [image_hash ^ (1 << rng.randint(0, 63)) for image_hash in hashes[:50]]
+        tree = BKTree()
+        for i, image_hash in enumerate(hashes):
+            tree.add(image_hash, i)
+        for query in hashes[:20] + [rng.getrandbits(64) for _ in range(20)]:
+            expected = sorted((hamming_distance(query, image_hash), i)
+                              for i, image_hash in enumerate(hashes)
+                              if hamming_distance(query, image_hash) <= 20)
+            self.assertEqual(sorted(tree.search(query, 20)), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+""" Tests of the recognition of the images from their first bytes"""
+
+from __future__ import print_function
+import os
+import sys
+import unittest
+from io import BytesIO
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from image_sniffer import ImageSniffer, InvalidImage
+
+
+def encode(image_format, width=40, height=30, **options):
+    """ encoded image of width x height pixels"""
+    from PIL import Image
+    output = BytesIO()
+    Image.new('RGB', (width, height), (200, 30, 40)).save(output, format=image_format,
+                                                           **options)
+    return output.getvalue()
+
+
+class ImageSnifferTest(unittest.TestCase):
+
+    formats = [('JPEG', '.jpg', {}), ('PNG', '.png', {}), ('GIF', '.gif', {}),
+               ('WEBP', '.webp', {}), ('WEBP', '.webp', {'lossless': True})]
+
+    def test_formats_and_dimensions(self):
+        sniffer = ImageSniffer(min_width=40, min_height=30)
+        for image_format, extension, options in self.formats:
+            data = encode(image_format, **options)
+            self.assertEqual(sniffer.check(data, complete=True), extension)
+            self.assertEqual(ImageSniffer.image_size(data), (40, 30))
+
+    def test_too_small_images(self):
+        sniffer = ImageSniffer(min_width=41)
+        for image_format, _, options in self.formats:
+            with self.assertRaises(InvalidImage):
+                sniffer.check(encode(image_format, **options), complete=True)
+
+    def test_html_error_pages(self):
+        sniffer = ImageSniffer()
+        for page in (b'<!DOCTYPE html><html><body>404 Not Found</body></html>',
+                     b'<html>', b'\xef\xbb\xbf<?xml version="1.0"?>', b''):
+            with self.assertRaises(InvalidImage):
+                sniffer.check(page, complete=True)
+
+    def test_truncated_headers(self):
+        sniffer = ImageSniffer(min_width=1, min_height=1)
+        data = encode('PNG')
+        # not enough bytes yet: wait for the next chunk
+        self.assertIsNone(sniffer.check(data[:8]))
+        self.assertIsNone(sniffer.check(data[:20]))
+        self.assertIsNone(ImageSniffer.image_size(data[:20]))
+        self.assertIsNone(sniffer.check(encode('JPEG')[:20]))  # before the start of frame
+        # whole content too short to be recognized
+        with self.assertRaises(InvalidImage):
+            sniffer.check(b'\x89PN', complete=True)
+        with self.assertRaises(InvalidImage):
+            sniffer.check(b'RIFF\x00\x00\x00\x00WEB', complete=True)
+        # recognized, but without dimensions: the image is kept
+        self.assertEqual(sniffer.check(data[:20], complete=True), '.png')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+""" Tests of the LinkStore and of the incremental reading of json links files"""
+
+from __future__ import print_function
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from link_store import LinkStore, iter_json_links
+from web_crawler import WebCrawler
+
+
+class LinkStoreTest(unittest.TestCase):
+
+    links = {'cats': ['http://a/1.png', 'http://a/2.png?size="big"'],
+             'café "noir"': ['http://b/café.jpg', 'http://b/back\\slash.jpg'],
+             'empty': []}
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def path(self, name):
+        return os.path.join(self.folder, name)
+
+    def write(self, name, text):
+        with open(self.path(name), 'w') as links_file:
+            links_file.write(text)
+        return self.path(name)
+
+    def test_json_round_trip_into_a_link_store(self):
+        crawler = WebCrawler({})
+        crawler.images_links = self.links
+        crawler.save_urls_to_json(self.path('links.json'))
+        store = LinkStore(self.path('links.db'))
+        try:
+            WebCrawler({}, link_store=store).load_urls_from_json(self.path('links.json'))
+            self.assertEqual(store.count(), 4)
+            for keyword in ('cats', 'café "noir"'):
+                self.assertEqual(list(store[keyword]), self.links[keyword])
+            self.assertFalse('empty' in store)
+        finally:
+            store.close()
+
+    def test_escaped_strings_across_chunks(self):
+        filename = self.write('links.json', json.dumps(self.links))
+        expected = [(keyword, link) for keyword, links in self.links.items() for link in links]
+        for chunk_size in (1, 2, 3, 7, 64 * 1024):  # strings and escapes cut by the chunks
+            self.assertEqual(sorted(iter_json_links(filename, chunk_size)), sorted(expected))
+
+    def test_whitespaces_and_empty_files(self):
+        filename = self.write('links.json', ' {\n "cats" : [ "http://a/1.png" ,\n'
+                                            '"http://a/2.png" ] , "dogs":[ ] }\n')
+        self.assertEqual(list(iter_json_links(filename, 4)),
+                         [('cats', 'http://a/1.png'), ('cats', 'http://a/2.png')])
+        self.assertEqual(list(iter_json_links(self.write('empty.json', '{}'))), [])
+
+    def test_truncated_file(self):
+        text = json.dumps({'cats': ['http://a/1.png', 'http://a/2.png']})
+        for end in (len(text) - 1, len(text) - 3, text.index('2.png'), 1, 0):
+            filename = self.write('truncated.json', text[:end])
+            with self.assertRaises(ValueError):
+                list(iter_json_links(filename, 5))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+""" Tests of the cache of the search result pages"""
+
+from __future__ import print_function
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from search_cache import SearchCache
+from search_engines import FakeEngine, register_engine
+from web_crawler import WebCrawler
+
+
+@register_engine
+class CountingEngine(FakeEngine):
+    """ Fake engine counting the pages it fetches"""
+
+    name = 'fake_counting'
+    items_per_page = 10
+    pages = []
+
+    def fetch_page(self, keyword, page, items_per_page):
+        CountingEngine.pages.append((keyword, page))
+        return FakeEngine.fetch_page(self, keyword, page, items_per_page)
+
+
+class SearchCacheTest(unittest.TestCase):
+
+    template = 'http://127.0.0.1/{keyword}/{index}.png'
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.cache = SearchCache(os.path.join(self.folder, 'cache.db'))
+        CountingEngine.pages = []
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.folder)
+
+    def crawl(self, number_links, template=None):
+        crawler = WebCrawler({'fake_counting': (template or self.template, 0)}, self.cache)
+        crawler.collect_links_from_web(['cats'], number_links)
+        return list(crawler.images_links['cats'])
+
+    def test_extended_crawl_only_fetches_the_new_pages(self):
+        links = self.crawl(20)
+        self.assertEqual(sorted(CountingEngine.pages), [('cats', 0), ('cats', 1)])
+        self.assertEqual(self.crawl(20), links)
+        self.assertEqual(len(CountingEngine.pages), 2)
+        self.assertEqual(len(self.crawl(40)), 40)
+        self.assertEqual(sorted(CountingEngine.pages),
+                         [('cats', 0), ('cats', 1), ('cats', 2), ('cats', 3)])
+        self.assertEqual(self.cache.hits, 4)
+
+    def test_other_request_parameters_are_not_shared(self):
+        self.crawl(10)
+        links = self.crawl(10, 'http://127.0.0.2/{keyword}/{index}.png')
+        self.assertEqual(len(CountingEngine.pages), 2)
+        self.assertTrue(links[0].startswith('http://127.0.0.2/'))
+
+    def test_expiration_and_eviction(self):
+        self.cache.set('engine', 'cats', 0, 10, ['a'])
+        self.assertEqual(self.cache.get('engine', 'cats', 0, 10), ['a'])
+        self.assertIsNone(self.cache.get('engine', 'cats', 0, 20))
+        self.cache.ttl = 0.05
+        time.sleep(0.1)
+        self.assertIsNone(self.cache.get('engine', 'cats', 0, 10))
+        self.cache.clear_expired()
+        self.assertEqual(self.cache.count, 0)
+        self.cache.ttl = None
+        self.cache.max_entries = 3
+        for page in range(5):
+            self.cache.set('engine', 'cats', page, 10, [str(page)])
+            time.sleep(0.01)
+        self.assertEqual(self.cache.count, 3)
+        self.assertIsNone(self.cache.get('engine', 'cats', 1, 10))  # least recently used
+        self.assertEqual(self.cache.get('engine', 'cats', 4, 10), ['4'])
+
+
+if __name__ == '__main__':
+    unittest.main()
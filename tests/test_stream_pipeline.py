@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+""" Tests of the streaming pipeline against a local image server and fake search engines"""
+
+from __future__ import print_function
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from benchmarks.fixtures import ImageServer
+from search_engines import FakeEngine, register_engine
+from web_crawler import WebCrawler
+from stream_pipeline import StreamingPipeline, ArraySink
+from dataset_reader import DatasetReader
+
+
+class QuotaError(Exception):
+    pass
+
+
+@register_engine
+class QuotaEngine(FakeEngine):
+    """ Fake engine failing after its first page (e.g. quota exceeded)"""
+
+    name = 'fake_quota'
+    items_per_page = 10
+
+    def fetch_page(self, keyword, page, items_per_page):
+        if page > 0:
+            raise QuotaError("quota exceeded")
+        return FakeEngine.fetch_page(self, keyword, page, items_per_page)
+
+
+class StreamingPipelineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ImageServer(width=16, height=16).start()
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.folder)
+
+    def test_array_sink_writes_shards(self):
+        crawler = WebCrawler({'fake': (self.server.link_template, 0)})
+        sink = ArraySink(self.folder, shard_size=8)
+        pipeline = StreamingPipeline(crawler, sink, threads=4)
+        self.assertEqual(pipeline.run(['cats', 'dogs'], 10), 20)
+        reader = DatasetReader(self.folder)
+        self.assertEqual(len(reader), 20)
+        self.assertEqual([shard['count'] for shard in reader.shards], [8, 8, 4])
+        self.assertEqual(sorted(reader.label_names), ['cats', 'dogs'])
+        images, labels = reader[0:20]
+        self.assertEqual(images.shape, (20, 16, 16, 3))
+        self.assertEqual(sorted(set(labels.tolist())), [0, 1])
+
+    def test_crawler_errors_are_raised(self):
+        crawler = WebCrawler({'fake_quota': (self.server.link_template, 0)})
+        pipeline = StreamingPipeline(crawler, ArraySink(self.folder, shard_size=4), threads=2)
+        self.assertRaises(QuotaError, pipeline.run, ['cats'], 30)
+        self.assertEqual(len(DatasetReader(self.folder)), 10)  # first page stored
+
+
+if __name__ == '__main__':
+    unittest.main()
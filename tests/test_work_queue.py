@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+""" Tests of the distributed download mode (WorkQueue leases)"""
+
+from __future__ import print_function
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from benchmarks.fixtures import ImageServer
+from images_downloader import ImagesDownloader
+from work_queue import WorkQueue
+
+
+class WorkQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.queue = WorkQueue(self.folder + '/work_queue.db', lease_seconds=0.6)
+
+    def tearDown(self):
+        self.queue.close()
+        shutil.rmtree(self.folder)
+
+    def test_expired_lease_is_taken_over(self):
+        self.queue.populate({'cats': ['a', 'b', 'c']}, unit_size=2)
+        unit_id, keyword, links = self.queue.lease('worker1')
+        self.assertEqual((keyword, links), ('cats', ['a', 'b']))
+        self.assertEqual(self.queue.lease('worker2')[0], unit_id + 1)
+        self.assertIsNone(self.queue.lease('worker2'))
+        self.queue.connection.execute("UPDATE units SET lease_expires = 0 WHERE id = ?",
+                                      (unit_id,))
+        self.assertEqual(self.queue.lease('worker2')[0], unit_id)
+        self.assertFalse(self.queue.renew(unit_id, 'worker1'))
+        self.assertFalse(self.queue.complete(unit_id, 'worker1'))
+        self.assertTrue(self.queue.complete(unit_id, 'worker2'))
+
+    def test_lease_is_renewed_during_long_units(self):
+        server = ImageServer(width=8, height=8, latency=0.3).start()
+        try:
+            links = [server.link_template.format(keyword='cats', index=index)
+                     for index in range(5)]
+            self.queue.populate({'cats': links}, unit_size=5)
+
+            def download():
+                queue = WorkQueue(self.queue.filename, self.queue.lease_seconds)
+                ImagesDownloader().download_from_queue(queue, self.folder + '/images',
+                                                       'worker1', poll_interval=0.1, threads=1)
+                queue.close()
+
+            worker = threading.Thread(target=download)
+            worker.start()
+            time.sleep(1.0)  # the unit takes 1.5s, more than lease_seconds
+            other_queue = WorkQueue(self.queue.filename, self.queue.lease_seconds)
+            self.assertIsNone(other_queue.lease('worker2'))
+            other_queue.close()
+            worker.join(30)
+            self.assertEqual(self.queue.progress()[WorkQueue.DONE], 1)
+            self.assertEqual(len(os.listdir(self.folder + '/images/cats')), 5)
+        finally:
+            server.stop()
+
+if __name__ == '__main__':
+    unittest.main()
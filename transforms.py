@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+""" Transforms: image operations that can be chained with DatasetBuilder.pipeline"""
+
+from __future__ import print_function
+import numpy as np
+from dataset_builder import DatasetBuilder
+
+
+class Transform(object):
+    """ Base class of the transforms: take an image array and return the transformed array"""
+
+    def __call__(self, image):
+        return image
+
+    def batch(self, images):
+        """ transform a batch of images of the same shape (N x H x W [x C] array).
+            Image by image by default, the subclasses use vectorized operations
+            when NumPy is faster than the image library"""
+        return np.array([self(image) for image in images])
+
+    def __repr__(self):
+        params = ', '.join(key + '=' + repr(value) for key, value in sorted(vars(self).items()))
+        return self.__class__.__name__ + '(' + params + ')'
+
+
+class Resize(Transform):
+    """ Resize the images to height x width"""
+
+    def __init__(self, height=128, width=128):
+        self.height = height
+        self.width = width
+
+    def __call__(self, image):
+        return DatasetBuilder.resize_image(image, self.height, self.width)
+
+    def batch(self, images):
+        return DatasetBuilder.resize_batch(images, self.height, self.width)
+
+
+class CenterCrop(Transform):
+    """ Center crop the images to height x width"""
+
+    def __init__(self, height=128, width=128):
+        self.height = height
+        self.width = width
+
+    def __call__(self, image):
+        return DatasetBuilder.crop_image(image, self.height, self.width)
+
+    def batch(self, images):
+        return DatasetBuilder.crop_batch(images, self.height, self.width)
+
+
+class Grayscale(Transform):
+    """ Convert the images to grayscale"""
+
+    def __call__(self, image):
+        return DatasetBuilder.grayscale_image(image)
+
+    def batch(self, images):
+        return DatasetBuilder.grayscale_batch(images)
+
+
+class Normalize(Transform):
+    """ Convert the images to float32 and normalize them: (image - mean) / std
+        (default: values between 0 and 1). Use it before saving arrays, not image files"""
+
+    def __init__(self, mean=0.0, std=255.0):
+        self.mean = mean
+        self.std = std
+
+    def __call__(self, image):
+        return DatasetBuilder.normalize_image(image, self.mean, self.std)
+
+    def batch(self, images):
+        return DatasetBuilder.normalize_image(images, self.mean, self.std)
+
+
+class Format(Transform):
+    """ Save the images in another format (e.g. '.png').
+        The image itself is not modified, only the extension of the output file"""
+
+    def __init__(self, extension='.jpg'):
+        self.extension = extension
+
+    def batch(self, images):
+        return images
@@ -2,11 +2,24 @@
 """ WebCrawler: fetch images from various search engines and download them"""
 
 from __future__ import print_function
-from math import ceil
 import sys
 import os
 import json
+import threading
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
 import images_downloader
+from rate_limiter import TokenBucket
+from search_engines import ENGINES, get_engine_class
+from link_store import LinkStore
+from metrics import registry
+
+try:
+    basestring
+except NameError:  # python 3
+    basestring = str
 
 __author__ = "Amine BENDAHMANE (@AmineHorseman)"
 __email__ = "bendahmane.amine@gmail.com"
@@ -15,20 +28,30 @@ __date__ = "May 2nd, 2016"
 
 
 class WebCrawler(object):
-    """ Fetch images from various search engines and download them"""
-    search_engines = ['google', 'flickr']
+    """ Fetch images from various search engines and download them.
+        The search engines are the ones registered in search_engines.py"""
     api_keys = []
-    images_links = {}
     keywords = ''
 
-    def __init__(self, api_keys):
+    def __init__(self, api_keys, cache=None, link_store=None):
+        """ api_keys: {engine: (key, secret)}
+            cache: SearchCache storing the result pages (optional)
+            link_store: LinkStore keeping the links on disk instead of in memory (optional)"""
         for engine, _ in api_keys.items():
-            if engine not in self.search_engines:
+            if get_engine_class(engine) is None:
                 error_msg = "Search engine " + engine + \
                             " not supported. Please use only the following engines: "
-                error_msg += ', '.join(self.search_engines)
+                error_msg += ', '.join(sorted(ENGINES))
                 self.error(error_msg)
         self.api_keys = api_keys
+        self.cache = cache
+        self.engines = {}
+        self.images_links = link_store if link_store is not None else {}
+
+    @property
+    def search_engines(self):
+        """ names of the supported search engines"""
+        return sorted(ENGINES)
 
     @staticmethod
     def error(msg):
@@ -37,11 +60,9 @@ class WebCrawler(object):
         exit()
 
 
-    def collect_links_from_web(self, keywords, number_links_per_engine,
-                               remove_duplicated_links=False):
-        """ Crawl search engines to collect images links matching a list of keywords.
-            Each keyword is processed seperately."""
-        # validate params:
+    def check_keywords(self, keywords, number_links_per_engine):
+        """ Validate the crawling parameters, return the list of keywords
+            and the number of links per engine"""
         number_links = int(number_links_per_engine)
         if number_links <= 0:
             print("Warning: number_links_per_engine must be positive, \
@@ -52,6 +73,63 @@ class WebCrawler(object):
         elif isinstance(keywords, basestring):
             keywords = [keywords]
         self.keywords = [keywords]
+        return keywords, number_links
+
+    def get_engine(self, engine, engines, keys=None):
+        """ Return the search engine instance stored in engines, create it if needed"""
+        if keys is None:
+            keys = self.api_keys[engine]
+        engine_key = (engine, keys[0], keys[1])
+        if engine_key not in engines:
+            engine_class = get_engine_class(engine)
+            if engine_class is None:
+                self.error("Search engine " + engine + " not supported")
+            engines[engine_key] = engine_class(keys[0], keys[1])
+        return engines[engine_key]
+
+    def fetch_page(self, engine, keyword, page, items_per_page, rate_limiter=None):
+        """ Return the links of a result page of a search engine instance,
+            from the cache if possible"""
+        if self.cache is not None:
+            links = self.cache.get(engine.cache_name(), keyword, page, items_per_page)
+            if links is not None:
+                registry.inc('crawl_cache_hits_total', engine=engine.name)
+                registry.stage_items('crawl', len(links))
+                return links
+        if rate_limiter is not None:
+            with registry.timer('crawl_rate_limit_wait_seconds', engine=engine.name):
+                rate_limiter.acquire()
+        registry.inc('crawl_pages_total', engine=engine.name)
+        try:
+            with registry.timer('crawl_page_seconds', engine=engine.name):
+                links = engine.fetch_page(keyword, page, items_per_page)
+        except Exception:  # the API clients raise their own exception types
+            registry.inc('crawl_errors_total', engine=engine.name)
+            raise
+        registry.inc('crawl_links_total', len(links), engine=engine.name)
+        registry.stage_items('crawl', len(links))
+        if self.cache is not None:
+            self.cache.set(engine.cache_name(), keyword, page, items_per_page, links)
+        return links
+
+    def collect_links_from_web(self, keywords, number_links_per_engine,
+                               remove_duplicated_links=False, threads=1, rate_limits=None):
+        """ Crawl search engines to collect images links matching a list of keywords.
+            Each keyword is processed seperately.
+            threads: number of result pages fetched at the same time (all keywords and
+                     engines together), each engine being limited by a token bucket
+                     and by its maximum number of simultaneous requests
+            rate_limits: maximum requests per second for each engine, e.g. {'google': 2}
+                         (default: the requests_per_second of each engine)"""
+        # validate params:
+        keywords, number_links = self.check_keywords(keywords, number_links_per_engine)
+
+        # fetch all the pages at the same time:
+        concurrent_links = None
+        if threads > 1:
+            with registry.stage('crawl'):
+                concurrent_links = self.collect_links_concurrently(keywords, number_links,
+                                                                   threads, rate_limits)
 
         # call methods for fetching image links in the selected search engines:
         print("Start fetching...")
@@ -59,11 +137,12 @@ class WebCrawler(object):
             print("\nFetching for '", keyword, "' images...")
             extracted_links = []
             for engine, keys in self.api_keys.items():
-                try:
-                    method = getattr(self, 'fetch_from_' + engine)
-                except AttributeError:
-                    self.error('funciton fetch_from_' + engine + '() not defined')
-                temporary_links = method(keyword, keys[0], keys[1], number_links)
+                if concurrent_links is not None:
+                    temporary_links = concurrent_links[(keyword, engine)]
+                else:
+                    with registry.stage('crawl'):
+                        temporary_links = list(self.iter_from_engine(engine, keyword, keys,
+                                                                     number_links))
                 extracted_links += temporary_links
                 print("\r >> ", len(temporary_links), " links extracted", end="\n")
 
@@ -77,135 +156,178 @@ class WebCrawler(object):
             # store the links into the global list:
             self.images_links[keyword] = extracted_links
 
+    def collect_links_concurrently(self, keywords, number_links, threads, rate_limits=None):
+        """ Fetch the result pages of all the keywords and engines with a pool of threads.
+            Return {(keyword, engine): links}, the links being in the same order
+            as with a serial crawl"""
+        rate_limits = rate_limits or {}
+        buckets = {}
+        slots = {}
+        tasks = Queue()
+        for engine in self.api_keys:
+            engine_class = get_engine_class(engine)
+            rate = rate_limits.get(engine, engine_class.requests_per_second)
+            buckets[engine] = TokenBucket(rate, capacity=max(1, rate))
+            slots[engine] = threading.Semaphore(engine_class.max_concurrency)
+        for keyword in keywords:
+            for engine in self.api_keys:
+                items_per_page, pages_nbr = get_engine_class(engine).count_pages(number_links)
+                for page in range(pages_nbr):
+                    tasks.put((keyword, engine, page, items_per_page))
+        pages_total = tasks.qsize()
+        for _ in range(threads):
+            tasks.put(None)  # one stop signal per worker
+        pages = {}
+        lock = threading.Lock()
+
+        def fetch_pages():
+            """ fetch pages until a stop signal is received (one engine instance per thread)"""
+            engines = {}
+            while True:
+                task = tasks.get()
+                if task is None:
+                    break
+                keyword, engine, page, items_per_page = task
+                try:
+                    with slots[engine]:
+                        links = self.fetch_page(self.get_engine(engine, engines), keyword,
+                                                page, items_per_page, buckets[engine])
+                except Exception as error:  # the API clients raise their own exception types
+                    print("\nWarning: failed to fetch page ", page + 1, " of '", keyword,
+                          "' from ", engine, ": ", error)
+                    links = []
+                with lock:
+                    pages[(keyword, engine, page)] = links
+                    print("\r >> ", len(pages), " / ", pages_total, " pages fetched...", end="")
+                    sys.stdout.flush()
+
+        print("Fetching ", pages_total, " pages with ", threads, " threads...")
+        workers = [threading.Thread(target=fetch_pages) for _ in range(threads)]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        for worker in workers:
+            worker.join()
+        print("")
+
+        links = {}
+        for keyword in keywords:
+            for engine in self.api_keys:
+                engine_links = []
+                page = 0
+                while (keyword, engine, page) in pages:
+                    engine_links += pages[(keyword, engine, page)]
+                    page += 1
+                links[(keyword, engine)] = engine_links[:number_links]
+        return links
+
+    def iter_links_from_web(self, keywords, number_links_per_engine,
+                            remove_duplicated_links=False):
+        """ Same as collect_links_from_web, but yield (keyword, link) pairs as soon as
+            each result page is received instead of storing the links"""
+        keywords, number_links = self.check_keywords(keywords, number_links_per_engine)
+        for keyword in keywords:
+            seen_links = set()
+            for engine, keys in self.api_keys.items():
+                for link in self.iter_from_engine(engine, keyword, keys, number_links):
+                    if remove_duplicated_links:
+                        if link in seen_links:
+                            continue
+                        seen_links.add(link)
+                    yield keyword, link
+
+    def iter_from_engine(self, engine, keyword, keys, number_links=50):
+        """ Yield images links from a search engine, page by page
+            (the engine instance and its API client are reused for the next keywords)"""
+        engine = self.get_engine(engine, self.engines, keys)
+
+        def fetch_page(keyword, page, items_per_page):
+            """ fetch the page through the cache"""
+            sys.stdout.flush()
+            return self.fetch_page(engine, keyword, page, items_per_page)
+
+        links_nbr = 0
+        for links in engine.iter_pages(keyword, number_links, fetch_page):
+            for link in links[:number_links - links_nbr]:
+                yield link
+            links_nbr += len(links)
+
     def fetch_from_google(self, keyword, api_key, engine_id, number_links=50):
         """Fetch images from google using API Key"""
-        items_per_page = 10 # max 10 for google api
-        if number_links < 10:
-            items_per_page = number_links
-        pages_nbr = int(ceil(number_links / items_per_page))
-        from googleapiclient.discovery import build  # no need to import the package if the user didn't choose google in the list ??!
-        links = []
-
-        # get first page and store:
-        print("Crawling Google Search Engine...")
-        service = build("customsearch", "v1", developerKey=api_key)
-        response = service.cse().list(q=keyword,
-                                      cx=engine_id,
-                                      searchType='image',
-                                      num=items_per_page,
-                                      fileType='jpg&img;png&img;bmp&img;gif&img',
-                                      fields='items/link, queries',
-                                     ).execute()
-        items = response['items']
-        for image in items:
-            links.append(image['link'])
-
-        # get next pages:
-        for i in range(1, pages_nbr):
-            sys.stdout.flush()
-            response = service.cse().list(q=keyword,
-                                          cx=engine_id,
-                                          searchType='image',
-                                          num=items_per_page,
-                                          fileType='jpg&img;png&img;bmp&img;gif&img',
-                                          fields='items/link, queries',
-                                          start=response['queries']['nextPage'][0]['startIndex'],
-                                         ).execute()
-            items = response['items']
-            for image in items:
-                links.append(image['link'])
+        links = list(self.iter_from_engine('google', keyword, (api_key, engine_id), number_links))
         print("\r >> ", len(links), " links extracted...", end="")
-
-        # store and reduce the number of images if too much:
         return links
 
     def fetch_from_flickr(self, keyword, api_key, api_secret, number_links=50):
         """ Fetch images from Flikr """
-        from flickrapi import FlickrAPI # we import flikcr API only if needed
-
-        # calculate number of pages:
-        if number_links < 200:
-            items_per_page = number_links
-        else:
-            items_per_page = 200   # max 200 for flikr
-        pages_nbr = int(ceil(number_links / items_per_page))
-        links = []
-
-        # get links from the first page:
-        print("Carwling Flickr Search...")
-        flickr = FlickrAPI(api_key, api_secret)
-        response = flickr.photos_search(api_key=api_key,
-                                        text=keyword,
-                                        per_page=items_per_page,
-                                        media='photos',
-                                        sort='relevance')
-        images = [im for im in list(response.iter()) if im.tag == 'photo']
-        for photo in images:
-            photo_url = "https://farm{0}.staticflickr.com/{1}/{2}_{3}.jpg". format(
-                photo.get('farm'), photo.get('server'), photo.get('id'), photo.get('secret'))
-            links.append(photo_url)
-        print(" >> ", len(links), " links extracted...", end="")
-
-        # get next pages:
-        for i in range(1, pages_nbr):
-            response = flickr.photos_search(api_key=api_key,
-                                            text=keyword,
-                                            per_page=items_per_page,
-                                            media='photos',
-                                            page = i + 1,  
-                                            sort='relevance')
-            images = [im for im in list(response.iter()) if im.tag == 'photo']
-            for photo in images:
-                link = "https://farm{0}.staticflickr.com/{1}/{2}_{3}.jpg". format(
-                    photo.get('farm'), photo.get('server'), photo.get('id'), photo.get('secret'))
-                links.append(link)
-            print("\r >> ", len(links), " links extracted...", end="")
-
-        # store and reduce the number of images if too much:
+        links = list(self.iter_from_engine('flickr', keyword, (api_key, api_secret), number_links))
+        print("\r >> ", len(links), " links extracted...", end="")
         return links
 
     def save_urls_to_json(self, filename):
-        """ Save links to disk """
+        """ Save links to disk (written keyword by keyword, link by link)"""
         folder, _ = os.path.split(filename)
-        if filename and not os.path.exists(folder):
+        if folder and not os.path.exists(folder):
             os.makedirs(folder)
         with open(filename, 'w') as links_file:
-            json.dump(self.images_links, links_file)
+            links_file.write('{')
+            for i, (keyword, links) in enumerate(self.images_links.items()):
+                links_file.write((', ' if i else '') + json.dumps(keyword) + ': [')
+                for j, link in enumerate(links):
+                    links_file.write((', ' if j else '') + json.dumps(link))
+                links_file.write(']')
+            links_file.write('}')
         print("\nLinks saved to '", filename, "'")
 
     def save_urls(self, filename):
-        """ Save links to disk """
+        """ Save links to disk (one 'keyword<TAB>link' per line)"""
         folder, _ = os.path.split(filename)
-        if filename and not os.path.exists(folder):
+        if folder and not os.path.exists(folder):
             os.makedirs(folder)
         with open(filename, 'w') as links_file:
-            for keyword in self.images_links:
-                for link in self.images_links[keyword]:
-                    links_file.write(link)
+            for keyword, links in self.images_links.items():
+                for link in links:
+                    links_file.write(keyword + '\t' + link + '\n')
         print("\nLinks saved to '", filename, "'")
 
     def load_urls(self, filename):
-        """ Load links from a file"""
+        """ Load links from a file (one 'keyword<TAB>link' per line, or only one link
+            per line, in which case the links are stored under the keyword 'images')"""
         if not os.path.isfile(filename):
             self.error("Failed to load URLs, file '" + filename + "' does not exist")
-        with open(filename) as links_file:
-            self.images_links['images'] = []
-            for link in links_file:
-                self.images_links['images'].append(link)
+        if isinstance(self.images_links, LinkStore):
+            self.images_links.import_text(filename)
+        else:
+            with open(filename) as links_file:
+                for line in links_file:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    if '\t' in line:
+                        keyword, link = line.split('\t', 1)
+                    else:
+                        keyword, link = 'images', line
+                    self.images_links.setdefault(keyword, []).append(link)
         print("\nLinks loaded from ", filename)
 
     def load_urls_from_json(self, filename):
-        """ Load links from a json file"""
+        """ Load links from a json file (read incrementally into the LinkStore if the
+            crawler has one, loaded in memory otherwise)"""
         if not os.path.isfile(filename):
             self.error("Failed to load URLs, file '" + filename + "' does not exist")
-        with open(filename) as links_file:
-            self.images_links = json.load(links_file)
+        if isinstance(self.images_links, LinkStore):
+            self.images_links.import_json(filename)
+        else:
+            with open(filename) as links_file:
+                self.images_links = json.load(links_file)
         print("\nLinks loaded from ", filename)
 
-    def download_images(self, target_folder='./data'):
-        """ Download images and store them in the specified folder """
+    def download_images(self, target_folder='./data', **download_options):
+        """ Download images and store them in the specified folder
+            download_options are passed to ImagesDownloader.download
+            (threads, max_per_host, pool_size, idle_timeout...)"""
         print(" ")
         downloader = images_downloader.ImagesDownloader()
         if not target_folder:
             target_folder = './data'
-        downloader.download(self.images_links, target_folder)
+        downloader.download(self.images_links, target_folder, **download_options)
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+""" WorkQueue: share the links to download between several workers (processes or nodes)"""
+
+from __future__ import print_function
+import os
+import json
+import socket
+import sqlite3
+import time
+from itertools import groupby
+from operator import itemgetter
+from link_store import iter_json_links
+
+
+class WorkQueue(object):
+    """ SQLite table of work units (a keyword and a list of links). A worker leases a unit
+        for lease_seconds, downloads it and marks it as done. If the worker dies, its
+        lease expires and the unit is given to another worker.
+        The database file must be reachable by all the workers (same machine or shared disk)"""
+
+    PENDING = 'pending'
+    LEASED = 'leased'
+    DONE = 'done'
+
+    def __init__(self, filename='./work_queue.db', lease_seconds=600):
+        folder, _ = os.path.split(filename)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        self.filename = filename
+        self.lease_seconds = lease_seconds
+        self.connection = sqlite3.connect(filename, timeout=60, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS units ("
+                                "id INTEGER PRIMARY KEY, keyword TEXT, links TEXT, "
+                                "state TEXT, worker TEXT, lease_expires REAL, "
+                                "attempts INTEGER DEFAULT 0)")
+
+    @staticmethod
+    def default_worker_id():
+        """ host name and process id"""
+        return socket.gethostname() + ':' + str(os.getpid())
+
+    def populate(self, images_links, unit_size=100):
+        """ split the links ({keyword: links}, LinkStore or (keyword, links) pairs) into
+            units of unit_size links.
+            Nothing is added if the queue already has units (so every worker can call it).
+            Return the number of units"""
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            count = self.connection.execute("SELECT COUNT(*) FROM units").fetchone()[0]
+            if count == 0:
+                items = images_links.items() if hasattr(images_links, 'items') else images_links
+                for keyword, links in items:
+                    unit = []
+                    for link in links:
+                        unit.append(link)
+                        if len(unit) >= unit_size:
+                            self.add_unit(keyword, unit)
+                            unit = []
+                    if unit:
+                        self.add_unit(keyword, unit)
+                count = self.connection.execute("SELECT COUNT(*) FROM units").fetchone()[0]
+            self.connection.execute("COMMIT")
+        except Exception:
+            self.connection.execute("ROLLBACK")
+            raise
+        return count
+
+    def populate_from_json(self, filename, unit_size=100):
+        """ split the links of a json file (see WebCrawler.save_urls_to_json) into units,
+            reading the file incrementally"""
+        pairs = groupby(iter_json_links(filename), key=itemgetter(0))
+        return self.populate(((keyword, (link for _, link in group)) for keyword, group in pairs),
+                             unit_size)
+
+    def add_unit(self, keyword, links):
+        """ insert a pending unit (inside a transaction)"""
+        self.connection.execute("INSERT INTO units (keyword, links, state) VALUES (?, ?, ?)",
+                                (keyword, json.dumps(links), self.PENDING))
+
+    def lease(self, worker_id):
+        """ lease a pending unit (or a unit whose lease expired) to the worker.
+            Return (unit_id, keyword, links), or None if no unit is available"""
+        now = time.time()
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.connection.execute("SELECT id, keyword, links FROM units WHERE state = ? "
+                                          "OR (state = ? AND lease_expires < ?) "
+                                          "ORDER BY id LIMIT 1",
+                                          (self.PENDING, self.LEASED, now)).fetchone()
+            if row is not None:
+                self.connection.execute("UPDATE units SET state = ?, worker = ?, "
+                                        "lease_expires = ?, attempts = attempts + 1 "
+                                        "WHERE id = ?",
+                                        (self.LEASED, worker_id, now + self.lease_seconds,
+                                         row[0]))
+            self.connection.execute("COMMIT")
+        except Exception:
+            self.connection.execute("ROLLBACK")
+            raise
+        if row is None:
+            return None
+        return row[0], row[1], json.loads(row[2])
+
+    def renew(self, unit_id, worker_id):
+        """ extend the lease of a unit, return False if the unit is not leased
+            to the worker anymore"""
+        cursor = self.connection.execute("UPDATE units SET lease_expires = ? WHERE id = ? AND "
+                                         "worker = ? AND state = ?",
+                                         (time.time() + self.lease_seconds, unit_id,
+                                          worker_id, self.LEASED))
+        return cursor.rowcount > 0
+
+    def complete(self, unit_id, worker_id):
+        """ mark a unit as done, return False if the unit is not leased to the worker
+            anymore (its lease expired and another worker took it)"""
+        cursor = self.connection.execute("UPDATE units SET state = ?, lease_expires = NULL "
+                                         "WHERE id = ? AND worker = ? AND state = ?",
+                                         (self.DONE, unit_id, worker_id, self.LEASED))
+        return cursor.rowcount > 0
+
+    def progress(self):
+        """ number of units in each state"""
+        rows = self.connection.execute("SELECT state, COUNT(*) FROM units GROUP BY state")
+        counts = {self.PENDING: 0, self.LEASED: 0, self.DONE: 0}
+        counts.update(dict(rows.fetchall()))
+        return counts
+
+    def close(self):
+        """ close the database"""
+        self.connection.close()